@@ -0,0 +1,379 @@
+"""
+In-memory stand-in for the parts of the Motor API the app uses.
+
+It is deliberately small: single-process, no transactions, and only the query
+and update operators that the repositories issue. An optional per-operation
+latency emulates network round trips so that changes in the number of round
+trips show up in benchmark results.
+"""
+import asyncio
+import copy
+
+from bson import ObjectId, Timestamp
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+
+def _get(document, path):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _compare(value, operator, operand):
+    if operator == '$eq':
+        return (value is _MISSING and operand is None) or value == operand
+    if operator == '$ne':
+        return not _compare(value, '$eq', operand)
+    if operator == '$in':
+        return any(_compare(value, '$eq', candidate) for candidate in operand)
+    if operator == '$nin':
+        return not _compare(value, '$in', operand)
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    raise NotImplementedError(f"Unsupported query operator {operator}")
+
+
+def matches(document, query):
+    for key, condition in query.items():
+        if key == '$and':
+            if not all(matches(document, sub) for sub in condition):
+                return False
+            continue
+        if key == '$or':
+            if not any(matches(document, sub) for sub in condition):
+                return False
+            continue
+        value = _get(document, key)
+        if isinstance(condition, dict) and condition and all(op.startswith('$') for op in condition):
+            if not all(_compare(value, op, operand) for op, operand in condition.items()):
+                return False
+        elif not _compare(value, '$eq', condition):
+            return False
+    return True
+
+
+def _project(document, projection):
+    if document is None or not projection:
+        return copy.deepcopy(document)
+    included = {key for key, flag in projection.items() if flag}
+    if included:
+        result = {key: document[key] for key in included if key in document}
+        if projection.get('_id', 1) and '_id' in document:
+            result['_id'] = document['_id']
+        return copy.deepcopy(result)
+    return copy.deepcopy({key: value for key, value in document.items() if projection.get(key, 1)})
+
+
+def _apply_update(document, update, inserting=False):
+    for operator, fields in update.items():
+        if operator == '$set':
+            document.update(copy.deepcopy(fields))
+        elif operator == '$setOnInsert':
+            if inserting:
+                document.update(copy.deepcopy(fields))
+        elif operator == '$unset':
+            for key in fields:
+                document.pop(key, None)
+        elif operator == '$inc':
+            for key, amount in fields.items():
+                document[key] = document.get(key, 0) + amount
+        elif operator in ('$max', '$min'):
+            pick = max if operator == '$max' else min
+            for key, value in fields.items():
+                document[key] = pick(document[key], value) if key in document else copy.deepcopy(value)
+        else:
+            raise NotImplementedError(f"Unsupported update operator {operator}")
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._results = None
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = key_or_list if isinstance(key_or_list, list) else [(key_or_list, direction)]
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _materialize(self):
+        documents = [doc for doc in self._collection._documents.values() if matches(doc, self._query)]
+        for key, direction in reversed(self._sort):
+            documents.sort(key=lambda doc: (_get(doc, key) is _MISSING, _get(doc, key)), reverse=direction < 0)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(doc, self._projection) for doc in documents]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            await self._collection._round_trip()
+            self._results = iter(self._materialize())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        await self._collection._round_trip()
+        results = self._materialize()
+        return results if length is None else results[:length]
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._documents = {}
+        self._indexes = {}
+
+    async def _round_trip(self):
+        if self.database.client.latency:
+            await asyncio.sleep(self.database.client.latency)
+
+    def with_options(self, **kwargs):
+        return self
+
+    def _check_unique(self, document, ignore_id=None):
+        unique_keys = [
+            (list(index['key'].keys()), index.get('partialFilterExpression'))
+            for index in self._indexes.values() if index.get('unique')
+        ]
+        for keys, partial in unique_keys:
+            if partial and not matches(document, partial):
+                continue
+            values = [_get(document, key) for key in keys]
+            for other in self._documents.values():
+                if other['_id'] == ignore_id or (partial and not matches(other, partial)):
+                    continue
+                if [_get(other, key) for key in keys] == values:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}", 11000)
+
+    def _insert(self, document):
+        document.setdefault('_id', ObjectId())
+        if document['_id'] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name}", 11000)
+        self._check_unique(document)
+        self._documents[document['_id']] = copy.deepcopy(document)
+
+    def _first(self, query, sort=None):
+        if sort:
+            cursor = FakeCursor(self, query, None).sort(sort).limit(1)
+            documents = cursor._materialize()
+            return self._documents[documents[0]['_id']] if documents else None
+        _id = query.get('_id')
+        if _id is not None and not isinstance(_id, dict):
+            document = self._documents.get(_id)
+            return document if document is not None and matches(document, query) else None
+        return next((doc for doc in self._documents.values() if matches(doc, query)), None)
+
+    async def create_indexes(self, indexes):
+        for index in indexes:
+            self._indexes[index.document['name']] = dict(index.document)
+        return [index.document['name'] for index in indexes]
+
+    async def create_index(self, keys, **kwargs):
+        return kwargs.get('name', '_'.join(f"{key}_{direction}" for key, direction in keys))
+
+    async def drop_index(self, name):
+        self._indexes.pop(name, None)
+
+    async def index_information(self):
+        return copy.deepcopy(self._indexes)
+
+    async def find_one(self, query=None, projection=None, sort=None, **kwargs):
+        await self._round_trip()
+        return _project(self._first(query or {}, sort), projection)
+
+    def find(self, query=None, projection=None, **kwargs):
+        return FakeCursor(self, query or {}, projection)
+
+    async def insert_one(self, document, **kwargs):
+        await self._round_trip()
+        self._insert(document)
+        return InsertOneResult(document['_id'], True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        await self._round_trip()
+        inserted, errors = [], []
+        for index, document in enumerate(documents):
+            try:
+                self._insert(document)
+                inserted.append(document['_id'])
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"nInserted": len(inserted), "writeErrors": errors})
+        return InsertManyResult(inserted, True)
+
+    async def _update(self, query, update, upsert, many=False):
+        matched = [doc for doc in self._documents.values() if matches(doc, query)]
+        if not many:
+            matched = matched[:1]
+        for document in matched:
+            _apply_update(document, update)
+        upserted_id = None
+        if not matched and upsert:
+            document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            _apply_update(document, update, inserting=True)
+            self._insert(document)
+            upserted_id = document['_id']
+        return len(matched), upserted_id
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        await self._round_trip()
+        matched, upserted_id = await self._update(query, update, upsert)
+        return UpdateResult({"n": matched or int(upserted_id is not None), "nModified": matched,
+                             "upserted": upserted_id}, True)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        await self._round_trip()
+        matched, upserted_id = await self._update(query, update, upsert, many=True)
+        return UpdateResult({"n": matched, "nModified": matched, "upserted": upserted_id}, True)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        await self._round_trip()
+        document = self._first(query, sort)
+        if document is None:
+            if not upsert:
+                return None
+            _, upserted_id = await self._update(query, update, upsert=True)
+            return _project(self._documents[upserted_id], projection) if return_document else None
+        before = copy.deepcopy(document)
+        _apply_update(document, update)
+        return _project(document if return_document else before, projection)
+
+    async def find_one_and_delete(self, query, projection=None, sort=None, **kwargs):
+        await self._round_trip()
+        document = self._first(query, sort)
+        if document is None:
+            return None
+        del self._documents[document['_id']]
+        return _project(document, projection)
+
+    async def delete_one(self, query, **kwargs):
+        await self._round_trip()
+        document = self._first(query)
+        if document is not None:
+            del self._documents[document['_id']]
+        return DeleteResult({"n": int(document is not None)}, True)
+
+    async def delete_many(self, query, **kwargs):
+        await self._round_trip()
+        ids = [doc['_id'] for doc in self._documents.values() if matches(doc, query)]
+        for _id in ids:
+            del self._documents[_id]
+        return DeleteResult({"n": len(ids)}, True)
+
+    async def count_documents(self, query, **kwargs):
+        await self._round_trip()
+        return sum(1 for doc in self._documents.values() if matches(doc, query))
+
+    async def estimated_document_count(self, **kwargs):
+        await self._round_trip()
+        return len(self._documents)
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name, *args, **kwargs):
+        await self['$cmd']._round_trip()
+        return {"ok": 1.0}
+
+
+class FakeSession:
+    """Causally consistent session stub: times come from the client's logical clock."""
+
+    def __init__(self, client):
+        self.client = client
+        self.operation_time = Timestamp(client._clock, 1)
+        self.cluster_time = {"clusterTime": self.operation_time}
+        self.advanced_to = None
+
+    def advance_cluster_time(self, cluster_time):
+        self.cluster_time = cluster_time
+
+    def advance_operation_time(self, operation_time):
+        self.advanced_to = operation_time
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeMongoClient:
+    def __init__(self, latency_ms: float = 0):
+        self.latency = latency_ms / 1000.0
+        self._databases = {}
+        self._clock = 0
+        self.sessions = 0
+
+    async def start_session(self, causal_consistency=None, **kwargs):
+        self._clock += 1
+        self.sessions += 1
+        return FakeSession(self)
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self, name)
+        return self._databases[name]
+
+    @property
+    def admin(self):
+        return self['admin']
+
+    def close(self):
+        pass
@@ -0,0 +1,313 @@
+"""
+Throughput and latency benchmarks for the auth hot paths.
+
+Drives the real FastAPI app from src/run.py in-process through httpx's ASGI
+transport, backed by the in-memory Mongo stand-in (default) or a real mongod.
+
+    python -m benchmarks.run_benchmarks --concurrency 32 --requests 2000 --output bench.json
+    python -m benchmarks.run_benchmarks --compare bench.json --fail-threshold 10
+    python -m benchmarks.run_benchmarks --mongodb-uri mongodb://localhost:27017 --drop-database
+
+Results are written as JSON so runs can be compared against each other.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+import uuid
+from datetime import UTC, datetime
+
+# The app refuses to sign tokens without keys; benchmarks don't need real ones.
+os.environ.setdefault('ACCESS_TOKEN_SECRET_KEY', 'benchmark-access-secret')
+os.environ.setdefault('REFRESH_TOKEN_SECRET_KEY', 'benchmark-refresh-secret')
+os.environ.setdefault('ALGORITHM', 'HS256')
+
+import httpx
+from fastapi import Depends
+
+from benchmarks.fake_mongo import FakeMongoClient
+from src.router.api import get_current_user_id
+from src.run import create_app
+from src.services.hashing_service import PasswordHasher, hashing_pool
+
+SCENARIOS = ('register', 'login', 'refresh_token', 'update_password', 'authenticated')
+PASSWORDS = ('BenchPass123', 'BenchPass456')
+BASE_URL = 'http://benchmark'
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    to_ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": to_ms(sum(ordered) / len(ordered)) if ordered else 0.0,
+            "p50": to_ms(percentile(ordered, 0.50)),
+            "p95": to_ms(percentile(ordered, 0.95)),
+            "p99": to_ms(percentile(ordered, 0.99)),
+            "max": to_ms(ordered[-1]) if ordered else 0.0,
+        },
+    }
+
+
+def _cookie_from(response, name):
+    for header in response.headers.get_list('set-cookie'):
+        key, _, rest = header.partition('=')
+        if key.strip() == name:
+            return rest.split(';', 1)[0]
+    return None
+
+
+class Benchmark:
+    def __init__(self, app, client, args):
+        self.app = app
+        self.client = client
+        self.args = args
+        self.run_id = uuid.uuid4().hex[:8]
+        self.users = []
+
+    async def seed_users(self, count):
+        """Insert `count` users directly, sharing one hash so seeding doesn't dominate the run."""
+        hashed = PasswordHasher.hash_password(PASSWORDS[0])
+        emails = [f"bench-{self.run_id}-user{i}@example.com" for i in range(len(self.users), len(self.users) + count)]
+        await self.app.state.container.user_repository.insert_many_users(
+            [{"email": email, "password": hashed} for email in emails]
+        )
+        self.users.extend(emails)
+        return emails
+
+    async def login(self, email, password=PASSWORDS[0]):
+        response = await self.client.post('/api/login/', json={"email": email, "password": password})
+        response.raise_for_status()
+        return response.json()["access_token"], _cookie_from(response, 'refresh_token')
+
+    # Each scenario returns (setup, operation). setup(worker) builds per-worker
+    # state; operation(state, i) performs request number i and reports success.
+
+    def scenario_register(self):
+        async def setup(worker):
+            return None
+
+        async def operation(state, i):
+            response = await self.client.post('/api/register/', json={
+                "email": f"bench-{self.run_id}-new{i}@example.com", "password": PASSWORDS[0]
+            })
+            return response.status_code == 201
+        return setup, operation
+
+    def scenario_login(self):
+        async def setup(worker):
+            return (await self.seed_users(1))[0]
+
+        async def operation(email, i):
+            response = await self.client.post('/api/login/', json={"email": email, "password": PASSWORDS[0]})
+            return response.status_code == 200
+        return setup, operation
+
+    def scenario_refresh_token(self):
+        async def setup(worker):
+            email = (await self.seed_users(1))[0]
+            _, refresh_token = await self.login(email)
+            return {"refresh_token": refresh_token}
+
+        async def operation(state, i):
+            response = await self.client.post(
+                '/api/refresh_token/', headers={"Cookie": f"refresh_token={state['refresh_token']}"}
+            )
+            if response.status_code != 200:
+                return False
+            state["refresh_token"] = _cookie_from(response, 'refresh_token')
+            return True
+        return setup, operation
+
+    def scenario_update_password(self):
+        async def setup(worker):
+            email = (await self.seed_users(1))[0]
+            access_token, _ = await self.login(email)
+            return {"access_token": access_token, "current": 0}
+
+        async def operation(state, i):
+            current, new = state["current"], 1 - state["current"]
+            response = await self.client.post(
+                '/api/update_password/',
+                json={"current_password": PASSWORDS[current], "new_password": PASSWORDS[new]},
+                headers={"Authorization": f"Bearer {state['access_token']}"},
+            )
+            if response.status_code != 200:
+                return False
+            # Changing the password revokes earlier access tokens; continue with the new one.
+            state["access_token"] = response.json()["access_token"]
+            state["current"] = new
+            return True
+        return setup, operation
+
+    def scenario_authenticated(self):
+        async def setup(worker):
+            email = (await self.seed_users(1))[0]
+            access_token, _ = await self.login(email)
+            return {"Authorization": f"Bearer {access_token}"}
+
+        async def operation(headers, i):
+            response = await self.client.get('/_bench/whoami', headers=headers)
+            return response.status_code == 200
+        return setup, operation
+
+    async def run_scenario(self, name):
+        setup, operation = getattr(self, f"scenario_{name}")()
+        states = [await setup(worker) for worker in range(self.args.concurrency)]
+        counter = iter(range(self.args.requests))
+        latencies = []
+        errors = 0
+
+        async def worker(state):
+            nonlocal errors
+            for i in counter:
+                started = time.perf_counter()
+                try:
+                    ok = await operation(state, i)
+                except Exception:
+                    ok = False
+                latencies.append(time.perf_counter() - started)
+                errors += not ok
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(state) for state in states))
+        return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def build_app(args):
+    if args.mongodb_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        mongo_client = AsyncIOMotorClient(args.mongodb_uri)
+    else:
+        mongo_client = FakeMongoClient(latency_ms=args.db_latency_ms)
+    app = create_app(mongo_client=mongo_client, database_name=args.database)
+
+    # A minimal authenticated route, so the token-validation dependency can be
+    # measured without the bcrypt work that update_password adds on top.
+    @app.get('/_bench/whoami')
+    async def whoami(user_id: str = Depends(get_current_user_id)):
+        return {"user_id": user_id}
+
+    return app, mongo_client
+
+
+async def run(args):
+    app, mongo_client = build_app(args)
+    results = {
+        "meta": {
+            "timestamp": datetime.now(UTC).isoformat(),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "backend": "mongod" if args.mongodb_uri else "in-memory",
+            "db_latency_ms": 0 if args.mongodb_uri else args.db_latency_ms,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "hashing_pool": {"kind": hashing_pool.kind, "max_workers": hashing_pool.max_workers},
+        },
+        "scenarios": {},
+    }
+
+    transport = httpx.ASGITransport(app=app)
+    try:
+        async with app.router.lifespan_context(app):
+            if not args.keep_rate_limits:
+                # Only this app's container is affected, not other apps in the process.
+                app.state.container.login_admission.enabled = False
+            async with httpx.AsyncClient(transport=transport, base_url=BASE_URL) as client:
+                benchmark = Benchmark(app, client, args)
+                for name in args.scenarios:
+                    print(f"Running {name} ...", file=sys.stderr)
+                    results["scenarios"][name] = await benchmark.run_scenario(name)
+    finally:
+        if args.mongodb_uri and args.drop_database:
+            await mongo_client.drop_database(args.database)
+    return results
+
+
+def compare(current, baseline, threshold):
+    """Print a side-by-side comparison; return the names of regressed scenarios."""
+    regressions = []
+    print(f"{'scenario':<18}{'rps':>10}{'base':>10}{'Δ%':>8}{'p95 ms':>10}{'base':>10}{'Δ%':>8}")
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        rps, base_rps = result["throughput_rps"], base["throughput_rps"]
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        rps_delta = (rps - base_rps) / base_rps * 100 if base_rps else 0.0
+        p95_delta = (p95 - base_p95) / base_p95 * 100 if base_p95 else 0.0
+        print(f"{name:<18}{rps:>10.1f}{base_rps:>10.1f}{rps_delta:>8.1f}{p95:>10.2f}{base_p95:>10.2f}{p95_delta:>8.1f}")
+        if rps_delta < -threshold or p95_delta > threshold:
+            regressions.append(name)
+    return regressions
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the auth hot paths of the user-management app.")
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=16, help="Concurrent virtual clients.")
+    parser.add_argument('--requests', type=int, default=500, help="Requests per scenario.")
+    parser.add_argument('--db-latency-ms', type=float, default=0.0,
+                        help="Simulated round-trip latency of the in-memory backend.")
+    parser.add_argument('--mongodb-uri', help="Run against a real mongod instead of the in-memory backend.")
+    parser.add_argument('--database', default='user-management-bench')
+    parser.add_argument('--drop-database', action='store_true', help="Drop the benchmark database afterwards.")
+    parser.add_argument('--keep-rate-limits', action='store_true', help="Leave login admission control enabled.")
+    parser.add_argument('--output', help="Write results as JSON to this path.")
+    parser.add_argument('--compare', help="Baseline JSON results to compare against.")
+    parser.add_argument('--fail-threshold', type=float, default=None,
+                        help="Exit non-zero if throughput drops or p95 grows by more than this percentage.")
+    parser.add_argument('--verbose', action='store_true', help="Keep application INFO logging.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if not args.verbose:
+        logging.disable(logging.INFO)
+
+    results = asyncio.run(run(args))
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+    print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.fail_threshold or 0.0)
+        if regressions and args.fail_threshold is not None:
+            print(f"Regressions: {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
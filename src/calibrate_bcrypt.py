@@ -0,0 +1,22 @@
+import argparse
+
+from src.configs.config import Config
+from src.services.hashing_service import MAX_BCRYPT_ROUNDS, MIN_BCRYPT_ROUNDS, calibrate_rounds
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pick the highest bcrypt cost under a target verify latency on this host.")
+    parser.add_argument('--target-ms', type=float, default=Config.BCRYPT_TARGET_VERIFY_MS,
+                        help="Maximum time one password check may take.")
+    parser.add_argument('--min-rounds', type=int, default=MIN_BCRYPT_ROUNDS)
+    parser.add_argument('--max-rounds', type=int, default=MAX_BCRYPT_ROUNDS)
+    return parser.parse_args(argv)
+
+def main(args):
+    rounds, timings = calibrate_rounds(args.target_ms, args.min_rounds, args.max_rounds)
+    for cost, elapsed_ms in timings.items():
+        print(f"cost {cost:>2}: {elapsed_ms:8.1f} ms per verify")
+    print(f"BCRYPT_ROUNDS={rounds}")
+    return rounds
+
+if __name__ == '__main__':
+    main(parse_args())
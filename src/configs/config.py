@@ -12,17 +12,110 @@ class Config:
     ACCESS_TOKEN_SECRET_KEY = os.getenv('ACCESS_TOKEN_SECRET_KEY')
     REFRESH_TOKEN_SECRET_KEY = os.getenv('REFRESH_TOKEN_SECRET_KEY')
     ALGORITHM = os.getenv('ALGORITHM')
+    JWT_KEY_RING_FILE = os.getenv('JWT_KEY_RING_FILE')
+    JWT_KEY_RING_RELOAD_SECONDS = float(os.getenv('JWT_KEY_RING_RELOAD_SECONDS', 30))
+    JWKS_MAX_AGE_SECONDS = int(os.getenv('JWKS_MAX_AGE_SECONDS', 300))
     ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv('ACCESS_TOKEN_EXPIRE_MINUTES', 15))
     REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv('REFRESH_TOKEN_EXPIRE_DAYS', 7))
     MONGODB_URI = os.getenv('MONGODB_URI', "mongodb://localhost:27017")
     IS_MONGO_LOCAL = os.getenv('IS_MONGO_LOCAL', 1)
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', 100))
+    MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', 0))
+    MONGO_MAX_IDLE_TIME_MS = int(os.getenv('MONGO_MAX_IDLE_TIME_MS') or 0) or None
+    MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS') or 0) or None
+    MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000))
+    MONGO_CONNECT_TIMEOUT_MS = int(os.getenv('MONGO_CONNECT_TIMEOUT_MS') or 0) or None
+    MONGO_SOCKET_TIMEOUT_MS = int(os.getenv('MONGO_SOCKET_TIMEOUT_MS') or 0) or None
+    MONGO_COMPRESSORS = os.getenv('MONGO_COMPRESSORS', '')  # e.g. "zstd,snappy,zlib"
+    MONGO_MONITORING_ENABLED = os.getenv('MONGO_MONITORING_ENABLED', 1)
+    # Read preference per operation: empty for the client's default (primary unless set in MONGODB_URI),
+    # or primary, primaryPreferred, secondary, secondaryPreferred or nearest.
+    MONGO_READ_PREFERENCE_PROFILE = os.getenv('MONGO_READ_PREFERENCE_PROFILE', '')
+    MONGO_READ_PREFERENCE_LOGIN = os.getenv('MONGO_READ_PREFERENCE_LOGIN', '')
+    MONGO_READ_PREFERENCE_LISTING = os.getenv('MONGO_READ_PREFERENCE_LISTING', '')
+    MONGO_MAX_STALENESS_SECONDS = int(os.getenv('MONGO_MAX_STALENESS_SECONDS', -1))  # -1: no bound, else >= 90
+    # Write concern per operation: empty for the client's default, a number of nodes, or "majority".
+    MONGO_WRITE_CONCERN_USER = os.getenv('MONGO_WRITE_CONCERN_USER', '')
+    MONGO_WRITE_CONCERN_PASSWORD = os.getenv('MONGO_WRITE_CONCERN_PASSWORD', '')
+    MONGO_WRITE_CONCERN_REFRESH_TOKEN = os.getenv('MONGO_WRITE_CONCERN_REFRESH_TOKEN', '')
+    MONGO_WRITE_CONCERN_TIMEOUT_MS = int(os.getenv('MONGO_WRITE_CONCERN_TIMEOUT_MS') or 0) or None
+    MONGO_CAUSAL_TOKEN_TTL_SECONDS = float(os.getenv('MONGO_CAUSAL_TOKEN_TTL_SECONDS', 120))
+    MONGO_CAUSAL_TOKEN_MAX_KEYS = int(os.getenv('MONGO_CAUSAL_TOKEN_MAX_KEYS', 100000))
     IS_STORAGE_LOCAL = os.getenv('IS_STORAGE_LOCAL', 1)
     ADMIN_EMAIL = os.getenv('ADMIN_EMAIL', "admin@example.com")
     QUEST_EMAIL = os.getenv('QUEST_EMAIL', "quest@example.com")
     ADMIN_PASSWORD = os.getenv('ADMIN_PASSWORD', "adminpass")
     QUEST_PASSWORD = os.getenv('QUEST_PASSWORD', "questpass")
     PORT = int(os.getenv('PORT', '8081'))
+    WEB_WORKERS = int(os.getenv('WEB_WORKERS', 1))
+    GRACEFUL_SHUTDOWN_SECONDS = int(os.getenv('GRACEFUL_SHUTDOWN_SECONDS', 30))
+    # Where workers share metrics snapshots, so any worker can serve /metrics for all of them.
+    # With several workers and no directory set, a temporary one is created at startup.
+    METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+    METRICS_SNAPSHOT_SECONDS = float(os.getenv('METRICS_SNAPSHOT_SECONDS', 5))
+    # Set by the multi-worker supervisor after it has seeded; not meant to be configured.
+    SKIP_STARTUP_SEEDING = os.getenv('SKIP_STARTUP_SEEDING', 0)
     LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 0)
+    PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))
+    PROFILING_INTERVAL_MS = float(os.getenv('PROFILING_INTERVAL_MS', 5))
+    PROFILING_MAX_STACKS = int(os.getenv('PROFILING_MAX_STACKS', 5000))
+    PROFILING_HEADER = os.getenv('PROFILING_HEADER', 'X-Profile')
+    READINESS_CACHE_SECONDS = float(os.getenv('READINESS_CACHE_SECONDS', 5))
+    READINESS_TIMEOUT_SECONDS = float(os.getenv('READINESS_TIMEOUT_SECONDS', 2))
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+    LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+    LOG_RATE_LIMIT_PER_MINUTE = int(os.getenv('LOG_RATE_LIMIT_PER_MINUTE', 60))
+    TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+    TOKEN_CACHE_MAX_TTL_SECONDS = int(os.getenv('TOKEN_CACHE_MAX_TTL_SECONDS', 300))
+    MAX_SESSIONS_PER_USER = int(os.getenv('MAX_SESSIONS_PER_USER', 10))
+    TOKEN_STORE_STATS_SECONDS = float(os.getenv('TOKEN_STORE_STATS_SECONDS', 60))
+    # Only honoured with WEB_WORKERS=1: the buffer is per process.
+    REFRESH_TOKEN_WRITE_BEHIND_ENABLED = os.getenv('REFRESH_TOKEN_WRITE_BEHIND_ENABLED', 0)
+    REFRESH_TOKEN_WRITE_BEHIND_INTERVAL_MS = float(os.getenv('REFRESH_TOKEN_WRITE_BEHIND_INTERVAL_MS', 50))
+    REFRESH_TOKEN_WRITE_BEHIND_BATCH_SIZE = int(os.getenv('REFRESH_TOKEN_WRITE_BEHIND_BATCH_SIZE', 500))
+    REFRESH_TOKEN_WRITE_BEHIND_MAX_BUFFER = int(os.getenv('REFRESH_TOKEN_WRITE_BEHIND_MAX_BUFFER', 10000))
+    USER_PURGE_ENABLED = os.getenv('USER_PURGE_ENABLED', 1)
+    USER_PURGE_RETENTION_DAYS = float(os.getenv('USER_PURGE_RETENTION_DAYS', 30))
+    USER_PURGE_INTERVAL_SECONDS = float(os.getenv('USER_PURGE_INTERVAL_SECONDS', 3600))
+    USER_PURGE_BATCH_SIZE = int(os.getenv('USER_PURGE_BATCH_SIZE', 500))
+    USER_PURGE_BATCH_PAUSE_SECONDS = float(os.getenv('USER_PURGE_BATCH_PAUSE_SECONDS', 1))
+    INTROSPECTION_API_KEY = os.getenv('INTROSPECTION_API_KEY', '')
+    INTROSPECTION_MAX_TOKENS = int(os.getenv('INTROSPECTION_MAX_TOKENS', 100))
+    INTROSPECTION_MAX_CACHE_SECONDS = int(os.getenv('INTROSPECTION_MAX_CACHE_SECONDS', 60))
+    INTROSPECTION_NEGATIVE_CACHE_SIZE = int(os.getenv('INTROSPECTION_NEGATIVE_CACHE_SIZE', 10000))
+    INTROSPECTION_NEGATIVE_TTL_SECONDS = float(os.getenv('INTROSPECTION_NEGATIVE_TTL_SECONDS', 60))
+    REVOCATION_SYNC_SECONDS = float(os.getenv('REVOCATION_SYNC_SECONDS', 5))
+    REVOCATION_BLOOM_CAPACITY = int(os.getenv('REVOCATION_BLOOM_CAPACITY', 100000))
+    REVOCATION_BLOOM_ERROR_RATE = float(os.getenv('REVOCATION_BLOOM_ERROR_RATE', 0.001))
+    # Only honoured with WEB_WORKERS=1: the cache is per process.
+    USER_CACHE_ENABLED = os.getenv('USER_CACHE_ENABLED', 1)
+    USER_CACHE_SIZE = int(os.getenv('USER_CACHE_SIZE', 10000))
+    USER_CACHE_TTL_SECONDS = float(os.getenv('USER_CACHE_TTL_SECONDS', 30))
+    USER_CACHE_NEGATIVE_TTL_SECONDS = float(os.getenv('USER_CACHE_NEGATIVE_TTL_SECONDS', 5))
+    # Login limits and the hashing pool below are for the whole server; each of the
+    # WEB_WORKERS processes gets an equal share.
+    LOGIN_RATE_LIMIT_ENABLED = os.getenv('LOGIN_RATE_LIMIT_ENABLED', 1)
+    LOGIN_EMAIL_RATE_PER_MINUTE = float(os.getenv('LOGIN_EMAIL_RATE_PER_MINUTE', 5))
+    LOGIN_EMAIL_BURST = int(os.getenv('LOGIN_EMAIL_BURST', 10))
+    LOGIN_IP_RATE_PER_MINUTE = float(os.getenv('LOGIN_IP_RATE_PER_MINUTE', 60))
+    LOGIN_IP_BURST = int(os.getenv('LOGIN_IP_BURST', 100))
+    LOGIN_LIMITER_MAX_KEYS = int(os.getenv('LOGIN_LIMITER_MAX_KEYS', 100000))
+    # Peers (addresses or networks, comma-separated, "*" for any) whose X-Forwarded-For is trusted for the client IP.
+    TRUSTED_PROXY_IPS = os.getenv('TRUSTED_PROXY_IPS', '127.0.0.1')
+    HASHING_POOL_KIND = os.getenv('HASHING_POOL_KIND', 'thread')  # 'thread' or 'process'
+    HASHING_POOL_WORKERS = int(os.getenv('HASHING_POOL_WORKERS', os.cpu_count() or 1))
+    HASHING_POOL_MAX_QUEUE = int(os.getenv('HASHING_POOL_MAX_QUEUE', 64))
+    BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', 12))
+    BCRYPT_CALIBRATE_ON_STARTUP = os.getenv('BCRYPT_CALIBRATE_ON_STARTUP', 0)
+    BCRYPT_TARGET_VERIFY_MS = float(os.getenv('BCRYPT_TARGET_VERIFY_MS', 250))
+    BCRYPT_REHASH_ON_LOGIN = os.getenv('BCRYPT_REHASH_ON_LOGIN', 1)
+    BULK_IMPORT_BATCH_SIZE = int(os.getenv('BULK_IMPORT_BATCH_SIZE', 1000))
+    BULK_IMPORT_WORKERS = int(os.getenv('BULK_IMPORT_WORKERS', os.cpu_count() or 1))
+    BULK_IMPORT_MAX_ERROR_DETAILS = int(os.getenv('BULK_IMPORT_MAX_ERROR_DETAILS', 1000))
+    BULK_IMPORT_PROGRESS_EVERY = int(os.getenv('BULK_IMPORT_PROGRESS_EVERY', 10000))
+    # Passwords per hashing pool task in web imports; bounds how long a login waits behind one.
+    BULK_IMPORT_POOL_CHUNK_SIZE = int(os.getenv('BULK_IMPORT_POOL_CHUNK_SIZE', 8))
 
     @classmethod
     def get_log_level(cls):
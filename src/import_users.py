@@ -0,0 +1,49 @@
+import argparse
+import asyncio
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from src.configs.config import Config
+from src.mongo_client import create_mongo_client, get_database
+from src.repository.user_repository import UserRepository
+from src.services.import_service import IMPORT_FORMATS, UserImportService, iter_file_lines, parse_records
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk-import users from an NDJSON or CSV file.")
+    parser.add_argument('path', help="File with one user per line (email, password).")
+    parser.add_argument('--format', choices=IMPORT_FORMATS, help="Input format (default: from file extension).")
+    parser.add_argument('--batch-size', type=int, default=Config.BULK_IMPORT_BATCH_SIZE)
+    parser.add_argument('--workers', type=int, default=Config.BULK_IMPORT_WORKERS)
+    parser.add_argument('--progress-every', type=int, default=Config.BULK_IMPORT_PROGRESS_EVERY)
+    return parser.parse_args(argv)
+
+async def main(args):
+    fmt = args.format or ('csv' if os.path.splitext(args.path)[1].lower() == '.csv' else 'ndjson')
+
+    mongo_client = create_mongo_client()
+    try:
+        user_repository = UserRepository(get_database(mongo_client))
+        await user_repository.ensure_indexes()
+
+        importer = UserImportService(
+            user_repository,
+            batch_size=args.batch_size,
+            workers=args.workers,
+            progress_every=args.progress_every,
+        )
+        logger.info("Importing users from %s (%s).", args.path, fmt)
+        # Outside the web app nothing else needs the CPUs, so hash on a process pool of our own.
+        with ProcessPoolExecutor(max_workers=args.workers) as executor:
+            report = await importer.import_users(parse_records(iter_file_lines(args.path), fmt), executor=executor)
+    finally:
+        mongo_client.close()
+
+    print(json.dumps(report.to_dict(), indent=2))
+    return report
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -1,17 +1,161 @@
+import atexit
+import json
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+
 from src.configs.config import Config
 
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# Pass as `extra=` to rate limit a warning an attacker can trigger at will.
+RATE_LIMITED = {'rate_limited': True}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for log shippers that index fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets through at most `per_minute` records per logger and message template in
+    each one-minute window and counts the rest. Templates, not rendered messages,
+    are the key, so "Import progress: %s rows read ..." is limited as a whole
+    however many different values it is logged with.
+
+    Only records up to `max_level` are limited, plus warnings logged with
+    `extra=RATE_LIMITED`, such as failed logins, which a credential-stuffing run
+    would otherwise turn into a flood. Errors always get through. At most `max_keys`
+    templates are tracked; windows that have ended are swept once a minute and,
+    beyond that, the oldest template is forgotten.
+    """
+
+    def __init__(self, per_minute: int, max_level: int = logging.INFO, max_keys: int = 10000):
+        super().__init__()
+        self.per_minute = per_minute
+        self.max_level = max_level
+        self.max_keys = max_keys
+        self._window = {}
+        self._lock = threading.Lock()
+        self._swept_at = time.monotonic()
+        self.suppressed = 0
+
+    def _sweep(self, now):
+        self._swept_at = now
+        for key in [key for key, (started, _, _) in self._window.items() if now - started >= 60]:
+            del self._window[key]
+
+    def filter(self, record):
+        if self.per_minute <= 0 or record.levelno >= logging.ERROR:
+            return True
+        if record.levelno > self.max_level and not getattr(record, 'rate_limited', False):
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            if now - self._swept_at >= 60:
+                self._sweep(now)
+            if key not in self._window and len(self._window) >= self.max_keys:
+                del self._window[next(iter(self._window))]
+            started, count, suppressed = self._window.get(key, (now, 0, 0))
+            if now - started >= 60:
+                if suppressed:
+                    # Carried on the first record of the new window, so the gap is visible in the logs.
+                    record.suppressed = suppressed
+                started, count, suppressed = now, 0, 0
+            if count >= self.per_minute:
+                self._window[key] = (started, count, suppressed + 1)
+                self.suppressed += 1
+                return False
+            self._window[key] = (started, count + 1, suppressed)
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    Hands records to the writer thread without blocking. When the bounded queue
+    is full the record is dropped and counted rather than stalling the event loop.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record can cross the queue as
+        # is: message formatting and interpolation happen on the writer thread.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _SuppressedNote(logging.Filter):
+    def filter(self, record):
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+class LoggingPipeline:
+    def __init__(self, queue_size: int, log_format: str, rate_limit_per_minute: int):
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = DroppingQueueHandler(self.queue)
+        self.rate_limit = RateLimitFilter(rate_limit_per_minute)
+        self.handler.addFilter(self.rate_limit)
+
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(JsonFormatter() if log_format == 'json' else logging.Formatter(TEXT_FORMAT))
+        stream_handler.addFilter(_SuppressedNote())
+        self.listener = QueueListener(self.queue, stream_handler, respect_handler_level=True)
+        self._started = False
+
+    def start(self):
+        if not self._started:
+            self.listener.start()
+            self._started = True
+
+    def stop(self):
+        """Flush queued records and join the writer thread."""
+        if self._started:
+            self.listener.stop()
+            self._started = False
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_limit.suppressed,
+        }
+
+
+logging_pipeline = LoggingPipeline(Config.LOG_QUEUE_SIZE, Config.LOG_FORMAT, Config.LOG_RATE_LIMIT_PER_MINUTE)
+atexit.register(logging_pipeline.stop)
+
+
 def setup_logger(name=__name__):
     logger = logging.getLogger(name)
     logger.setLevel(Config.get_log_level())
 
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(Config.get_log_level())
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    console_handler.setFormatter(formatter)
-
     # Avoid adding multiple handlers if logger is already configured
     if not logger.handlers:
-        logger.addHandler(console_handler)
+        logger.addHandler(logging_pipeline.handler)
+    logging_pipeline.start()
 
     return logger
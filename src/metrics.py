@@ -0,0 +1,424 @@
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format.
+
+Recording is deliberately lock-free: every update happens on the worker's event
+loop thread, where a plain increment cannot interleave with another one. Label
+children are cached, so the hot path is a dict lookup at import time and an
+increment or a bisect per observation.
+
+Each worker process keeps its own registry. A scrape reaches whichever worker
+accepted the connection, so with several workers `MultiprocessMetrics` shares
+snapshots through a directory and any worker serves all of them, each series
+labelled with its `worker`.
+"""
+import asyncio
+import functools
+import json
+import logging
+import math
+import os
+import time
+from bisect import bisect_left
+
+DEFAULT_LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *labelvalues):
+        child = self._children.get(labelvalues)
+        if child is None:
+            if len(labelvalues) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            child = self._children[labelvalues] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self):
+        samples = []
+        for labelvalues, child in self._children.items():
+            samples.extend(child.samples(self.name, list(zip(self.labelnames, labelvalues))))
+        return self.name, self.type, self.documentation, samples
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount=1.0):
+        self.value += amount
+
+    def samples(self, name, labels):
+        return [(name, labels, self.value)]
+
+
+class _GaugeChild(_CounterChild):
+    __slots__ = ()
+
+    def dec(self, amount=1.0):
+        self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name, labels):
+        samples = []
+        cumulative = 0
+        for bound, count in zip(self.bounds + (math.inf,), self.counts):
+            cumulative += count
+            samples.append((f"{name}_bucket", labels + [('le', _format_value(float(bound)))], cumulative))
+        samples.append((f"{name}_sum", labels, self.sum))
+        samples.append((f"{name}_count", labels, self.count))
+        return samples
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+
+class Gauge(_Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = {}
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def register_collector(self, key, collector):
+        """
+        Register a callable that returns `(name, documentation, samples)` tuples at
+        scrape time, where samples are `(labels, value)` pairs. Used to expose the
+        stats() of caches and pools without touching their hot paths. Registering
+        again under the same key replaces the previous collector.
+        """
+        self._collectors[key] = collector
+
+    def collect(self):
+        """Every metric family as `(name, type, documentation, samples)`, samples being `(name, labels, value)`."""
+        families = [metric.collect() for metric in self._metrics]
+        for collector in self._collectors.values():
+            for name, documentation, samples in collector():
+                families.append((
+                    name, 'gauge', documentation,
+                    [(name, sorted(labels.items()), value) for labels, value in samples],
+                ))
+        return families
+
+    def render(self):
+        return render_families(self.collect())
+
+
+def render_families(families):
+    lines = []
+    for name, type_, documentation, samples in families:
+        lines.append(f"# HELP {name} {documentation}")
+        lines.append(f"# TYPE {name} {type_}")
+        for sample_name, labels, value in samples:
+            lines.append(f"{sample_name}{_format_labels(labels)} {_format_value(value)}")
+    return '\n'.join(lines) + '\n'
+
+
+class MultiprocessMetrics:
+    """
+    Serves the metrics of all worker processes from whichever one is scraped.
+
+    Every worker writes a snapshot of its registry to `directory` every
+    `interval_seconds`, and on each scrape. A scrape merges all snapshots into
+    one family per metric, each sample labelled with the worker's pid, so
+    queries aggregate with e.g. `sum without (worker)`. Other workers' numbers
+    are up to `interval_seconds` old. Snapshots not refreshed for ten intervals
+    belong to workers that died and are removed.
+    """
+
+    def __init__(self, registry, directory: str, interval_seconds: float, worker: str = None):
+        self.registry = registry
+        self.directory = directory
+        self.interval_seconds = interval_seconds
+        self.worker = str(worker or os.getpid())
+        self.path = os.path.join(directory, f"{self.worker}.json")
+        self._task = None
+        self.stale_removed = 0
+
+    def write_snapshot(self):
+        families = [
+            (name, type_, documentation, [
+                (sample_name, list(labels) + [('worker', self.worker)], value)
+                for sample_name, labels, value in samples
+            ])
+            for name, type_, documentation, samples in self.registry.collect()
+        ]
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(families, f)
+        os.replace(temporary, self.path)
+
+    def render(self):
+        self.write_snapshot()
+        merged = {}
+        stale_before = time.time() - 10 * self.interval_seconds
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                if entry.path != self.path and entry.stat().st_mtime < stale_before:
+                    os.remove(entry.path)
+                    self.stale_removed += 1
+                    continue
+                with open(entry.path) as f:
+                    families = json.load(f)
+            except (OSError, ValueError):
+                # Removed or replaced by its worker while we were reading it.
+                continue
+            for name, type_, documentation, samples in families:
+                merged.setdefault(name, (type_, documentation, []))[2].extend(samples)
+        return render_families(
+            (name, type_, documentation, samples) for name, (type_, documentation, samples) in merged.items()
+        )
+
+    async def _snapshot_forever(self):
+        while True:
+            try:
+                self.write_snapshot()
+            except Exception as e:
+                logging.getLogger(__name__).warning("Error writing metrics snapshot: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._snapshot_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def stats_collector(prefix, stats, documentation):
+    """
+    Adapt a `stats()` method returning a (possibly nested) dict of numbers into a
+    collector. `{"hits": 3, "commands": {"find": {"count": 2}}}` becomes
+    `<prefix>_hits 3` and `<prefix>_commands_count{name="find"} 2`.
+    """
+    def collect():
+        families = {}
+        for key, value in stats().items():
+            if isinstance(value, dict):
+                for label, sub in value.items():
+                    if isinstance(sub, dict):
+                        for sub_key, sub_value in sub.items():
+                            families.setdefault(f"{prefix}_{key}_{sub_key}", []).append(({"name": label}, sub_value))
+                    else:
+                        families.setdefault(f"{prefix}_{key}", []).append(({"name": label}, sub))
+            else:
+                families.setdefault(f"{prefix}_{key}", []).append(({}, value))
+        return [
+            (name, documentation, [(labels, float(value)) for labels, value in samples])
+            for name, samples in families.items()
+            if all(isinstance(value, (int, float)) for _, value in samples)
+        ]
+    return collect
+
+
+class AsyncStatsPoller:
+    """
+    Refreshes stats that need I/O (e.g. collection counts) in the background, so
+    scrapes read the last snapshot instead of querying the database themselves.
+    """
+
+    def __init__(self, fetch, interval_seconds: float):
+        self.fetch = fetch
+        self.interval_seconds = interval_seconds
+        self._snapshot = {}
+        self._task = None
+        self.errors = 0
+
+    async def _poll_forever(self):
+        while True:
+            try:
+                self._snapshot = await self.fetch()
+            except Exception as e:
+                self.errors += 1
+                logging.getLogger(__name__).warning("Error polling stats: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._poll_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {**self._snapshot, "poll_errors": self.errors}
+
+
+def timed(histogram, *labelvalues):
+    """Decorator recording the wall-clock duration of an async function."""
+    child = histogram.labels(*labelvalues)
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await fn(*args, **kwargs)
+            finally:
+                child.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware recording per-route request counts, latencies and the
+    number of in-flight requests. The route label is the matched path template,
+    so cardinality is bounded by the number of routes.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        http_requests_in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec()
+            route = scope.get('route')
+            path = getattr(route, 'path', 'unmatched')
+            method = scope['method']
+            http_request_duration_seconds.labels(method, path).observe(elapsed)
+            http_requests_total.labels(method, path, str(status_code)).inc()
+
+
+registry = MetricsRegistry()
+
+http_requests_total = registry.counter(
+    'http_requests_total', 'HTTP requests by route and status.', ('method', 'route', 'status')
+)
+http_request_duration_seconds = registry.histogram(
+    'http_request_duration_seconds', 'HTTP request latency by route.', ('method', 'route')
+)
+http_requests_in_flight = registry.gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served.'
+).labels()
+db_operation_duration_seconds = registry.histogram(
+    'db_operation_duration_seconds', 'Repository method latency.', ('repository', 'operation')
+)
+password_hash_duration_seconds = registry.histogram(
+    'password_hash_duration_seconds', 'bcrypt execution time in the hashing pool.', ('operation',)
+)
+jwt_duration_seconds = registry.histogram(
+    'jwt_duration_seconds', 'JWT encode/decode time.', ('operation', 'token_type')
+)
+refresh_token_flush_duration_seconds = registry.histogram(
+    'refresh_token_flush_duration_seconds', 'Write-behind insert_many latency for refresh tokens.'
+).labels()
+refresh_token_flush_size = registry.histogram(
+    'refresh_token_flush_size', 'Refresh tokens written per write-behind flush.',
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500),
+).labels()
@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+
+from src.mongo_client import DATABASE_NAME, create_mongo_client, get_database
+from src.repository.user_repository import UserRepository
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Migrate users to soft delete. Run once every server runs a version with soft delete."
+    )
+    parser.add_argument('--database', default=DATABASE_NAME)
+    return parser.parse_args(argv)
+
+async def main(args):
+    mongo_client = create_mongo_client()
+    try:
+        user_repository = UserRepository(get_database(mongo_client, args.database))
+        await user_repository.ensure_indexes()
+        backfilled = await user_repository.migrate_soft_delete()
+    finally:
+        mongo_client.close()
+
+    print(f"Backfilled {backfilled} users. Restart the servers to match live users by equality.")
+    return backfilled
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,6 @@
+from pydantic import BaseModel, Field
+
+from src.configs.config import Config
+
+class TokenIntrospectionRequest(BaseModel):
+    tokens: list[str] = Field(..., min_length=1, max_length=Config.INTROSPECTION_MAX_TOKENS)
@@ -0,0 +1,52 @@
+import asyncio
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from src.configs.config import Config
+from src.mongo_monitoring import MongoPoolMetrics
+
+DATABASE_NAME = 'user-management-db'
+
+def _pool_options():
+    options = {
+        "maxPoolSize": Config.MONGO_MAX_POOL_SIZE,
+        "minPoolSize": Config.MONGO_MIN_POOL_SIZE,
+        "serverSelectionTimeoutMS": Config.MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    }
+    optional = {
+        "maxIdleTimeMS": Config.MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": Config.MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": Config.MONGO_CONNECT_TIMEOUT_MS,
+        "socketTimeoutMS": Config.MONGO_SOCKET_TIMEOUT_MS,
+        "compressors": Config.MONGO_COMPRESSORS or None,
+    }
+    options.update({key: value for key, value in optional.items() if value is not None})
+    return options
+
+def create_mongo_client(metrics: MongoPoolMetrics = None):
+    options = _pool_options()
+    if metrics is not None:
+        options["event_listeners"] = [metrics]
+
+    if int(Config.IS_MONGO_LOCAL):
+        return AsyncIOMotorClient(Config.MONGODB_URI, **options)
+
+    options.setdefault("socketTimeoutMS", 60000)
+    options.setdefault("connectTimeoutMS", 60000)
+    return AsyncIOMotorClient(
+        Config.MONGODB_URI,
+        tls=True,
+        retryWrites=False,
+        tlsCAFile=Config.CA_FILE,
+        **options
+    )
+
+def get_database(mongo_client, name: str = DATABASE_NAME):
+    return mongo_client[name]
+
+async def prewarm_pool(mongo_client, connections: int = None):
+    """
+    Open connections up front so the first requests after startup don't pay for
+    TCP/TLS handshakes. Concurrent pings each need their own connection.
+    """
+    connections = max(1, connections if connections is not None else Config.MONGO_MIN_POOL_SIZE)
+    await asyncio.gather(*(mongo_client.admin.command('ping') for _ in range(connections)))
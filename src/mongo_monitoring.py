@@ -0,0 +1,129 @@
+import threading
+
+from pymongo import monitoring
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener, monitoring.CommandListener):
+    """
+    Connection-pool and command listener for the Motor client.
+
+    The driver calls these hooks from its own threads, so all counters are updated
+    under a lock. Each hook only does a few additions to stay off the critical path.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections_open = 0
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.checkout_failures = {}
+        self.checkout_wait_seconds_total = 0.0
+        self.checkout_wait_seconds_max = 0.0
+        self.pool_clears = 0
+        self.commands = {}
+
+    # Connection pool events
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+            self.connections_open -= 1
+
+    def connection_check_out_started(self, event):
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures[event.reason] = self.checkout_failures.get(event.reason, 0) + 1
+            self._record_wait(event)
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+            self.checkouts += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+            self._record_wait(event)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def _record_wait(self, event):
+        duration = getattr(event, 'duration', None)
+        if duration is not None:
+            self.checkout_wait_seconds_total += duration
+            self.checkout_wait_seconds_max = max(self.checkout_wait_seconds_max, duration)
+
+    # Command events
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record_command(event, failed=False)
+
+    def failed(self, event):
+        self._record_command(event, failed=True)
+
+    def _record_command(self, event, failed):
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            stats = self.commands.get(event.command_name)
+            if stats is None:
+                stats = self.commands[event.command_name] = {
+                    "count": 0, "failures": 0, "seconds_total": 0.0, "seconds_max": 0.0
+                }
+            stats["count"] += 1
+            stats["failures"] += int(failed)
+            stats["seconds_total"] += seconds
+            stats["seconds_max"] = max(stats["seconds_max"], seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "connections_open": self.connections_open,
+                "connections_created": self.connections_created,
+                "connections_closed": self.connections_closed,
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "checkout_wait_seconds_avg": (
+                    self.checkout_wait_seconds_total / self.checkouts if self.checkouts else 0.0
+                ),
+                "checkout_wait_seconds_max": self.checkout_wait_seconds_max,
+                "pool_clears": self.pool_clears,
+                "commands": {name: dict(stats) for name, stats in self.commands.items()},
+            }
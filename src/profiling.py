@@ -0,0 +1,202 @@
+"""
+Opt-in sampling profiler for individual requests.
+
+While at least one profiled request is running, a background thread samples the
+stacks of the event-loop thread and the password-hashing threads every few
+milliseconds via `sys._current_frames()`. Each sample counts towards wall-clock
+time; it also counts as CPU time when the thread's CPU clock advanced since the
+previous sample, which separates bcrypt and jose work from time spent awaiting
+MongoDB. Samples are aggregated per route into collapsed stacks
+("frame;frame;frame count"), the input format of flamegraph.pl and speedscope.
+
+The event loop is shared by all in-flight requests, so loop samples taken during
+a profiled request may include work done for concurrent ones.
+
+Nothing here runs unless `PROFILING_ENABLED` is set: the middleware is not
+installed and the sampler thread is never started.
+"""
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+MAX_STACK_DEPTH = 64
+TRUNCATED = "[truncated]"
+
+
+def _collapse(frame):
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f"{frame.f_globals.get('__name__', '?')}.{code.co_qualname}")
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+def _cpu_clock(thread_id):
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(thread_id))
+    except (AttributeError, OSError):
+        return None
+
+
+class ProfileStore:
+    """Collapsed-stack counts per (route, mode), capped at `max_stacks` distinct stacks."""
+
+    def __init__(self, max_stacks: int = 5000):
+        self.max_stacks = max_stacks
+        self._profiles = {}
+        self._distinct = 0
+        self.requests = 0
+
+    def add(self, route, samples):
+        self.requests += 1
+        for mode, stacks in samples.items():
+            profile = self._profiles.setdefault((route, mode), Counter())
+            for stack, count in stacks.items():
+                if stack not in profile:
+                    if self._distinct >= self.max_stacks:
+                        stack = f"{route};{TRUNCATED}"
+                    else:
+                        self._distinct += 1
+                profile[stack] += count
+
+    def collapsed(self, mode='wall', route=None):
+        lines = []
+        for (profile_route, profile_mode), stacks in self._profiles.items():
+            if profile_mode != mode or (route is not None and profile_route != route):
+                continue
+            lines.extend(f"{stack} {count}" for stack, count in stacks.most_common())
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def clear(self):
+        self._profiles.clear()
+        self._distinct = 0
+        self.requests = 0
+
+
+class _Session:
+    __slots__ = ('loop_thread_id', 'samples')
+
+    def __init__(self, loop_thread_id):
+        self.loop_thread_id = loop_thread_id
+        self.samples = {'wall': Counter(), 'cpu': Counter()}
+
+
+class SamplingProfiler:
+    def __init__(self, store: ProfileStore, interval_seconds: float = 0.005, thread_prefixes=('hashing',)):
+        self.store = store
+        self.interval_seconds = interval_seconds
+        self.thread_prefixes = thread_prefixes
+        self._sessions = set()
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+        self._cpu_clocks = {}
+        self.samples = 0
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def start(self):
+        """Begin profiling a request running on the current (event-loop) thread."""
+        session = _Session(threading.get_ident())
+        with self._lock:
+            self._sessions.add(session)
+            self._active.set()
+        self._ensure_thread()
+        return session
+
+    def finish(self, session, route):
+        with self._lock:
+            self._sessions.discard(session)
+            if not self._sessions:
+                self._active.clear()
+        self.store.add(route, session.samples)
+
+    def _sampled_threads(self, loop_thread_ids):
+        threads = {thread_id: 'loop' for thread_id in loop_thread_ids}
+        for thread in threading.enumerate():
+            if thread.ident is not None and thread.name.startswith(self.thread_prefixes):
+                threads[thread.ident] = thread.name.split('_')[0]
+        return threads
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            started = time.perf_counter()
+            # Held while sampling, so finish() never reads a session's counters
+            # while they are being updated.
+            with self._lock:
+                if self._sessions:
+                    self._sample(self._sessions)
+            time.sleep(max(0.0, self.interval_seconds - (time.perf_counter() - started)))
+
+    def _sample(self, sessions):
+        threads = self._sampled_threads({session.loop_thread_id for session in sessions})
+        frames = sys._current_frames()
+        for thread_id, role in threads.items():
+            frame = frames.get(thread_id)
+            if frame is None:
+                continue
+            stack = f"{role};{_collapse(frame)}"
+            cpu = _cpu_clock(thread_id)
+            on_cpu = cpu is not None and cpu > self._cpu_clocks.get(thread_id, cpu)
+            if cpu is not None:
+                self._cpu_clocks[thread_id] = cpu
+            for session in sessions:
+                session.samples['wall'][stack] += 1
+                if on_cpu:
+                    session.samples['cpu'][stack] += 1
+        self.samples += 1
+
+    def stats(self):
+        return {"requests": self.store.requests, "samples": self.samples, "active": len(self._sessions)}
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when it is picked by `sample_rate`, or when it carries the
+    `header` and an access token of the admin user.
+    """
+
+    def __init__(self, app, profiler: SamplingProfiler, sample_rate: float = 0.0, header: str = 'x-profile'):
+        self.app = app
+        self.profiler = profiler
+        self.sample_rate = sample_rate
+        self.header = header.lower().encode('latin-1')
+
+    async def _requested_by_admin(self, scope):
+        headers = dict(scope.get('headers') or [])
+        if self.header not in headers:
+            return False
+        scheme, _, token = headers.get(b'authorization', b'').decode('latin-1').partition(' ')
+        if scheme.lower() != 'bearer' or not token:
+            return False
+        container = scope['app'].state.container
+        try:
+            user_id = await container.token_service.extract_user_id_from_token(token)
+            return await container.user_service.is_admin(user_id)
+        except Exception:
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        sampled = self.sample_rate > 0 and random.random() < self.sample_rate
+        if not sampled and not await self._requested_by_admin(scope):
+            return await self.app(scope, receive, send)
+
+        session = self.profiler.start()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            self.profiler.finish(session, f"{scope['method']} {route}")
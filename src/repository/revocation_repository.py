@@ -0,0 +1,66 @@
+from datetime import UTC, datetime
+
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel
+from src.metrics import db_operation_duration_seconds, timed
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+class RevocationRepository:
+    """
+    Access-token revocations, in two collections:
+
+    - `revoked_tokens`: one document per revoked jti, kept until the token would
+      have expired anyway.
+    - `user_token_cutoffs`: per user, tokens issued before `not_before` are revoked
+      (logout everywhere, password change). Kept for one access-token lifetime.
+
+    Both carry an `updated_at` so workers can fetch only what changed since their
+    last sync.
+    """
+
+    def __init__(self, db: AsyncIOMotorDatabase):
+        self.revoked_tokens = db['revoked_tokens']
+        self.user_token_cutoffs = db['user_token_cutoffs']
+
+    async def ensure_indexes(self):
+        expiry = IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0)
+        changes = IndexModel([("updated_at", ASCENDING)], name="updated_at")
+        try:
+            await self.revoked_tokens.create_indexes([expiry, changes])
+            await self.user_token_cutoffs.create_indexes([expiry, changes])
+        except Exception as e:
+            logger.error("Error creating indexes on revocation collections: %s", e)
+            raise
+
+    @timed(db_operation_duration_seconds, "revocation", "revoke_token")
+    async def revoke_token(self, jti, user_id, expires_at: datetime):
+        await self.revoked_tokens.update_one(
+            {"_id": jti},
+            {
+                "$setOnInsert": {"user_id": user_id, "expires_at": expires_at},
+                "$set": {"updated_at": datetime.now(UTC)},
+            },
+            upsert=True,
+        )
+
+    @timed(db_operation_duration_seconds, "revocation", "set_user_cutoff")
+    async def set_user_cutoff(self, user_id, not_before: float, expires_at: datetime):
+        # $max keeps the latest cutoff if two revocations race.
+        await self.user_token_cutoffs.update_one(
+            {"_id": user_id},
+            {
+                "$max": {"not_before": not_before, "expires_at": expires_at},
+                "$set": {"updated_at": datetime.now(UTC)},
+            },
+            upsert=True,
+        )
+
+    @timed(db_operation_duration_seconds, "revocation", "changes_since")
+    async def changes_since(self, since: datetime = None):
+        """Revoked tokens and cutoffs updated at or after `since` (everything if None)."""
+        query = {"updated_at": {"$gte": since}} if since is not None else {}
+        tokens = await self.revoked_tokens.find(query).to_list(length=None)
+        cutoffs = await self.user_token_cutoffs.find(query).to_list(length=None)
+        return tokens, cutoffs
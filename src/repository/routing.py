@@ -0,0 +1,213 @@
+"""
+Per-operation read preferences and write concerns for the repositories.
+
+Each repository operation has a name (the same one it reports to the
+db_operation_duration_seconds metric). Reads can be sent to secondaries and
+writes can wait for more nodes, one operation at a time; anything not
+configured uses the client's defaults, which read from and write to the primary.
+
+A read that goes to a secondary may not see a write this worker just made on
+the primary. To keep read-your-writes (e.g. logging in right after registering
+or changing the password), writes to a key record the cluster and operation time
+of a causally consistent session, and the next secondary read of that key joins a
+session advanced to those times: the driver sends `afterClusterTime` and the
+secondary waits until it has applied the write. The tokens live in this worker
+only, so another worker may still read an older version for up to the
+replication lag.
+
+Reads by get_user_by_id and get_user_by_email fill the user cache, so what a
+secondary returns is cached like any other read. This worker's own writes are
+safe: the read waits for them, and a read that raced with an invalidation is
+not cached. A write made by another worker, though, may be missed for up to the
+replication lag plus USER_CACHE_TTL_SECONDS. Refresh tokens are always read
+from the primary, where they are consumed atomically.
+"""
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+from pymongo.read_preferences import Nearest, Primary, PrimaryPreferred, Secondary, SecondaryPreferred
+from pymongo.write_concern import WriteConcern
+
+from src.configs.config import Config
+
+READ_PREFERENCES = {
+    'primary': Primary,
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def read_preference(mode: str, max_staleness_seconds: int = -1):
+    """Read preference for `mode`, or None to keep the client's default."""
+    if not mode:
+        return None
+    try:
+        preference = READ_PREFERENCES[mode]
+    except KeyError:
+        raise ValueError(f"Unknown read preference {mode!r}, expected one of {', '.join(READ_PREFERENCES)}")
+    if preference is Primary:
+        return Primary()
+    return preference(max_staleness=max_staleness_seconds)
+
+
+def write_concern(w: str, timeout_ms: int = None):
+    """WriteConcern for `w` ("majority", "1", ...), or None to keep the client's default."""
+    if not w:
+        return None
+    return WriteConcern(w=int(w) if w.isdigit() else w, wtimeout=timeout_ms)
+
+
+class CausalTokens:
+    """
+    Cluster and operation time of the latest write per key made by this worker,
+    kept for `ttl_seconds` (longer than the replication lag allowed by
+    maxStaleness) and for at most `max_keys` keys.
+    """
+
+    def __init__(self, ttl_seconds: float = 120, max_keys: int = 100000):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self._tokens = OrderedDict()
+        self.recorded = 0
+        self.causal_reads = 0
+
+    def record(self, session, *keys):
+        if session is None or session.operation_time is None:
+            return
+        token = (session.cluster_time, session.operation_time, time.monotonic() + self.ttl_seconds)
+        for key in keys:
+            self._tokens[key] = token
+            self._tokens.move_to_end(key)
+            self.recorded += 1
+        while len(self._tokens) > self.max_keys:
+            self._tokens.popitem(last=False)
+
+    def get(self, key):
+        token = self._tokens.get(key)
+        if token is None:
+            return None
+        if token[2] <= time.monotonic():
+            del self._tokens[key]
+            return None
+        return token
+
+    def stats(self):
+        return {"keys": len(self._tokens), "recorded": self.recorded, "causal_reads": self.causal_reads}
+
+
+class OperationRouting:
+    def __init__(self, read_preferences: dict = None, write_concerns: dict = None, causal_tokens: CausalTokens = None):
+        self.read_preferences = {
+            operation: preference for operation, preference in (read_preferences or {}).items()
+            if preference is not None
+        }
+        self.write_concerns = {
+            operation: concern for operation, concern in (write_concerns or {}).items() if concern is not None
+        }
+        self.causal_tokens = causal_tokens if causal_tokens is not None else CausalTokens()
+        # Sessions only cost something when a read can actually be served by a secondary.
+        self.reads_secondaries = any(
+            not isinstance(preference, Primary) for preference in self.read_preferences.values()
+        )
+
+    @classmethod
+    def from_config(cls):
+        staleness = Config.MONGO_MAX_STALENESS_SECONDS
+        profile = read_preference(Config.MONGO_READ_PREFERENCE_PROFILE, staleness)
+        login = read_preference(Config.MONGO_READ_PREFERENCE_LOGIN, staleness)
+        listing = read_preference(Config.MONGO_READ_PREFERENCE_LISTING, staleness)
+        timeout = Config.MONGO_WRITE_CONCERN_TIMEOUT_MS
+        user_writes = write_concern(Config.MONGO_WRITE_CONCERN_USER, timeout)
+        password_writes = write_concern(Config.MONGO_WRITE_CONCERN_PASSWORD, timeout)
+        token_writes = write_concern(Config.MONGO_WRITE_CONCERN_REFRESH_TOKEN, timeout)
+        return cls(
+            read_preferences={
+                "get_user_by_id": profile,
+                "get_user_by_email": login,
+                "list_users": listing,
+            },
+            write_concerns={
+                "create_user": user_writes,
+                "insert_user_if_absent": user_writes,
+                "insert_many_users": user_writes,
+                "soft_delete_user": user_writes,
+                "update_password": password_writes,
+                "replace_password_hash": password_writes,
+                "save_refresh_token": token_writes,
+                "consume_refresh_token": token_writes,
+                "delete_refresh_token": token_writes,
+                "evict_excess_sessions": token_writes,
+                "revoke_all_for_user": token_writes,
+            },
+            causal_tokens=CausalTokens(Config.MONGO_CAUSAL_TOKEN_TTL_SECONDS, Config.MONGO_CAUSAL_TOKEN_MAX_KEYS),
+        )
+
+    def bind(self, collection):
+        return RoutedCollection(self, collection)
+
+    def _secondary_read(self, operation):
+        preference = self.read_preferences.get(operation)
+        return preference is not None and not isinstance(preference, Primary)
+
+    @asynccontextmanager
+    async def read_session(self, client, operation, key):
+        """
+        A session that makes a secondary read of `key` see this worker's latest
+        write to it, or None when no session is needed.
+        """
+        token = self.causal_tokens.get(key) if self._secondary_read(operation) else None
+        if token is None:
+            yield None
+            return
+        async with await client.start_session(causal_consistency=True) as session:
+            if token[0] is not None:
+                session.advance_cluster_time(token[0])
+            session.advance_operation_time(token[1])
+            self.causal_tokens.causal_reads += 1
+            yield session
+
+    @asynccontextmanager
+    async def write_session(self, client):
+        """
+        A causally consistent session for a write whose keys may later be read from
+        a secondary; pass it to `record` after the write. None if no read can go to
+        a secondary.
+        """
+        if not self.reads_secondaries:
+            yield None
+            return
+        async with await client.start_session(causal_consistency=True) as session:
+            yield session
+
+    def record(self, session, *keys):
+        self.causal_tokens.record(session, *keys)
+
+    def stats(self):
+        return self.causal_tokens.stats()
+
+
+class RoutedCollection:
+    """`routed("operation")` is the collection with that operation's options applied."""
+
+    def __init__(self, routing: OperationRouting, collection):
+        self._routing = routing
+        self._collection = collection
+        self._by_operation = {}
+
+    def __call__(self, operation):
+        collection = self._by_operation.get(operation)
+        if collection is None:
+            options = {}
+            if operation in self._routing.read_preferences:
+                options["read_preference"] = self._routing.read_preferences[operation]
+            if operation in self._routing.write_concerns:
+                options["write_concern"] = self._routing.write_concerns[operation]
+            collection = self._collection.with_options(**options) if options else self._collection
+            self._by_operation[operation] = collection
+        return collection
+
+
+default_routing = OperationRouting.from_config()
@@ -0,0 +1,161 @@
+"""
+Write-behind buffer for refresh-token inserts.
+
+Login and refresh only need the new refresh token to be consumable later, not
+to be on disk before the response goes out. With the buffer enabled, new token
+documents are queued in memory and written with one `insert_many` every
+`interval_seconds`, or as soon as `batch_size` documents are waiting. Lookups,
+consumes and deletes check the buffer first, so a just-issued token behaves as
+if it had been written.
+
+A token consumed before its flush is never written at all. While a batch is
+being written its tokens are neither pending nor guaranteed on disk, so callers
+touching one of them wait for that flush and then go to the database; this
+keeps consumption single-use. When the buffer is full (MongoDB is slow or down)
+or not running, callers fall back to a synchronous insert.
+
+Buffered tokens are lost if the process dies before a flush; the affected users
+have to log in again. Shutdown flushes whatever is left.
+
+The buffer lives in one process, so it must only be used with a single worker:
+another worker would neither find a token issued here before its flush nor
+see it when revoking the user's sessions. The service container enforces this.
+"""
+import asyncio
+import time
+
+from src.metrics import refresh_token_flush_duration_seconds, refresh_token_flush_size
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class RefreshTokenWriteBuffer:
+    def __init__(self, insert_many, interval_seconds: float = 0.05, batch_size: int = 500, max_size: int = 10000):
+        self._insert_many = insert_many
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self._pending = {}
+        self._flushing = {}
+        self._flush_done = None
+        self._wake = asyncio.Event()
+        self._task = None
+
+        self.buffered = 0
+        self.fallbacks = 0
+        self.consumed_before_flush = 0
+        self.flushes = 0
+        self.flushed = 0
+        self.errors = 0
+
+    def add(self, document) -> bool:
+        """Queue a token document. Returns False if the caller must write it itself."""
+        if self._task is None or len(self._pending) + len(self._flushing) >= self.max_size:
+            self.fallbacks += 1
+            return False
+        self._pending[document["_id"]] = document
+        self.buffered += 1
+        if len(self._pending) >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def get(self, token_id):
+        return self._pending.get(token_id) or self._flushing.get(token_id)
+
+    async def wait_for_flush(self, token_id=None):
+        """Wait until `token_id` (or, without one, any token) is no longer being written."""
+        while self._flush_done is not None and (token_id is None or token_id in self._flushing):
+            await asyncio.shield(self._flush_done)
+
+    def take(self, token_id, user_id):
+        """Remove and return a pending token of `user_id`, so that it is never written."""
+        document = self._pending.get(token_id)
+        if document is None or document["user_id"] != user_id:
+            return None
+        del self._pending[token_id]
+        self.consumed_before_flush += 1
+        return document
+
+    def discard(self, token_id):
+        return self._pending.pop(token_id, None) is not None
+
+    def pending_for_user(self, user_id):
+        return [document for document in self._pending.values() if document["user_id"] == user_id]
+
+    def discard_user(self, user_id):
+        token_ids = [token_id for token_id, document in self._pending.items() if document["user_id"] == user_id]
+        for token_id in token_ids:
+            del self._pending[token_id]
+        return len(token_ids)
+
+    async def flush(self):
+        await self.wait_for_flush()
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        self._flushing = batch
+        self._flush_done = asyncio.get_running_loop().create_future()
+        started = time.perf_counter()
+        try:
+            await self._insert_many(list(batch.values()))
+        except (Exception, asyncio.CancelledError) as e:
+            # Retried with the next flush; documents that did get written are
+            # skipped then as duplicates.
+            for token_id, document in batch.items():
+                self._pending.setdefault(token_id, document)
+            if not isinstance(e, asyncio.CancelledError):
+                self.errors += 1
+                logger.error("Error flushing %s buffered refresh tokens: %s", len(batch), e)
+            raise
+        finally:
+            self._flushing = {}
+            done, self._flush_done = self._flush_done, None
+            done.set_result(None)
+        refresh_token_flush_duration_seconds.observe(time.perf_counter() - started)
+        refresh_token_flush_size.observe(len(batch))
+        self.flushes += 1
+        self.flushed += len(batch)
+        return len(batch)
+
+    async def _flush_forever(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception:
+                pass  # Logged by flush; the batch stays queued.
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._flush_forever())
+
+    async def stop(self):
+        """Stop the background flusher and write out what is left. New tokens are written synchronously from now on."""
+        if self._task is not None:
+            task, self._task = self._task, None
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        try:
+            await self.flush()
+        except Exception:
+            logger.error("Lost %s buffered refresh tokens on shutdown.", len(self._pending))
+
+    def stats(self):
+        return {
+            "pending": len(self._pending),
+            "flushing": len(self._flushing),
+            "buffered": self.buffered,
+            "fallbacks": self.fallbacks,
+            "consumed_before_flush": self.consumed_before_flush,
+            "flushes": self.flushes,
+            "flushed": self.flushed,
+            "errors": self.errors,
+        }
@@ -1,28 +1,156 @@
+import asyncio
+from datetime import UTC, datetime
+
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import BulkWriteError
+from src.configs.config import Config
+from src.metrics import db_operation_duration_seconds, timed
+from src.repository.routing import OperationRouting, default_routing
+from src.repository.token_buffer import RefreshTokenWriteBuffer
 from src.logger_setup import setup_logger
 
 logger = setup_logger(__name__)
 
-class TokenRepository:
-    _instance = None
-
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+def _aware(timestamp):
+    # Motor returns naive UTC datetimes unless the client is tz_aware.
+    return timestamp.replace(tzinfo=UTC) if timestamp.tzinfo is None else timestamp
 
-    def __init__(self, db: AsyncIOMotorDatabase):
+class TokenRepository:
+    def __init__(self, db: AsyncIOMotorDatabase, routing: OperationRouting = None, write_behind: bool = False):
+        self.db = db
         self.collection = db['refresh_tokens']
+        self.routing = routing if routing is not None else default_routing
+        self.routed = self.routing.bind(self.collection)
+        # Optional; started and stopped by the app's lifespan.
+        self.write_buffer = RefreshTokenWriteBuffer(
+            self._insert_batch,
+            interval_seconds=Config.REFRESH_TOKEN_WRITE_BEHIND_INTERVAL_MS / 1000,
+            batch_size=Config.REFRESH_TOKEN_WRITE_BEHIND_BATCH_SIZE,
+            max_size=Config.REFRESH_TOKEN_WRITE_BEHIND_MAX_BUFFER,
+        ) if write_behind else None
 
+    async def ensure_indexes(self):
+        # The TTL index lets mongod delete expired tokens in the background (its
+        # monitor runs about once a minute). The (user_id, expires_at) index serves
+        # the per-user session cap and revoke-all, and its expires_at order is
+        # issue order, since every refresh token gets the same lifetime.
+        indexes = [
+            IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+            IndexModel([("user_id", ASCENDING), ("expires_at", ASCENDING)], name="user_sessions"),
+        ]
+        try:
+            return await self.collection.create_indexes(indexes)
+        except Exception as e:
+            logger.error("Error creating indexes on refresh_tokens collection: %s", e)
+            raise
+
+    @timed(db_operation_duration_seconds, "token", "save_refresh_token")
     async def save_refresh_token(self, token_id, user_id, expires_at):
-        await self.collection.insert_one({
+        document = {
             "_id": token_id,
             "user_id": user_id,
             "expires_at": expires_at
-        })
+        }
+        if self.write_buffer is not None and self.write_buffer.add(document):
+            return
+        await self.routed("save_refresh_token").insert_one(document)
+
+    async def _insert_batch(self, documents):
+        """Write a batch from the write-behind buffer. Tokens already written by an earlier, failed attempt are skipped."""
+        try:
+            await self.routed("save_refresh_token").insert_many(documents, ordered=False)
+        except BulkWriteError as e:
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
 
+    @timed(db_operation_duration_seconds, "token", "delete_refresh_token")
     async def delete_refresh_token(self, token_id):
-        await self.collection.delete_one({"_id": token_id})
+        if self.write_buffer is not None:
+            await self.write_buffer.wait_for_flush(token_id)
+            if self.write_buffer.discard(token_id):
+                return
+        await self.routed("delete_refresh_token").delete_one({"_id": token_id})
 
+    @timed(db_operation_duration_seconds, "token", "get_refresh_token")
     async def get_refresh_token(self, token_id):
+        buffered = self.write_buffer.get(token_id) if self.write_buffer is not None else None
+        if buffered is not None:
+            return dict(buffered)
         return await self.collection.find_one({"_id": token_id})
+
+    @timed(db_operation_duration_seconds, "token", "consume_refresh_token")
+    async def consume_refresh_token(self, token_id, user_id):
+        """
+        Atomically delete a refresh token record that belongs to `user_id`.
+
+        Returns the deleted record, or None if the token was already consumed,
+        never stored or belongs to someone else. Of several concurrent callers for
+        the same token exactly one gets the record.
+
+        With the write-behind buffer, a token that is still buffered is taken from
+        it and never written. The buffer is only enabled with a single worker, so
+        a token missing from both the buffer and the collection is really gone.
+        """
+        if self.write_buffer is not None:
+            await self.write_buffer.wait_for_flush(token_id)
+            token = self.write_buffer.take(token_id, user_id)
+            if token is not None:
+                return token
+        return await self.routed("consume_refresh_token").find_one_and_delete({"_id": token_id, "user_id": user_id})
+
+    @timed(db_operation_duration_seconds, "token", "evict_excess_sessions")
+    async def evict_excess_sessions(self, user_id, max_sessions: int):
+        """
+        Delete all but the `max_sessions` newest refresh tokens of `user_id`.
+
+        Within the cap this is one indexed query returning nothing; only a user
+        over the cap pays for the delete. Tokens still in the write-behind buffer
+        count too: the excess among them is dropped from the buffer.
+        """
+        buffered = []
+        if self.write_buffer is not None:
+            await self.write_buffer.wait_for_flush()
+            buffered = self.write_buffer.pending_for_user(user_id)
+        cursor = self.collection.find({"user_id": user_id}, projection={"_id": 1, "expires_at": 1})
+        cursor = cursor.sort("expires_at", DESCENDING)
+        if buffered:
+            # Few enough to merge here: the user is at most a handful of logins over the cap.
+            tokens = buffered + await cursor.to_list(length=None)
+            tokens.sort(key=lambda token: _aware(token["expires_at"]), reverse=True)
+        else:
+            tokens = await cursor.skip(max_sessions).to_list(length=None)
+            max_sessions = 0
+        evicted = 0
+        stored = []
+        for token in tokens[max_sessions:]:
+            if self.write_buffer is not None and self.write_buffer.discard(token["_id"]):
+                evicted += 1
+            else:
+                stored.append(token["_id"])
+        if stored:
+            result = await self.routed("evict_excess_sessions").delete_many({"_id": {"$in": stored}, "user_id": user_id})
+            evicted += result.deleted_count
+        return evicted
+
+    @timed(db_operation_duration_seconds, "token", "revoke_all_for_user")
+    async def revoke_all_for_user(self, user_id):
+        discarded = 0
+        if self.write_buffer is not None:
+            await self.write_buffer.wait_for_flush()
+            discarded = self.write_buffer.discard_user(user_id)
+        result = await self.routed("revoke_all_for_user").delete_many({"user_id": user_id})
+        return discarded + result.deleted_count
+
+    async def store_stats(self):
+        """Size of the collection and how far behind the TTL monitor is."""
+        now = datetime.now(UTC)
+        documents, expired, oldest = await asyncio.gather(
+            self.collection.estimated_document_count(),
+            self.collection.count_documents({"expires_at": {"$lt": now}}),
+            self.collection.find_one({}, projection={"expires_at": 1}, sort=[("expires_at", ASCENDING)]),
+        )
+        expiry_lag = 0.0
+        if expired and oldest is not None:
+            expiry_lag = max(0.0, (now - _aware(oldest["expires_at"])).total_seconds())
+        return {"documents": documents, "expired_documents": expired, "expiry_lag_seconds": expiry_lag}
@@ -0,0 +1,133 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from src.configs.config import Config
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+# Returned by UserCache.get when nothing is cached for a key. A cached None means
+# "known not to exist" (negative entry).
+CACHE_MISS = object()
+
+
+class UserCache(ABC):
+    """
+    Interface for the cache in front of UserRepository.
+
+    Methods are async so that a shared backend (e.g. Redis) can implement it
+    without changing callers. Keys are plain strings chosen by the repository.
+    """
+
+    @abstractmethod
+    async def get(self, key: str):
+        """The cached value, None for a negative entry, or CACHE_MISS."""
+
+    @abstractmethod
+    async def set(self, key: str, value, negative: bool = False):
+        """Cache `value`; `negative` entries record that the key doesn't exist."""
+
+    @abstractmethod
+    async def delete(self, *keys: str):
+        """Drop the entries for `keys`, if any."""
+
+    def stats(self):
+        return {}
+
+
+class NullUserCache(UserCache):
+    async def get(self, key: str):
+        return CACHE_MISS
+
+    async def set(self, key: str, value, negative: bool = False):
+        pass
+
+    async def delete(self, *keys: str):
+        pass
+
+
+class InMemoryUserCache(UserCache):
+    """
+    Per-process TTL + LRU cache.
+
+    Mutations only invalidate this process's copy, so it is only used with a single
+    worker (see build_user_cache); otherwise another worker would keep accepting
+    the old password of a changed or deleted user for up to `ttl_seconds`.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 30, negative_ttl_seconds: float = 5):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.negative_ttl_seconds = negative_ttl_seconds
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    async def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return CACHE_MISS
+
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return CACHE_MISS
+
+        self._entries.move_to_end(key)
+        if value is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def set(self, key: str, value, negative: bool = False):
+        ttl = self.negative_ttl_seconds if negative else self.ttl_seconds
+        if self.max_size <= 0 or ttl <= 0:
+            return
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys: str):
+        for key in keys:
+            if self._entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations,
+            "hit_rate": (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+def build_user_cache(workers: int = None):
+    if not int(Config.USER_CACHE_ENABLED):
+        return NullUserCache()
+    workers = max(1, workers or Config.WEB_WORKERS)
+    if workers > 1:
+        logger.warning("USER_CACHE_ENABLED ignored: the cache is per process and needs a single worker, not %s.", workers)
+        return NullUserCache()
+    return InMemoryUserCache(
+        max_size=Config.USER_CACHE_SIZE,
+        ttl_seconds=Config.USER_CACHE_TTL_SECONDS,
+        negative_ttl_seconds=Config.USER_CACHE_NEGATIVE_TTL_SECONDS,
+    )
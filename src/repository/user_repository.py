@@ -1,19 +1,48 @@
+from datetime import UTC, datetime
+
 from bson import ObjectId
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, IndexModel, ReturnDocument
+from pymongo.errors import OperationFailure
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from src.repository.routing import OperationRouting, default_routing
+from src.repository.user_cache import CACHE_MISS, UserCache, build_user_cache
+from src.metrics import db_operation_duration_seconds, timed
+from src.single_flight import SingleFlight
 from src.logger_setup import setup_logger
 
 logger = setup_logger(__name__)
 
-class UserRepository:
-    _instance = None
+default_user_cache = build_user_cache()
 
-    def __new__(cls, *args, **kwargs):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+# Condition every read of a "current" user must include. Once every user document
+# carries an explicit isDeleted flag, this is an equality match that the partial
+# indexes below serve exactly (a $ne predicate can't use them).
+LIVE_USER_FILTER = {"isDeleted": False}
+# Until the soft-delete migration has run, documents written by older versions
+# have no flag at all, so live users are matched with $ne instead.
+PRE_MIGRATION_LIVE_USER_FILTER = {"isDeleted": {"$ne": True}}
+LEGACY_EMAIL_INDEX = "email_unique"
+SOFT_DELETE_MIGRATION = "users_soft_delete"
+# Listing never needs the password hash, so it is not even read from disk.
+PUBLIC_USER_PROJECTION = {"password": 0}
 
-    def __init__(self, db: AsyncIOMotorDatabase):
+class UserRepository:
+    def __init__(self, db: AsyncIOMotorDatabase, cache: UserCache = None, routing: OperationRouting = None):
         self._db = db
+        self.cache = cache if cache is not None else default_user_cache
+        self.routing = routing if routing is not None else default_routing
+        # Per-operation read preference and write concern, see src/repository/routing.py.
+        self.routed = self.routing.bind(self.users_collection)
+        # Concurrent cache misses for the same user share one query.
+        self.lookups = SingleFlight()
+        # Invalidation sequence per key, kept only while fetches are in flight, so a
+        # fetch that raced with a write doesn't put the old document back in the cache.
+        self._sequence = 0
+        self._invalidated_at = {}
+        self._fetches = 0
+        # Switched to LIVE_USER_FILTER by load_migration_state() once the migration is recorded.
+        self.live_filter = PRE_MIGRATION_LIVE_USER_FILTER
 
     @property
     def db(self):
@@ -22,43 +51,359 @@ class UserRepository:
     @property
     def users_collection(self):
         return self.db['users']
-    
-    async def get_user_by_id(self, user_id):
+
+    @property
+    def migrations_collection(self):
+        return self.db['migrations']
+
+    async def ensure_indexes(self):
+        # Login looks users up by email and everything else by _id, which already has
+        # its own unique index. The email index only covers live users: it serves the
+        # login lookup, lets create_user detect duplicates in the same round trip as
+        # the insert, and lets a deleted user's email be registered again. Deleted
+        # users are indexed separately by deletion time for the purge job.
+        # A new deployment has no documents from older versions to migrate.
+        if await self.users_collection.find_one({}, projection={"_id": 1}) is None:
+            await self._record_migration()
+        migrated = await self.load_migration_state()
+        indexes = [
+            IndexModel(
+                [("email", ASCENDING)], name="email_live_unique", unique=True,
+                partialFilterExpression={"isDeleted": False},
+            ),
+            IndexModel(
+                [("deletedAt", ASCENDING)], name="deleted_at",
+                partialFilterExpression={"isDeleted": True},
+            ),
+        ]
+        if not migrated:
+            # Users without the flag are outside the partial index, so until the
+            # migration has flagged them, emails stay unique across all documents
+            # (deleted users included). migrate_soft_delete() drops this index.
+            indexes.append(IndexModel([("email", ASCENDING)], name=LEGACY_EMAIL_INDEX, unique=True))
         try:
-            return await self.users_collection.find_one({"_id": ObjectId(user_id), "isDeleted": {"$ne": True}})
+            return await self.users_collection.create_indexes(indexes)
         except Exception as e:
-            logger.error(f"Error fetching user by id {user_id}: {e}")
-            return None
+            logger.error("Error creating indexes on users collection: %s", e)
+            raise
+
+    async def load_migration_state(self):
+        """Pick the live-user filter according to whether the soft-delete migration has run."""
+        migrated = await self.migrations_collection.find_one({"_id": SOFT_DELETE_MIGRATION}) is not None
+        self.live_filter = LIVE_USER_FILTER if migrated else PRE_MIGRATION_LIVE_USER_FILTER
+        if not migrated:
+            logger.warning("Users soft-delete migration has not run yet; run python -m src.migrate_users.")
+        return migrated
+
+    async def migrate_soft_delete(self):
+        """
+        One-off migration, run once no older version is writing users any more:
+        give documents without a flag an explicit isDeleted: False, drop the old
+        email index that made emails unique across deleted users too, and record
+        the migration so workers match live users by equality. Safe to re-run.
+        Returns the number of backfilled users.
+        """
+        result = await self.users_collection.update_many(
+            {"isDeleted": {"$exists": False}}, {"$set": {"isDeleted": False}}
+        )
+        logger.info("Set isDeleted: false on %s existing users.", result.modified_count)
+        if LEGACY_EMAIL_INDEX in await self.users_collection.index_information():
+            try:
+                await self.users_collection.drop_index(LEGACY_EMAIL_INDEX)
+                logger.info("Dropped legacy index %s on users collection.", LEGACY_EMAIL_INDEX)
+            except OperationFailure as e:
+                logger.info("Legacy index %s already dropped: %s", LEGACY_EMAIL_INDEX, e)
+        await self._record_migration()
+        self.live_filter = LIVE_USER_FILTER
+        return result.modified_count
+
+    async def _record_migration(self):
+        await self.migrations_collection.update_one(
+            {"_id": SOFT_DELETE_MIGRATION},
+            {"$setOnInsert": {"completedAt": datetime.now(UTC)}},
+            upsert=True,
+        )
+
+    @staticmethod
+    def _id_key(user_id):
+        return f"id:{user_id}"
+
+    @staticmethod
+    def _email_key(email):
+        return f"email:{email}"
+
+    def _fetch_started(self):
+        self._fetches += 1
+        return self._sequence
+
+    def _fetch_finished(self):
+        self._fetches -= 1
+        if not self._fetches:
+            self._invalidated_at.clear()
+
+    def _invalidated_since(self, key, started):
+        return self._invalidated_at.get(key, 0) > started
+
+    async def _cache(self, key, value, started, negative=False):
+        """Cache what a fetch that began at sequence `started` read, unless `key` was invalidated meanwhile."""
+        if self._invalidated_since(key, started):
+            return
+        await self.cache.set(key, dict(value) if value is not None else None, negative=negative)
+        # An invalidation may have deleted the key while a shared cache was storing it.
+        if self._invalidated_since(key, started):
+            await self.cache.delete(key)
+
+    async def _cache_user(self, user, started):
+        await self._cache(self._id_key(user["_id"]), user, started)
+        await self._cache(self._email_key(user["email"]), user, started)
+
+    async def invalidate_user(self, user_id=None, email=None):
+        """Drop cached entries for a user. Call after every mutation of a user document."""
+        keys = []
+        if user_id is not None:
+            keys.append(self._id_key(user_id))
+        if email is not None:
+            keys.append(self._email_key(email))
+        self._invalidate_keys(keys)
+        await self.cache.delete(*keys)
+
+    def _invalidate_keys(self, keys):
+        self._sequence += 1
+        if self._fetches:
+            for key in keys:
+                self._invalidated_at[key] = self._sequence
+        self.lookups.forget(*keys)
+
+    @timed(db_operation_duration_seconds, "user", "get_user_by_id")
+    async def get_user_by_id(self, user_id):
+        key = self._id_key(user_id)
+        cached = await self.cache.get(key)
+        if cached is not CACHE_MISS:
+            return dict(cached) if cached is not None else None
+        user = await self.lookups.do(key, self._fetch_user_by_id, user_id)
+        return dict(user) if user is not None else None
+
+    async def _fetch_user_by_id(self, user_id):
+        started = self._fetch_started()
+        try:
+            try:
+                async with self.routing.read_session(self.db.client, "get_user_by_id", self._id_key(user_id)) as session:
+                    user = await self.routed("get_user_by_id").find_one(
+                        {"_id": ObjectId(user_id), **self.live_filter}, session=session
+                    )
+            except Exception as e:
+                logger.error("Error fetching user by id %s: %s", user_id, e)
+                return None
+            if user:
+                await self._cache_user(user, started)
+            return user
+        finally:
+            self._fetch_finished()
 
+    @timed(db_operation_duration_seconds, "user", "get_user_by_email")
     async def get_user_by_email(self, email):
+        key = self._email_key(email)
+        cached = await self.cache.get(key)
+        if cached is not CACHE_MISS:
+            return dict(cached) if cached is not None else None
+        user = await self.lookups.do(key, self._fetch_user_by_email, email)
+        return dict(user) if user is not None else None
+
+    async def _fetch_user_by_email(self, email):
+        started = self._fetch_started()
         try:
-            return await self.users_collection.find_one({"email": email, "isDeleted": {"$ne": True}})
-        except Exception as e:
-            logger.error(f"Error fetching user by email {email}: {e}")
-            return None
+            try:
+                async with self.routing.read_session(self.db.client, "get_user_by_email", self._email_key(email)) as session:
+                    user = await self.routed("get_user_by_email").find_one(
+                        {"email": email, **self.live_filter}, session=session
+                    )
+            except Exception as e:
+                logger.error("Error fetching user by email %s: %s", email, e)
+                return None
+            if user:
+                await self._cache_user(user, started)
+            else:
+                await self._cache(self._email_key(email), None, started, negative=True)
+            return user
+        finally:
+            self._fetch_finished()
+
+    def iter_users(self, after_id=None, limit: int = None, batch_size: int = 1000):
+        """
+        Cursor over live users in `_id` order, starting after `after_id`.
+
+        Keyset pagination on `_id` is served by the `_id` index, so every page costs
+        the same regardless of how deep it is (unlike skip/limit). The returned Motor
+        cursor is an async iterator that fetches `batch_size` documents at a time.
+        """
+        query = dict(self.live_filter)
+        if after_id is not None:
+            query["_id"] = {"$gt": ObjectId(after_id)}
+        cursor = self.routed("list_users").find(query, projection=PUBLIC_USER_PROJECTION)
+        cursor = cursor.sort("_id", ASCENDING).batch_size(batch_size)
+        if limit:
+            cursor = cursor.limit(limit)
+        return cursor
+
+    @timed(db_operation_duration_seconds, "user", "list_users")
+    async def list_users(self, after_id=None, limit: int = 100):
+        return await self.iter_users(after_id, limit, batch_size=limit).to_list(length=limit)
 
+    @timed(db_operation_duration_seconds, "user", "create_user")
     async def create_user(self, email, password):
+        user = {
+            "email": email,
+            "password": password,
+            "isDeleted": False,
+        }
         try:
-            user_exists = await self.users_collection.find_one({"email": email})
-            if user_exists:
-                return None  # Indicate user already exists
-            user = {
-                "email": email,
-                "password": password
-            }
-            result = await self.users_collection.insert_one(user)
+            async with self.routing.write_session(self.db.client) as session:
+                result = await self.routed("create_user").insert_one(user, session=session)
+            self.routing.record(session, self._id_key(result.inserted_id), self._email_key(email))
+            await self.invalidate_user(email=email)
             return {"_id": result.inserted_id, **user}
+        except DuplicateKeyError:
+            return None  # Indicate user already exists
         except Exception as e:
-            logger.error(f"Exception creating user {email}: {e}")
+            logger.error("Exception creating user %s: %s", email, e)
             return None
 
+    @timed(db_operation_duration_seconds, "user", "find_existing_emails")
+    async def find_existing_emails(self, emails):
+        """The subset of `emails` that belong to existing users, in one query."""
+        cursor = self.users_collection.find(
+            {"email": {"$in": list(emails)}, **self.live_filter}, projection={"_id": 0, "email": 1}
+        )
+        return {user["email"] for user in await cursor.to_list(length=None)}
+
+    @timed(db_operation_duration_seconds, "user", "insert_user_if_absent")
+    async def insert_user_if_absent(self, email, password):
+        """
+        Idempotently create a user: an upsert with `$setOnInsert` leaves an existing
+        user untouched, so concurrent callers (e.g. several workers seeding at once)
+        converge on one document. Returns True if this call inserted it.
+        """
+        try:
+            async with self.routing.write_session(self.db.client) as session:
+                result = await self.routed("insert_user_if_absent").update_one(
+                    {"email": email, **self.live_filter},
+                    {"$setOnInsert": {"email": email, "password": password, "isDeleted": False}},
+                    upsert=True, session=session,
+                )
+        except DuplicateKeyError:
+            # Another upsert inserted the same email between our match and insert.
+            return False
+        self.routing.record(session, self._email_key(email))
+        await self.invalidate_user(email=email)
+        return result.upserted_id is not None
+
+    @timed(db_operation_duration_seconds, "user", "insert_many_users")
+    async def insert_many_users(self, users):
+        """
+        Insert a batch of user documents without stopping at the first failure.
+
+        Returns the number of inserted documents and the driver's per-document
+        write errors; each error carries the `index` of the failed document in
+        `users` and its error `code` (11000 for a duplicate email).
+        """
+        if not users:
+            return 0, []
+        users = [{**user, "isDeleted": False} for user in users]
+        keys = [self._email_key(user["email"]) for user in users]
+        session = None
+        try:
+            async with self.routing.write_session(self.db.client) as session:
+                result = await self.routed("insert_many_users").insert_many(users, ordered=False, session=session)
+            return len(result.inserted_ids), []
+        except BulkWriteError as e:
+            return e.details.get("nInserted", 0), e.details.get("writeErrors", [])
+        finally:
+            self.routing.record(session, *keys)
+            # Clear negative entries for the imported emails.
+            self._invalidate_keys(keys)
+            await self.cache.delete(*keys)
+
+    @timed(db_operation_duration_seconds, "user", "update_password")
     async def update_password(self, user_id, new_password):
         try:
-            result = await self.users_collection.update_one(
-                {"_id": ObjectId(user_id), "isDeleted": {"$ne": True}},
-                {"$set": {"password": new_password}}
-            )
-            return result.modified_count == 1
+            # find_one_and_update costs the same round trip as update_one and hands back
+            # the email, so both cache keys for the user can be invalidated.
+            async with self.routing.write_session(self.db.client) as session:
+                user = await self.routed("update_password").find_one_and_update(
+                    {"_id": ObjectId(user_id), **self.live_filter},
+                    {"$set": {"password": new_password}},
+                    projection={"email": 1},
+                    return_document=ReturnDocument.AFTER,
+                    session=session,
+                )
+            if user is not None:
+                self.routing.record(session, self._id_key(user_id), self._email_key(user["email"]))
+            await self.invalidate_user(user_id, user["email"] if user else None)
+            return user is not None
+        except Exception as e:
+            logger.error("Error updating password for user %s: %s", user_id, e)
+            return False
+
+    @timed(db_operation_duration_seconds, "user", "replace_password_hash")
+    async def replace_password_hash(self, user_id, old_hash, new_hash):
+        """
+        Swap `old_hash` for `new_hash` only if it is still the stored hash, so a
+        background rehash can never overwrite a password changed in the meantime.
+        """
+        try:
+            async with self.routing.write_session(self.db.client) as session:
+                user = await self.routed("replace_password_hash").find_one_and_update(
+                    {"_id": ObjectId(user_id), "password": old_hash, **self.live_filter},
+                    {"$set": {"password": new_hash}},
+                    projection={"email": 1},
+                    session=session,
+                )
+            if user is not None:
+                self.routing.record(session, self._id_key(user_id), self._email_key(user["email"]))
+                await self.invalidate_user(user_id, user["email"])
+            return user is not None
         except Exception as e:
-            logger.error(f"Error updating password for user {user_id}: {e}")
+            logger.error("Error replacing password hash for user %s: %s", user_id, e)
             return False
+
+    @timed(db_operation_duration_seconds, "user", "soft_delete_user")
+    async def soft_delete_user(self, user_id, keep_email=None):
+        """
+        Mark a live user deleted, unless its email is `keep_email`. Returns the
+        user's email, or None if there was no such live user.
+        """
+        query = {"_id": ObjectId(user_id), **self.live_filter}
+        if keep_email is not None:
+            query["email"] = {"$ne": keep_email}
+        try:
+            async with self.routing.write_session(self.db.client) as session:
+                user = await self.routed("soft_delete_user").find_one_and_update(
+                    query,
+                    {"$set": {"isDeleted": True, "deletedAt": datetime.now(UTC)}},
+                    projection={"email": 1},
+                    session=session,
+                )
+        except Exception as e:
+            logger.error("Error deleting user %s: %s", user_id, e)
+            return None
+        if user is None:
+            return None
+        self.routing.record(session, self._id_key(user_id), self._email_key(user["email"]))
+        await self.invalidate_user(user_id, user["email"])
+        return user["email"]
+
+    @timed(db_operation_duration_seconds, "user", "purge_deleted_users")
+    async def purge_deleted_users(self, deleted_before: datetime, batch_size: int):
+        """
+        Hard-delete up to `batch_size` users soft-deleted before `deleted_before`.
+        Both steps are served by the partial deleted_at index, so the cost is
+        proportional to the batch, not to the number of users.
+        """
+        cursor = self.users_collection.find(
+            {"isDeleted": True, "deletedAt": {"$lt": deleted_before}}, projection={"_id": 1}
+        ).limit(batch_size)
+        ids = [user["_id"] for user in await cursor.to_list(length=batch_size)]
+        if not ids:
+            return 0
+        result = await self.users_collection.delete_many({"_id": {"$in": ids}, "isDeleted": True})
+        return result.deleted_count
@@ -1,33 +1,88 @@
+import asyncio
+import hashlib
+import hmac
+import time
 import json
+import math
 from datetime import UTC, datetime
 
-from fastapi import APIRouter, Depends, HTTPException, Header, status, Request
-from fastapi.responses import JSONResponse
+from bson import ObjectId
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, status, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer
 
+from src.configs.config import Config
+from src.metrics import registry
+from src.models.token import TokenIntrospectionRequest
 from src.models.user import UserCreate, UserUpdatePassword
+from src.services.admission_service import LoginAdmissionController
+from src.services.container import ServiceContainer
+from src.services.import_service import IMPORT_FORMATS, UserImportService, aiter_lines, parse_records
+from src.services.key_ring import key_ring
 from src.services.token_service import TokenService
 from src.services.user_service import UserService
-from src.logger_setup import setup_logger
+from src.logger_setup import RATE_LIMITED, setup_logger
 
 logger = setup_logger(__name__)
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
+# Services are built once per worker by the lifespan in src/run.py; these
+# dependencies only look them up, so no per-request objects are created.
+
+def get_container(request: Request) -> ServiceContainer:
+    return request.app.state.container
+
 def get_db(request: Request):
-    return request.app.state.db
+    return request.app.state.container.db
 
-def get_user_service(db = Depends(get_db)):
-    return UserService(db)
+def get_login_admission(request: Request) -> LoginAdmissionController:
+    return request.app.state.container.login_admission
 
-def get_token_service(db = Depends(get_db)):
-    return TokenService(db)
+def get_user_service(request: Request) -> UserService:
+    return request.app.state.container.user_service
+
+def get_token_service(request: Request) -> TokenService:
+    return request.app.state.container.token_service
 
 @router.get("/health")
 async def health_check():
+    """Liveness: the process is up and serving. Never touches the database."""
     return {"status": "healthy", "timestamp": datetime.now(UTC) }
 
+@router.get("/ready")
+async def readiness_check(request: Request):
+    """Readiness: startup has finished and MongoDB answered a (cached) ping."""
+    probe = getattr(request.app.state, 'readiness', None)
+    if probe is None:
+        return JSONResponse({"status": "starting"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    ready, _ = await probe.check()
+    if not ready:
+        return JSONResponse({"status": "unavailable"}, status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    return {"status": "ready"}
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(request: Request):
+    # With several workers, serve every worker's metrics rather than just the one that took the scrape.
+    exporter = getattr(request.app.state, 'metrics_exporter', None)
+    body = exporter.render() if exporter is not None else registry.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@router.get("/.well-known/jwks.json")
+async def jwks(request: Request):
+    """
+    Publish the public access-token keys so other services can verify tokens
+    locally. Empty when tokens are signed with the shared secret.
+    """
+    body = json.dumps(key_ring.jwks() if key_ring is not None else {"keys": []}, sort_keys=True)
+    etag = f'"{hashlib.sha256(body.encode("utf-8")).hexdigest()[:32]}"'
+    headers = {"Cache-Control": f"public, max-age={Config.JWKS_MAX_AGE_SECONDS}", "ETag": etag}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
 async def get_current_user_id(
     request: Request,
     authorization: str = Header(None),
@@ -39,7 +94,7 @@ async def get_current_user_id(
     This dependency function attempts to retrieve a bearer token from the request's `Authorization` header,
     falling back to the `Authorization` query parameter if not found. If no token is provided, it returns an
     HTTP 401 Unauthorized error. If a token is found, it uses the `TokenService` to extract and validate the
-    user's ID. If the token is invalid or expired, an HTTP 401 error is raised.
+    user's ID. If the token is invalid, expired or revoked, an HTTP 401 error is raised.
 
     Args:
         request (Request): The incoming request, used to access query parameters.
@@ -52,6 +107,12 @@ async def get_current_user_id(
     Raises:
         HTTPException: If no token is provided or if token validation fails.
     """
+    token = _request_token(request, authorization)
+
+    # Validate the token and extract the user ID via the token service
+    return await token_service.extract_user_id_from_token(token)
+
+def _request_token(request: Request, authorization: str):
     token = None
 
     # Attempt to extract the token from the Authorization header
@@ -72,26 +133,50 @@ async def get_current_user_id(
             detail="Not authenticated",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    return token
 
-    # Validate the token and extract the user ID via the token service
-    return await token_service.extract_user_id_from_token(token)
+async def get_current_admin_user_id(
+    current_user_id: str = Depends(get_current_user_id),
+    user_service: UserService = Depends(get_user_service),
+):
+    if not await user_service.is_admin(current_user_id):
+        logger.warning("User ID %s attempted an admin operation.", current_user_id)
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin privileges required")
+    return current_user_id
 
 class DateTimeEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
             return obj.isoformat()
+        if isinstance(obj, ObjectId):
+            return str(obj)
         return super().default(obj)
 
 @router.post('/api/login/', status_code=status.HTTP_200_OK)
-async def login(request: Request, user_service: UserService = Depends(get_user_service)):
+async def login(
+    request: Request,
+    user_service: UserService = Depends(get_user_service),
+    login_admission: LoginAdmissionController = Depends(get_login_admission)
+):
     data = await request.json()
     email = data.get('email')
     password = data.get('password')
+
+    client_ip = request.client.host if request.client else None
+    retry_after = login_admission.admit(email, client_ip)
+    if retry_after:
+        logger.warning("Login attempt for %s from %s rejected by rate limiter.", email, client_ip)
+        return JSONResponse(
+            {'message': 'Too many login attempts'},
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": str(max(1, math.ceil(min(retry_after, 3600))))},
+        )
+
     response = await user_service.login(email, password)
     if response.status_code == 200:
-        logger.info(f"User {email} logged in successfully.")
+        logger.info("User %s logged in successfully.", email)
     else:
-        logger.warning(f"Failed login attempt for {email}.")
+        logger.warning("Failed login attempt for %s.", email, extra=RATE_LIMITED)
     return response
 
 @router.post('/api/refresh_token/', status_code=status.HTTP_200_OK)
@@ -108,19 +193,79 @@ async def refresh_token(request: Request, token_service: TokenService = Depends(
         logger.info("Refresh token successfully rotated.")
         return response
     except HTTPException as e:
-        logger.error(f"Invalid refresh token: {e.detail}")
+        logger.error("Invalid refresh token: %s", e.detail)
         raise
     except Exception as e:
-        logger.error(f"Unexpected error during token refresh: {e}")
+        logger.error("Unexpected error during token refresh: %s", e)
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Server error")
 
+@router.post('/api/logout/', status_code=status.HTTP_200_OK)
+async def logout(
+    request: Request,
+    authorization: str = Header(None),
+    all_sessions: bool = Query(False, description="Also revoke every other access token of this user."),
+    token_service: TokenService = Depends(get_token_service),
+):
+    """Revoke the presented access token (or all of the user's) and the refresh-token cookie."""
+    payload = token_service.verify_access_token(_request_token(request, authorization))
+    user_id = payload["sub"]
+    refresh_token = request.cookies.get('refresh_token')
+    if all_sessions:
+        await asyncio.gather(
+            token_service.revoke_user_access_tokens(user_id),
+            token_service.revoke_all_sessions(user_id),
+        )
+    else:
+        await token_service.revoke_access_token(payload)
+        if refresh_token:
+            await token_service.revoke_refresh_token(refresh_token)
+
+    logger.info("User %s logged out%s.", user_id, " of all sessions" if all_sessions else "")
+    response = JSONResponse({"message": "Logged out"})
+    response.delete_cookie("refresh_token")
+    return response
+
+@router.post('/api/introspect/', status_code=status.HTTP_200_OK)
+async def introspect_tokens(
+    body: TokenIntrospectionRequest,
+    x_api_key: str = Header(None),
+    token_service: TokenService = Depends(get_token_service),
+):
+    """
+    Validate a batch of access tokens for gateways and sidecars.
+
+    Returns `{"results": [...]}` with one `{"active": ...}` entry per token, in
+    request order. The response may be cached for `Cache-Control: max-age`
+    seconds: until the earliest expiry among the active tokens, capped by
+    INTROSPECTION_MAX_CACHE_SECONDS, which bounds how long a revocation can go
+    unnoticed by callers that cache.
+    """
+    if not Config.INTROSPECTION_API_KEY:
+        # Fail closed: without a key anyone could probe which tokens are valid.
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Introspection is not configured")
+    if not hmac.compare_digest(
+        (x_api_key or '').encode('utf-8'), Config.INTROSPECTION_API_KEY.encode('utf-8')
+    ):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key")
+
+    results = token_service.introspect(body.tokens)
+    max_age = Config.INTROSPECTION_MAX_CACHE_SECONDS
+    now = time.time()
+    for result in results:
+        if result["active"]:
+            max_age = min(max_age, int(result["exp"] - now))
+    return JSONResponse(
+        {"results": results},
+        headers={"Cache-Control": f"private, max-age={max(0, max_age)}"},
+    )
+
 @router.post('/api/register/', status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: UserCreate, user_service: UserService = Depends(get_user_service)):
     user = await user_service.create_user(user_data.email, user_data.password)
     if user is None:
-        logger.warning(f"Attempted to register already existing user: {user_data.email}")
+        logger.warning("Attempted to register already existing user: %s", user_data.email)
         raise HTTPException(status_code=400, detail="User already exists")
-    logger.info(f"User {user_data.email} registered successfully.")
+    logger.info("User %s registered successfully.", user_data.email)
     return {"message": "User registered successfully", "user_id": str(user["_id"])}
 
 @router.post('/api/update_password/', status_code=status.HTTP_200_OK)
@@ -131,17 +276,123 @@ async def update_password(
 ):
     user = await user_service.get_user_by_id(current_user_id)
     if not user:
-        logger.warning(f"Attempted password update for non-existing user ID: {current_user_id}")
+        logger.warning("Attempted password update for non-existing user ID: %s", current_user_id)
         raise HTTPException(status_code=404, detail="User not found")
 
-    if not user_service.validate_user_password(user, user_data.current_password):
-        logger.warning(f"Incorrect current password for user ID: {current_user_id}")
+    if not await user_service.validate_user_password(user, user_data.current_password):
+        logger.warning("Incorrect current password for user ID: %s", current_user_id)
         raise HTTPException(status_code=400, detail="Current password is incorrect")
 
     updated = await user_service.update_user_password(current_user_id, user_data.new_password)
     if updated:
-        logger.info(f"Password updated successfully for user ID: {current_user_id}")
-        return {"message": "Password updated successfully"}
+        logger.info("Password updated successfully for user ID: %s", current_user_id)
+        # Every earlier access token was just revoked, including the caller's; hand
+        # this session a fresh pair so it stays signed in.
+        return await user_service.create_session_response(user, "Password updated successfully")
     else:
-        logger.error(f"Failed to update password for user ID: {current_user_id}")
+        logger.error("Failed to update password for user ID: %s", current_user_id)
         raise HTTPException(status_code=500, detail="Failed to update password")
+
+@router.delete('/api/users/me', status_code=status.HTTP_204_NO_CONTENT)
+async def delete_own_account(
+    current_user_id: str = Depends(get_current_user_id),
+    user_service: UserService = Depends(get_user_service)
+):
+    if not await user_service.delete_user(current_user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+
+@router.delete('/api/admin/users/{user_id}', status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user(
+    user_id: str,
+    admin_user_id: str = Depends(get_current_admin_user_id),
+    user_service: UserService = Depends(get_user_service)
+):
+    if not ObjectId.is_valid(user_id):
+        raise HTTPException(status_code=400, detail="Invalid user id")
+    if not await user_service.delete_user(user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    logger.info("Admin %s deleted user %s.", admin_user_id, user_id)
+
+@router.post('/api/admin/users/import', status_code=status.HTTP_200_OK)
+async def import_users(
+    request: Request,
+    fmt: str = Query('ndjson', alias='format'),
+    admin_user_id: str = Depends(get_current_admin_user_id),
+    container: ServiceContainer = Depends(get_container)
+):
+    """
+    Bulk-import users from the raw request body.
+
+    The body is newline-delimited JSON (`format=ndjson`) or CSV with an
+    `email,password` header (`format=csv`). It is streamed, never buffered whole,
+    and the response is the import report with per-row duplicates and failures.
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, expected one of {', '.join(IMPORT_FORMATS)}")
+
+    logger.info("Admin %s started a bulk %s user import.", admin_user_id, fmt)
+    importer = UserImportService(container.user_repository, hashing_pool=container.hashing_pool)
+    report = await importer.import_users(parse_records(aiter_lines(request.stream()), fmt))
+    return report.to_dict()
+
+@router.get('/api/admin/users', status_code=status.HTTP_200_OK)
+async def list_users(
+    limit: int = Query(100, ge=1, le=1000),
+    after: str = Query(None, description="Return users after this user id (the previous page's next_cursor)."),
+    fmt: str = Query('json', alias='format'),
+    admin_user_id: str = Depends(get_current_admin_user_id),
+    user_service: UserService = Depends(get_user_service)
+):
+    """
+    List live users in id order, without password hashes.
+
+    `format=json` returns one page and a `next_cursor` for the following one.
+    `format=ndjson` streams every user after `after` as newline-delimited JSON
+    straight from the database cursor (`limit` is ignored), so an export of any
+    size runs in constant memory.
+    """
+    if fmt not in ('json', 'ndjson'):
+        raise HTTPException(status_code=400, detail="Unsupported format, expected json or ndjson")
+    if after is not None and not ObjectId.is_valid(after):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    user_repository = user_service.user_repository
+    if fmt == 'json':
+        users = await user_repository.list_users(after_id=after, limit=limit)
+        next_cursor = str(users[-1]["_id"]) if len(users) == limit else None
+        body = json.dumps({"users": users, "next_cursor": next_cursor}, cls=DateTimeEncoder)
+        return Response(body, media_type="application/json")
+
+    logger.info("Admin %s started an NDJSON user export.", admin_user_id)
+
+    async def export(chunk_size=500):
+        lines = []
+        async for user in user_repository.iter_users(after_id=after):
+            lines.append(json.dumps(user, cls=DateTimeEncoder))
+            if len(lines) >= chunk_size:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    return StreamingResponse(export(), media_type="application/x-ndjson")
+
+@router.get('/api/admin/profiles', response_class=PlainTextResponse)
+async def get_profiles(
+    request: Request,
+    mode: str = Query('wall', pattern='^(wall|cpu)$'),
+    route: str = Query(None, description='Only this route, e.g. "POST /api/login/".'),
+    admin_user_id: str = Depends(get_current_admin_user_id),
+):
+    """Profiled request stacks in collapsed format, for flamegraph.pl or speedscope."""
+    profiler = getattr(request.app.state, 'profiler', None)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    return PlainTextResponse(profiler.store.collapsed(mode, route))
+
+@router.delete('/api/admin/profiles', status_code=status.HTTP_204_NO_CONTENT)
+async def clear_profiles(request: Request, admin_user_id: str = Depends(get_current_admin_user_id)):
+    profiler = getattr(request.app.state, 'profiler', None)
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled")
+    profiler.store.clear()
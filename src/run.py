@@ -1,35 +1,209 @@
+import time
+_imports_started = time.perf_counter()
+
+import asyncio
+import glob
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI
 import uvicorn
+from uvicorn.middleware.proxy_headers import ProxyHeadersMiddleware
 
-
-from motor.motor_asyncio import AsyncIOMotorClient
 from src.configs.config import Config
+from src.metrics import MetricsMiddleware, MultiprocessMetrics, registry, stats_collector
+from src.mongo_client import DATABASE_NAME, create_mongo_client, get_database, prewarm_pool
+from src.mongo_monitoring import MongoPoolMetrics
+from src.profiling import ProfileStore, ProfilingMiddleware, SamplingProfiler
+from src.repository.routing import default_routing
+from src.repository.user_repository import default_user_cache
+from src.services.container import ServiceContainer
+from src.services.hashing_service import PasswordHasher, calibrate_rounds
+from src.services.token_service import access_token_cache, invalid_token_cache
 from src.services.init_service import InitService
+from src.services.readiness_service import ReadinessProbe
 from src.router.api import router
-from src.logger_setup import setup_logger
+from src.logger_setup import logging_pipeline, setup_logger
 
 logger = setup_logger(__name__)
 
-def create_app():
-    app = FastAPI()
-    app.state.config = Config
+IMPORT_SECONDS = time.perf_counter() - _imports_started
+
+class StartupTimer:
+    """Wall time of each startup phase, logged once ready and exported on /metrics."""
 
-    # Initialize MongoDB async client and set it in app state
+    def __init__(self):
+        self.phases = {"imports": IMPORT_SECONDS}
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = time.perf_counter() - started
+
+    def stats(self):
+        return {"phase_seconds": self.phases, "total_seconds": sum(self.phases.values())}
+
+def register_stats_collectors(app):
+    sources = [
+        ("access_token_cache", access_token_cache.stats, "Verified access-token cache."),
+        ("invalid_token_cache", invalid_token_cache.stats, "Introspection cache of invalid tokens."),
+        ("user_cache", default_user_cache.stats, "User lookup cache."),
+        ("read_routing", default_routing.stats, "Read-your-writes tokens for secondary reads."),
+        ("logging", logging_pipeline.stats, "Asynchronous logging pipeline."),
+    ]
+    sources.append(("startup", app.state.startup.stats, "Startup phase durations."))
+    container = getattr(app.state, 'container', None)
+    if container is not None:
+        sources.append(("hashing_pool", container.hashing_pool.stats, "Password hashing pool state."))
+        sources.append(("login_admission", container.login_admission.stats, "Login admission control."))
+        sources.append(("revocation", container.revocation_service.stats, "Access-token revocation mirror."))
+        sources.append(("refresh_token_store", container.token_store_stats.stats, "Refresh-token collection."))
+        if container.token_repository.write_buffer is not None:
+            sources.append(("refresh_token_buffer", container.token_repository.write_buffer.stats,
+                            "Write-behind buffer for refresh tokens."))
+        sources.append(("user_purge", container.user_purge_job.stats, "Purge of soft-deleted users."))
+        sources.append(("user_lookups", container.user_repository.lookups.stats, "Coalesced user lookups."))
+        sources.append(("refresh_rotations", container.token_service.refreshes.stats,
+                        "Coalesced refresh-token rotations."))
+    if app.state.profiler is not None:
+        sources.append(("profiler", app.state.profiler.stats, "Request sampling profiler."))
+    if app.state.mongo_metrics is not None:
+        sources.append(("mongo_pool", app.state.mongo_metrics.stats, "MongoDB pool and commands."))
+    for prefix, stats, documentation in sources:
+        registry.register_collector(prefix, stats_collector(prefix, stats, documentation))
+
+async def calibrate_password_hashing():
+    loop = asyncio.get_running_loop()
+    rounds, timings = await loop.run_in_executor(None, calibrate_rounds, Config.BCRYPT_TARGET_VERIFY_MS)
+    logger.info(
+        "Calibrated bcrypt cost %s for a %s ms verify target (%.1f ms measured).",
+        rounds, Config.BCRYPT_TARGET_VERIFY_MS, timings[rounds],
+    )
+    PasswordHasher.rounds = rounds
+
+async def _prewarm_pool(mongo_client):
+    try:
+        await prewarm_pool(mongo_client)
+    except Exception as e:
+        logger.error("Error pre-warming MongoDB connection pool: %s", e)
+
+def _connect(app):
+    """
+    Create this worker's MongoDB client. It is only ever created inside the
+    lifespan, i.e. in the worker process itself, so no client (and none of its
+    sockets or monitor threads) is shared across processes.
+    """
     logger.info("Initializing MongoDB client.")
-    MONGODB_URI = Config.MONGODB_URI
-    if int(Config.IS_MONGO_LOCAL):
-        mongo_client = AsyncIOMotorClient(MONGODB_URI)
+    mongo_metrics = MongoPoolMetrics() if int(Config.MONGO_MONITORING_ENABLED) else None
+    app.state.mongo_metrics = mongo_metrics
+    app.state.mongo_client = create_mongo_client(mongo_metrics)
+    app.state.owns_mongo_client = True
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup = app.state.startup
+    if int(Config.BCRYPT_CALIBRATE_ON_STARTUP):
+        with startup.phase("bcrypt_calibration"):
+            await calibrate_password_hashing()
+
+    if app.state.mongo_client is None:
+        _connect(app)
+    app.state.db = get_database(app.state.mongo_client, app.state.database_name)
+
+    logger.info("Building service container.")
+    with startup.phase("container"):
+        app.state.container = ServiceContainer(app.state.db)
+    register_stats_collectors(app)
+
+    init_service = InitService(app.state.container)
+    if int(Config.SKIP_STARTUP_SEEDING):
+        # The supervisor already built indexes and seeded before starting workers.
+        with startup.phase("pool"):
+            await asyncio.gather(
+                _prewarm_pool(app.state.mongo_client),
+                app.state.container.user_repository.load_migration_state(),
+            )
     else:
-        mongo_client = AsyncIOMotorClient(
-            MONGODB_URI,
-            tls=True,
-            retryWrites=False,
-            tlsCAFile=Config.CA_FILE,
-            socketTimeoutMS=60000,
-            connectTimeoutMS=60000
+        # Opening pool connections and building indexes are independent round trips.
+        logger.info("Pre-warming MongoDB connection pool and ensuring indexes.")
+        with startup.phase("pool_and_indexes"):
+            await asyncio.gather(_prewarm_pool(app.state.mongo_client), init_service.ensure_indexes())
+        logger.info("Seeding initial data.")
+        with startup.phase("seed"):
+            await init_service.seed_users()
+
+    with startup.phase("revocations"):
+        await app.state.container.revocation_service.start()
+    app.state.container.token_store_stats.start()
+    refresh_token_buffer = app.state.container.token_repository.write_buffer
+    if refresh_token_buffer is not None:
+        refresh_token_buffer.start()
+    if int(Config.USER_PURGE_ENABLED):
+        app.state.container.user_purge_job.start()
+
+    if Config.METRICS_MULTIPROC_DIR:
+        app.state.metrics_exporter = MultiprocessMetrics(
+            registry, Config.METRICS_MULTIPROC_DIR, Config.METRICS_SNAPSHOT_SECONDS
         )
-    app.state.db = mongo_client['user-management-db']
+        app.state.metrics_exporter.start()
+
+    app.state.readiness = ReadinessProbe.from_config(app.state.mongo_client)
+    logger.info(
+        "Ready after %.3fs (%s).",
+        startup.stats()["total_seconds"],
+        ", ".join(f"{name} {seconds:.3f}s" for name, seconds in startup.phases.items()),
+    )
+
+    yield
+
+    app.state.readiness = None
+    if refresh_token_buffer is not None:
+        logger.info("Flushing buffered refresh tokens.")
+        await refresh_token_buffer.stop()
+    await app.state.container.revocation_service.stop()
+    await app.state.container.token_store_stats.stop()
+    await app.state.container.user_purge_job.stop()
+    if app.state.metrics_exporter is not None:
+        await app.state.metrics_exporter.stop()
+        app.state.metrics_exporter = None
+
+    logger.info("Shutting down password hashing pool.")
+    app.state.container.hashing_pool.shutdown(wait=False)
+    logger.info("Closing MongoDB client.")
+    app.state.mongo_client.close()
+    if app.state.owns_mongo_client:
+        app.state.mongo_client = None
+
+def create_app(mongo_client=None, database_name: str = DATABASE_NAME):
+    """
+    Build the application. Without `mongo_client`, the client is created by the
+    lifespan when the app starts, so importing this module never connects.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.state.config = Config
+    app.state.startup = StartupTimer()
+    # Set once the lifespan has finished starting up; /ready reports 503 until then.
+    app.state.readiness = None
+
+    app.state.database_name = database_name
+    app.state.mongo_metrics = None
+    app.state.mongo_client = mongo_client
+    app.state.owns_mongo_client = False
+    app.state.db = get_database(mongo_client, database_name) if mongo_client is not None else None
+
+    app.state.metrics_exporter = None
+    app.state.profiler = None
+    if int(Config.PROFILING_ENABLED):
+        app.state.profiler = SamplingProfiler(
+            ProfileStore(Config.PROFILING_MAX_STACKS), interval_seconds=Config.PROFILING_INTERVAL_MS / 1000
+        )
+
+    register_stats_collectors(app)
 
     app.add_middleware(
         CORSMiddleware,
@@ -38,21 +212,69 @@ def create_app():
         allow_methods=["GET", "POST", "PUT", "DELETE"],
         allow_headers=["Authorization", "Content-Type"],
     )
+    # Only installed when enabled, so requests pay nothing for it otherwise.
+    if app.state.profiler is not None:
+        app.add_middleware(
+            ProfilingMiddleware,
+            profiler=app.state.profiler,
+            sample_rate=Config.PROFILING_SAMPLE_RATE,
+            header=Config.PROFILING_HEADER,
+        )
+    app.add_middleware(MetricsMiddleware)
+    # Outermost, so everything inside (e.g. login admission per client IP) sees the
+    # client behind a trusted proxy rather than the proxy itself.
+    app.add_middleware(ProxyHeadersMiddleware, trusted_hosts=Config.TRUSTED_PROXY_IPS)
 
     logger.info("Including main router.")
     app.include_router(router)
 
-    @app.on_event("startup")
-    async def startup_event():
-        logger.info("Seeding initial data.")
-        init_service = InitService(app)
-        await init_service.seed_admin_user()
-        await init_service.seed_quest_user()
-
     return app
 
+async def prepare_database(database_name: str = DATABASE_NAME):
+    """Build indexes and seed users once, before any worker starts."""
+    mongo_client = create_mongo_client()
+    container = ServiceContainer(get_database(mongo_client, database_name))
+    try:
+        init_service = InitService(container)
+        await init_service.ensure_indexes()
+        await init_service.seed_users()
+    finally:
+        container.hashing_pool.shutdown()
+        mongo_client.close()
+
+def serve(workers: int = None):
+    workers = max(1, workers or Config.WEB_WORKERS)
+    # Workers size their share of the login limits and the hashing pool by this.
+    os.environ['WEB_WORKERS'] = str(workers)
+    if workers > 1:
+        # Work that must happen once per deployment runs here in the supervisor;
+        # workers are spawned (not forked) and inherit these settings through the
+        # environment, so they agree on the bcrypt cost and skip seeding.
+        if int(Config.BCRYPT_CALIBRATE_ON_STARTUP):
+            asyncio.run(calibrate_password_hashing())
+            os.environ['BCRYPT_ROUNDS'] = str(PasswordHasher.rounds)
+            os.environ['BCRYPT_CALIBRATE_ON_STARTUP'] = '0'
+        # Scrapes reach a single worker, which then serves every worker's snapshot.
+        metrics_dir = os.environ.get('METRICS_MULTIPROC_DIR') or tempfile.mkdtemp(prefix='user-management-metrics-')
+        for snapshot in glob.glob(os.path.join(metrics_dir, '*.json')):
+            os.remove(snapshot)
+        os.environ['METRICS_MULTIPROC_DIR'] = metrics_dir
+        logger.info("Preparing database before starting %s workers.", workers)
+        asyncio.run(prepare_database())
+        os.environ['SKIP_STARTUP_SEEDING'] = '1'
+
+    logger.info("Starting Uvicorn server with %s worker(s).", workers)
+    uvicorn.run(
+        "src.run:app" if workers > 1 else app,
+        host='0.0.0.0',
+        port=Config.PORT,
+        workers=workers,
+        # The app installs ProxyHeadersMiddleware itself, with TRUSTED_PROXY_IPS.
+        proxy_headers=False,
+        timeout_graceful_shutdown=Config.GRACEFUL_SHUTDOWN_SECONDS,
+    )
+
 app = create_app()
 
 if __name__ == '__main__':
-    logger.info("Starting Uvicorn server.")
-    uvicorn.run(app, host='0.0.0.0', port=Config.PORT)
+    serve()
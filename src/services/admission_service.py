@@ -0,0 +1,113 @@
+import math
+import time
+from collections import OrderedDict
+
+from src.configs.config import Config
+
+
+class TokenBucketLimiter:
+    """
+    Per-key token buckets kept in a bounded LRU.
+
+    Each bucket is a two-element list `[tokens, updated_at]`. When more than
+    `max_keys` keys are tracked the least recently seen bucket is dropped, which
+    only ever makes the limiter more lenient for that key.
+    """
+
+    def __init__(self, rate_per_minute: float, burst: int, max_keys: int):
+        self.rate_per_second = rate_per_minute / 60.0
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self.evictions = 0
+
+    def acquire(self, key, now: float = None):
+        """Take one token for `key`. Returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic() if now is None else now
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(self.burst), now]
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+                self.evictions += 1
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate_per_second)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0
+        if self.rate_per_second <= 0:
+            return math.inf
+        return (1 - bucket[0]) / self.rate_per_second
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class LoginAdmissionController:
+    """
+    Cheap pre-check for login attempts, run before any Mongo lookup or bcrypt work.
+
+    Attempts are limited per client IP and per email; the first exhausted limit
+    rejects the attempt and reports how long the caller should back off.
+    """
+
+    def __init__(self, email_limiter: TokenBucketLimiter, ip_limiter: TokenBucketLimiter, enabled: bool = True):
+        self.enabled = enabled
+        self.email_limiter = email_limiter
+        self.ip_limiter = ip_limiter
+        self.allowed = 0
+        self.rejected_email = 0
+        self.rejected_ip = 0
+
+    def admit(self, email, client_ip):
+        if not self.enabled:
+            return 0
+        now = time.monotonic()
+        if client_ip:
+            retry_after = self.ip_limiter.acquire(client_ip, now)
+            if retry_after:
+                self.rejected_ip += 1
+                return retry_after
+        if email:
+            retry_after = self.email_limiter.acquire(str(email).strip().lower(), now)
+            if retry_after:
+                self.rejected_email += 1
+                return retry_after
+        self.allowed += 1
+        return 0
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "allowed": self.allowed,
+            "rejected_email": self.rejected_email,
+            "rejected_ip": self.rejected_ip,
+            "tracked_emails": len(self.email_limiter),
+            "tracked_ips": len(self.ip_limiter),
+            "evictions": self.email_limiter.evictions + self.ip_limiter.evictions,
+        }
+
+
+def build_login_admission(workers: int = None):
+    """
+    Admission control for one of `workers` server processes. The configured rates
+    and bursts are for the whole server: connections are spread over the worker
+    processes, so each one enforces its share of the limits.
+    """
+    workers = max(1, workers or Config.WEB_WORKERS)
+    return LoginAdmissionController(
+        email_limiter=TokenBucketLimiter(
+            Config.LOGIN_EMAIL_RATE_PER_MINUTE / workers,
+            max(1, math.ceil(Config.LOGIN_EMAIL_BURST / workers)),
+            Config.LOGIN_LIMITER_MAX_KEYS,
+        ),
+        ip_limiter=TokenBucketLimiter(
+            Config.LOGIN_IP_RATE_PER_MINUTE / workers,
+            max(1, math.ceil(Config.LOGIN_IP_BURST / workers)),
+            Config.LOGIN_LIMITER_MAX_KEYS,
+        ),
+        enabled=bool(int(Config.LOGIN_RATE_LIMIT_ENABLED)),
+    )
@@ -0,0 +1,58 @@
+from src.configs.config import Config
+from src.metrics import AsyncStatsPoller
+from src.repository.revocation_repository import RevocationRepository
+from src.repository.token_repository import TokenRepository
+from src.repository.user_repository import UserRepository
+from src.services.admission_service import LoginAdmissionController, build_login_admission
+from src.services.hashing_service import HashingPool, hashing_pool as default_hashing_pool
+from src.services.purge_service import UserPurgeJob
+from src.services.revocation_service import RevocationService
+from src.services.token_service import TokenService
+from src.services.user_service import UserService
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+
+def refresh_token_write_behind_enabled(workers: int = None):
+    """
+    Whether refresh tokens go through the write-behind buffer. The buffer is
+    per process, so with several workers it is refused: a token buffered by
+    one worker could be refreshed or revoked on another before it is written.
+    """
+    if not int(Config.REFRESH_TOKEN_WRITE_BEHIND_ENABLED):
+        return False
+    workers = max(1, workers or Config.WEB_WORKERS)
+    if workers > 1:
+        logger.warning("REFRESH_TOKEN_WRITE_BEHIND_ENABLED ignored: it needs a single worker, not %s.", workers)
+        return False
+    return True
+
+
+class ServiceContainer:
+    """
+    The per-worker object graph. Built once in the app's lifespan and shared by
+    every request through the dependencies in src/router/api.py; tests can swap
+    in their own container (or individual services) on `app.state.container`.
+
+    Each container gets its own login admission controller. The hashing pool
+    defaults to the process-wide one, since its threads are sized for the host.
+    """
+
+    def __init__(self, db, login_admission: LoginAdmissionController = None, hashing_pool: HashingPool = None):
+        self.db = db
+        self.login_admission = login_admission or build_login_admission()
+        self.hashing_pool = hashing_pool or default_hashing_pool
+        self.user_repository = UserRepository(db)
+        self.token_repository = TokenRepository(db, write_behind=refresh_token_write_behind_enabled())
+        self.token_store_stats = AsyncStatsPoller(self.token_repository.store_stats, Config.TOKEN_STORE_STATS_SECONDS)
+        self.revocation_repository = RevocationRepository(db)
+        self.revocation_service = RevocationService.from_config(self.revocation_repository)
+        self.token_service = TokenService(
+            db, token_repository=self.token_repository, revocation_service=self.revocation_service
+        )
+        self.user_service = UserService(
+            db, user_repository=self.user_repository, token_service=self.token_service,
+            hashing_pool=self.hashing_pool,
+        )
+        self.user_purge_job = UserPurgeJob.from_config(self.user_repository)
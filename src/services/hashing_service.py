@@ -1,11 +1,207 @@
+import asyncio
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
 import bcrypt
+from fastapi import HTTPException
+from starlette.status import HTTP_503_SERVICE_UNAVAILABLE
+
+from src.configs.config import Config
+from src.metrics import password_hash_duration_seconds
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+
+MIN_BCRYPT_ROUNDS = 10
+MAX_BCRYPT_ROUNDS = 16
+
+
+def _hash(password: str, rounds: int) -> str:
+    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds))
+    return hashed.decode('utf-8')
+
+
+def _check(hashed_password: str, user_password: str) -> bool:
+    return bcrypt.checkpw(user_password.encode('utf-8'), hashed_password.encode('utf-8'))
+
+
+def hash_rounds(hashed_password: str):
+    """The cost factor of a modular-crypt bcrypt hash ("$2b$12$..." -> 12), or None."""
+    try:
+        return int(hashed_password.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def measure_verify_seconds(rounds: int, samples: int = 3) -> float:
+    """Best-of-`samples` wall time of one bcrypt check at `rounds` on this host."""
+    hashed = _hash('calibration-password', rounds)
+    best = float('inf')
+    for _ in range(samples):
+        started = time.perf_counter()
+        _check(hashed, 'calibration-password')
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def calibrate_rounds(target_ms: float, min_rounds: int = MIN_BCRYPT_ROUNDS, max_rounds: int = MAX_BCRYPT_ROUNDS):
+    """
+    Highest cost whose verify time stays under `target_ms` on this host, with the
+    measured timings per cost. Each extra round doubles the work, so the search
+    stops at the first cost over the target. Never returns less than `min_rounds`.
+    """
+    chosen = min_rounds
+    timings = {}
+    for rounds in range(min_rounds, max_rounds + 1):
+        timings[rounds] = measure_verify_seconds(rounds) * 1000
+        if timings[rounds] > target_ms:
+            break
+        chosen = rounds
+    return chosen, timings
+
+
+def _timed(fn, *args):
+    # Runs inside the worker. time.monotonic() is system-wide on the platforms we
+    # deploy to, so the timestamps are comparable across processes.
+    started = time.monotonic()
+    result = fn(*args)
+    return started, time.monotonic(), result
+
+
+class HashingPool:
+    """
+    Bounded executor for bcrypt work.
+
+    At most `max_workers` hashes run at once; up to `max_queue` more may wait for
+    a worker. Anything beyond that is rejected with a 503 instead of piling up
+    behind the event loop.
+    """
+
+    def __init__(self, kind: str = 'thread', max_workers: int = 1, max_queue: int = 0):
+        if kind not in ('thread', 'process'):
+            raise ValueError(f"Unsupported hashing pool kind: {kind}")
+        self.kind = kind
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = None
+
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hashing')
+        return self._executor
+
+    @property
+    def queue_depth(self):
+        return max(0, self.pending - self.max_workers)
+
+    @property
+    def saturated(self):
+        return self.pending >= self.max_workers + self.max_queue
+
+    async def run(self, fn, *args, operation: str = None):
+        if self.saturated:
+            self.rejected += 1
+            logger.warning("Hashing pool saturated (%s pending), rejecting request.", self.pending)
+            raise HTTPException(
+                status_code=HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Server busy, try again later",
+                headers={"Retry-After": "1"},
+            )
+
+        self.pending += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        submitted = time.monotonic()
+        try:
+            loop = asyncio.get_running_loop()
+            started, finished, result = await loop.run_in_executor(self.executor, _timed, fn, *args)
+        finally:
+            self.pending -= 1
+
+        wait = max(0.0, started - submitted)
+        self.completed += 1
+        self.total_wait_seconds += wait
+        self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        if operation is not None:
+            password_hash_duration_seconds.labels(operation).observe(finished - started)
+        return result
+
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_wait_seconds": self.total_wait_seconds / self.completed if self.completed else 0.0,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+def build_hashing_pool(workers: int = None):
+    """
+    The hashing pool of one of `workers` server processes. HASHING_POOL_WORKERS and
+    HASHING_POOL_MAX_QUEUE are for the whole server, so that N processes don't run
+    N times as many bcrypt threads as there are cores.
+    """
+    workers = max(1, workers or Config.WEB_WORKERS)
+    return HashingPool(
+        kind=Config.HASHING_POOL_KIND,
+        max_workers=max(1, Config.HASHING_POOL_WORKERS // workers),
+        max_queue=-(-Config.HASHING_POOL_MAX_QUEUE // workers),
+    )
+
+
+# The process-wide default. The service container holds a reference to it, so
+# tests and tools can hand a container a pool of its own instead.
+hashing_pool = build_hashing_pool()
+
 
 class PasswordHasher:
+    # Target cost for new hashes. Replaced at startup when calibration is enabled.
+    rounds = Config.BCRYPT_ROUNDS
+
     @staticmethod
     def hash_password(password: str) -> str:
-        hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
-        return hashed.decode('utf-8')
-    
+        return _hash(password, PasswordHasher.rounds)
+
+    @staticmethod
+    def hash_passwords(passwords: list, rounds: int = None) -> list:
+        # Runs in worker processes during imports, so the cost is passed in rather
+        # than read from the class, which may have been calibrated in the parent only.
+        return [_hash(password, rounds or PasswordHasher.rounds) for password in passwords]
+
     @staticmethod
     def check_password(hashed_password: str, user_password: str) -> bool:
-        return bcrypt.checkpw(user_password.encode('utf-8'), hashed_password.encode('utf-8'))
+        return _check(hashed_password, user_password)
+
+    @staticmethod
+    def needs_rehash(hashed_password: str) -> bool:
+        return hash_rounds(hashed_password) != PasswordHasher.rounds
+
+    @staticmethod
+    async def hash_password_async(password: str, pool: HashingPool = None) -> str:
+        return await (pool or hashing_pool).run(_hash, password, PasswordHasher.rounds, operation='hash')
+
+    @staticmethod
+    async def check_password_async(hashed_password: str, user_password: str, pool: HashingPool = None) -> bool:
+        return await (pool or hashing_pool).run(_check, hashed_password, user_password, operation='check')
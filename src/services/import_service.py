@@ -0,0 +1,264 @@
+import asyncio
+import csv
+import json
+import time
+
+from pydantic import ValidationError
+
+from src.configs.config import Config
+from src.models.user import UserCreate
+from src.services.hashing_service import HashingPool, PasswordHasher, hashing_pool as default_hashing_pool
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+POOL_BUSY_RETRY_SECONDS = 0.05
+DUPLICATE_KEY_ERROR = 11000
+
+
+def _decode(line: bytes):
+    # A line that isn't UTF-8 is yielded as its UnicodeDecodeError, so that
+    # parse_records reports it as a failed row instead of aborting the import.
+    try:
+        return line.decode('utf-8').rstrip('\r\n')
+    except UnicodeDecodeError as e:
+        return e
+
+
+async def aiter_lines(chunks):
+    """Split an async iterator of byte chunks into decoded text lines."""
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield _decode(line)
+    if buffer:
+        yield _decode(buffer)
+
+
+async def iter_file_lines(path):
+    with open(path, 'rb') as f:
+        for line in f:
+            yield _decode(line)
+
+
+async def parse_records(lines, fmt):
+    """
+    Turn an async iterator of lines into `(row_number, record)` pairs.
+
+    Rows that cannot be decoded or parsed are yielded with the exception in place
+    of the record, so they show up in the import report instead of aborting it.
+    Row numbers are 1-based and count data rows only (the CSV header is skipped).
+    """
+    if fmt not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    header = None
+    row_number = 0
+    async for line in lines:
+        if isinstance(line, Exception):
+            row_number += 1
+            yield row_number, line
+            continue
+        if not line.strip():
+            continue
+        if fmt == 'csv' and header is None:
+            header = next(csv.reader([line]))
+            continue
+
+        row_number += 1
+        try:
+            if fmt == 'ndjson':
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("Expected a JSON object")
+            else:
+                record = dict(zip(header, next(csv.reader([line]))))
+        except Exception as e:
+            record = e
+        yield row_number, record
+
+
+class ImportReport:
+    def __init__(self, max_error_details: int):
+        self.max_error_details = max_error_details
+        self.rows = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.failed = 0
+        self.duplicate_rows = []
+        self.failures = []
+        self.started = time.monotonic()
+
+    @property
+    def elapsed_seconds(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed_seconds
+        return self.rows / elapsed if elapsed else 0.0
+
+    def add_duplicate(self, row, email):
+        self.duplicates += 1
+        if len(self.duplicate_rows) < self.max_error_details:
+            self.duplicate_rows.append({"row": row, "email": email})
+
+    def add_failure(self, row, error):
+        self.failed += 1
+        if len(self.failures) < self.max_error_details:
+            self.failures.append({"row": row, "error": error})
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "failed": self.failed,
+            "elapsed_seconds": round(self.elapsed_seconds, 3),
+            "rows_per_second": round(self.rows_per_second, 1),
+            "duplicate_rows": self.duplicate_rows,
+            "failures": self.failures,
+            "details_truncated": (
+                self.duplicates > len(self.duplicate_rows) or self.failed > len(self.failures)
+            ),
+        }
+
+
+class UserImportService:
+    """
+    Streams user records into the users collection.
+
+    Records are validated one by one, hashed and written with unordered
+    `insert_many` batches. With an `executor` (the command-line importer's own
+    process pool) each batch is hashed in `workers` parallel chunks. Otherwise it
+    goes through the server's hashing pool in small chunks, one at a time, so an
+    import holds a single pool slot and logins queue behind one chunk at most. Hashing of the next batch overlaps
+    with the insert of the previous one. Duplicates are detected by the unique email
+    index, so they cost nothing extra.
+    """
+
+    def __init__(
+        self,
+        user_repository,
+        batch_size: int = Config.BULK_IMPORT_BATCH_SIZE,
+        workers: int = Config.BULK_IMPORT_WORKERS,
+        max_error_details: int = Config.BULK_IMPORT_MAX_ERROR_DETAILS,
+        progress_every: int = Config.BULK_IMPORT_PROGRESS_EVERY,
+        pool_chunk_size: int = Config.BULK_IMPORT_POOL_CHUNK_SIZE,
+        hashing_pool: HashingPool = None,
+    ):
+        self.user_repository = user_repository
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.max_error_details = max_error_details
+        self.progress_every = progress_every
+        self.pool_chunk_size = max(1, pool_chunk_size)
+        self.hashing_pool = hashing_pool or default_hashing_pool
+
+    async def import_users(self, records, executor=None):
+        report = ImportReport(self.max_error_details)
+
+        pending_insert = None
+        batch = []
+        next_progress = self.progress_every
+        async for row, record in records:
+            report.rows += 1
+            user = self._validate(row, record, report)
+            if user is not None:
+                batch.append(user)
+
+            if len(batch) >= self.batch_size:
+                pending_insert = await self._flush(batch, executor, pending_insert, report)
+                batch = []
+
+            if self.progress_every and report.rows >= next_progress:
+                next_progress += self.progress_every
+                logger.info(
+                    "Import progress: %s rows read, %s inserted, %s duplicates, %s failed (%.0f rows/s).",
+                    report.rows, report.inserted, report.duplicates, report.failed, report.rows_per_second,
+                )
+
+        if batch:
+            pending_insert = await self._flush(batch, executor, pending_insert, report)
+        if pending_insert is not None:
+            await pending_insert
+
+        logger.info(
+            "Import finished: %s rows, %s inserted, %s duplicates, %s failed in %.1fs (%.0f rows/s).",
+            report.rows, report.inserted, report.duplicates, report.failed, report.elapsed_seconds,
+            report.rows_per_second,
+        )
+        return report
+
+    def _validate(self, row, record, report):
+        if isinstance(record, Exception):
+            reason = "Invalid UTF-8" if isinstance(record, UnicodeDecodeError) else "Unparseable record"
+            report.add_failure(row, f"{reason}: {record}")
+            return None
+        try:
+            user = UserCreate(email=record.get('email'), password=record.get('password'))
+        except ValidationError as e:
+            errors = "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors())
+            report.add_failure(row, errors)
+            return None
+        if user.email == Config.ADMIN_EMAIL:
+            report.add_failure(row, "email: reserved for the admin account")
+            return None
+        return row, user.email, user.password
+
+    async def _flush(self, batch, executor, pending_insert, report):
+        hashes = await self._hash_batch(batch, executor)
+        # Keep at most one insert in flight so memory stays bounded by two batches.
+        if pending_insert is not None:
+            await pending_insert
+        return asyncio.ensure_future(self._insert_batch(batch, hashes, report))
+
+    async def _hash_batch(self, batch, executor):
+        passwords = [password for _, _, password in batch]
+        rounds = PasswordHasher.rounds
+        if executor is None:
+            # The web app hashes on the pool its workers already have; starting a
+            # process pool per request would put its start-up cost on the request.
+            hashes = []
+            for i in range(0, len(passwords), self.pool_chunk_size):
+                hashes.extend(await self._hash_on_pool(passwords[i:i + self.pool_chunk_size], rounds))
+            return hashes
+
+        chunk_size = -(-len(passwords) // self.workers)
+        chunks = [passwords[i:i + chunk_size] for i in range(0, len(passwords), chunk_size)]
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(
+            *(loop.run_in_executor(executor, PasswordHasher.hash_passwords, chunk, rounds) for chunk in chunks)
+        )
+        return [hashed for chunk in results for hashed in chunk]
+
+    async def _hash_on_pool(self, passwords, rounds):
+        # A saturated pool means logins are waiting; the import yields to them
+        # instead of failing halfway through.
+        while self.hashing_pool.saturated:
+            await asyncio.sleep(POOL_BUSY_RETRY_SECONDS)
+        return await self.hashing_pool.run(PasswordHasher.hash_passwords, passwords, rounds)
+
+    async def _insert_batch(self, batch, hashes, report):
+        documents = [
+            {"email": email, "password": hashed}
+            for (_, email, _), hashed in zip(batch, hashes)
+        ]
+        try:
+            inserted, write_errors = await self.user_repository.insert_many_users(documents)
+        except Exception as e:
+            logger.error("Error inserting import batch of %s users: %s", len(batch), e)
+            for row, _, _ in batch:
+                report.add_failure(row, "Database error")
+            return
+
+        report.inserted += inserted
+        for error in write_errors:
+            row, email, _ = batch[error["index"]]
+            if error.get("code") == DUPLICATE_KEY_ERROR:
+                report.add_duplicate(row, email)
+            else:
+                report.add_failure(row, error.get("errmsg", "Write error"))
@@ -1,33 +1,58 @@
-from src.services.user_service import UserService
+import asyncio
+
 from src.configs.config import Config
+from src.services.hashing_service import PasswordHasher
 from src.logger_setup import setup_logger
 
 logger = setup_logger(__name__)
 
 class InitService:
-    def __init__(self, app):
-        self.app = app
-        self.db = app.state.db
-        self.user_service = UserService(self.db)
-    
-    async def seed_admin_user(self):
-        email = Config.ADMIN_EMAIL  
-        password = Config.ADMIN_PASSWORD
-        existing_user = await self.user_service.user_repository.get_user_by_email(email)
-        if existing_user:
-            logger.info(f"Admin user {email} already exists.")
-            return existing_user
-        else:
-            logger.info(f"Creating admin user {email}.")
-            return await self.user_service.create_user(email, password)
-    
-    async def seed_quest_user(self):
-        email = Config.QUEST_EMAIL
-        password = Config.QUEST_PASSWORD
-        existing_user = await self.user_service.user_repository.get_user_by_email(email)
-        if existing_user:
-            logger.info(f"Quest user {email} already exists.")
-            return existing_user
-        else:
-            logger.info(f"Creating quest user {email}.")
-            return await self.user_service.create_user(email, password)
+    def __init__(self, container):
+        self.db = container.db
+        self.user_service = container.user_service
+        self.token_repository = container.token_repository
+        self.revocation_repository = container.revocation_repository
+        self.hashing_pool = container.hashing_pool
+
+    async def ensure_indexes(self):
+        logger.info("Ensuring indexes on users, refresh token and revocation collections.")
+        await asyncio.gather(
+            self.user_service.user_repository.ensure_indexes(),
+            self.token_repository.ensure_indexes(),
+            self.revocation_repository.ensure_indexes(),
+        )
+
+    def seed_accounts(self):
+        return {
+            Config.ADMIN_EMAIL: Config.ADMIN_PASSWORD,
+            Config.QUEST_EMAIL: Config.QUEST_PASSWORD,
+        }
+
+    async def seed_users(self):
+        """
+        Make sure the admin and quest users exist.
+
+        One query finds which already do, so a warm restart costs a single round
+        trip and no bcrypt work. Missing users are hashed concurrently and inserted
+        with idempotent upserts, so workers starting together cannot duplicate them
+        or overwrite a changed password.
+        """
+        accounts = self.seed_accounts()
+        user_repository = self.user_service.user_repository
+        existing = await user_repository.find_existing_emails(accounts)
+        missing = [email for email in accounts if email not in existing]
+        for email in existing:
+            logger.info("Seed user %s already exists.", email)
+        if not missing:
+            return []
+
+        hashes = await asyncio.gather(*(
+            PasswordHasher.hash_password_async(accounts[email], pool=self.hashing_pool) for email in missing
+        ))
+        inserted = await asyncio.gather(*(
+            user_repository.insert_user_if_absent(email, hashed) for email, hashed in zip(missing, hashes)
+        ))
+        created = [email for email, was_inserted in zip(missing, inserted) if was_inserted]
+        for email in created:
+            logger.info("Created seed user %s.", email)
+        return created
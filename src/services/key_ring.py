@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import time
+
+from jose import jwk
+
+from src.configs.config import Config
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+ASYMMETRIC_ALGORITHMS = ('RS256', 'RS384', 'RS512', 'ES256', 'ES384', 'ES512')
+
+
+class SigningKey:
+    def __init__(self, kid, algorithm, private_key, public_key):
+        self.kid = kid
+        self.algorithm = algorithm
+        self.private_key = private_key
+        self.public_key = public_key
+        self.public_jwk = {**public_key.to_dict(), "kid": kid, "alg": algorithm, "use": "sig"}
+
+    @property
+    def can_sign(self):
+        return self.private_key is not None
+
+
+class KeyRing:
+    """
+    Asymmetric keys for access tokens, loaded from a JSON file:
+
+        {
+          "signing_kid": "2024-06",
+          "keys": [
+            {"kid": "2024-06", "alg": "ES256", "private_key_file": "keys/2024-06.pem"},
+            {"kid": "2024-01", "alg": "RS256", "public_key_file": "keys/2024-01.pub.pem"}
+          ]
+        }
+
+    Tokens are signed with `signing_kid` and carry it in their `kid` header; any
+    listed key verifies tokens that name it, and all are published as JWKS. Paths
+    are relative to the file. The file is re-read when its mtime changes (checked
+    at most every `reload_seconds`), so keys rotate without restarting workers.
+    Parsed key objects are reused across reloads as long as their PEM is unchanged.
+    """
+
+    def __init__(self, path: str, reload_seconds: float = 30):
+        self.path = path
+        self.reload_seconds = reload_seconds
+        self._keys = {}
+        self._signing_kid = None
+        self._parsed = {}
+        self._mtime = None
+        self._checked_at = 0.0
+        self.reloads = 0
+        self.load()
+
+    @classmethod
+    def from_config(cls):
+        if not Config.JWT_KEY_RING_FILE:
+            return None
+        return cls(Config.JWT_KEY_RING_FILE, Config.JWT_KEY_RING_RELOAD_SECONDS)
+
+    def _read_pem(self, entry, field):
+        if entry.get(field):
+            return entry[field]
+        path = entry.get(f"{field}_file")
+        if not path:
+            return None
+        with open(os.path.join(os.path.dirname(self.path), path), 'r') as f:
+            return f.read()
+
+    def _construct(self, pem, algorithm):
+        fingerprint = (algorithm, hashlib.sha256(pem.encode('utf-8')).hexdigest())
+        key = self._parsed.get(fingerprint)
+        if key is None:
+            key = jwk.construct(pem, algorithm)
+        return fingerprint, key
+
+    def load(self):
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'r') as f:
+            document = json.load(f)
+
+        keys = {}
+        parsed = {}
+        for entry in document.get("keys", []):
+            kid, algorithm = entry["kid"], entry["alg"]
+            if algorithm not in ASYMMETRIC_ALGORITHMS:
+                raise ValueError(f"Unsupported key algorithm {algorithm} for kid {kid}")
+            private_pem = self._read_pem(entry, "private_key")
+            public_pem = self._read_pem(entry, "public_key")
+            private_key = public_key = None
+            if private_pem:
+                fingerprint, private_key = self._construct(private_pem, algorithm)
+                parsed[fingerprint] = private_key
+                public_key = private_key.public_key()
+            elif public_pem:
+                fingerprint, public_key = self._construct(public_pem, algorithm)
+                parsed[fingerprint] = public_key
+            else:
+                raise ValueError(f"Key {kid} has neither a private nor a public key")
+            keys[kid] = SigningKey(kid, algorithm, private_key, public_key)
+
+        signing_kid = document.get("signing_kid")
+        if signing_kid not in keys or not keys[signing_kid].can_sign:
+            raise ValueError(f"signing_kid {signing_kid!r} must name a key with a private key")
+
+        self._keys, self._signing_kid, self._parsed, self._mtime = keys, signing_kid, parsed, mtime
+        self.reloads += 1
+        logger.info("Loaded key ring %s: signing with %s, %s keys published.", self.path, signing_kid, len(keys))
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_seconds:
+            return
+        self._checked_at = now
+        try:
+            if os.stat(self.path).st_mtime != self._mtime:
+                self.load()
+        except Exception as e:
+            # Keep serving the last good key set; a broken edit must not take auth down.
+            logger.error("Error reloading key ring %s: %s", self.path, e)
+
+    def signing_key(self) -> SigningKey:
+        self._maybe_reload()
+        return self._keys[self._signing_kid]
+
+    def verification_key(self, kid) -> SigningKey:
+        self._maybe_reload()
+        return self._keys.get(kid)
+
+    def jwks(self):
+        self._maybe_reload()
+        return {"keys": [key.public_jwk for key in self._keys.values()]}
+
+
+key_ring = KeyRing.from_config()
@@ -0,0 +1,83 @@
+import asyncio
+import random
+from datetime import UTC, datetime, timedelta
+
+from src.configs.config import Config
+from src.repository.user_repository import UserRepository
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class UserPurgeJob:
+    """
+    Hard-deletes users that were soft-deleted more than `retention` ago.
+
+    Runs every `interval_seconds` and deletes in batches of `batch_size` with a
+    `batch_pause_seconds` pause in between, so a large backlog is worked off
+    without monopolising the primary. Every worker runs the job; batches are
+    idempotent, and a random initial delay keeps workers from starting together.
+    """
+
+    def __init__(self, user_repository: UserRepository, retention: timedelta, interval_seconds: float,
+                 batch_size: int, batch_pause_seconds: float):
+        self.user_repository = user_repository
+        self.retention = retention
+        self.interval_seconds = interval_seconds
+        self.batch_size = batch_size
+        self.batch_pause_seconds = batch_pause_seconds
+        self._task = None
+        self.runs = 0
+        self.purged = 0
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, user_repository: UserRepository):
+        return cls(
+            user_repository,
+            retention=timedelta(days=Config.USER_PURGE_RETENTION_DAYS),
+            interval_seconds=Config.USER_PURGE_INTERVAL_SECONDS,
+            batch_size=Config.USER_PURGE_BATCH_SIZE,
+            batch_pause_seconds=Config.USER_PURGE_BATCH_PAUSE_SECONDS,
+        )
+
+    async def run_once(self):
+        deleted_before = datetime.now(UTC) - self.retention
+        purged = 0
+        while True:
+            count = await self.user_repository.purge_deleted_users(deleted_before, self.batch_size)
+            purged += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(self.batch_pause_seconds)
+        self.runs += 1
+        self.purged += purged
+        if purged:
+            logger.info("Purged %s users deleted before %s.", purged, deleted_before.isoformat())
+        return purged
+
+    async def _run_forever(self):
+        await asyncio.sleep(random.uniform(0, self.interval_seconds))
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self.errors += 1
+                logger.error("Error purging deleted users: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {"runs": self.runs, "purged": self.purged, "errors": self.errors}
@@ -0,0 +1,56 @@
+import asyncio
+import time
+
+from src.configs.config import Config
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+
+class ReadinessProbe:
+    """
+    Answers "can this worker reach MongoDB?" for the readiness endpoint.
+
+    The ping result is cached for `ttl_seconds`, so probes from load balancers and
+    orchestrators cost a dict lookup rather than a round trip each. When the cache
+    is stale, concurrent probes share one in-flight ping instead of each issuing
+    their own, and a ping that exceeds `timeout_seconds` counts as not ready.
+    """
+
+    def __init__(self, mongo_client, ttl_seconds: float = 5, timeout_seconds: float = 2):
+        self.mongo_client = mongo_client
+        self.ttl_seconds = ttl_seconds
+        self.timeout_seconds = timeout_seconds
+        self._ready = False
+        self._error = None
+        self._checked_at = None
+        self._inflight = None
+        self.pings = 0
+
+    @classmethod
+    def from_config(cls, mongo_client):
+        return cls(mongo_client, Config.READINESS_CACHE_SECONDS, Config.READINESS_TIMEOUT_SECONDS)
+
+    async def _ping(self):
+        self.pings += 1
+        try:
+            await asyncio.wait_for(self.mongo_client.admin.command('ping'), self.timeout_seconds)
+            self._ready, self._error = True, None
+        except Exception as e:
+            if self._ready:
+                logger.warning("MongoDB readiness ping failed: %r", e)
+            self._ready, self._error = False, repr(e)
+        self._checked_at = time.monotonic()
+
+    async def check(self):
+        """Return `(ready, error)`, pinging at most once per `ttl_seconds`."""
+        if self._checked_at is None or time.monotonic() - self._checked_at >= self.ttl_seconds:
+            if self._inflight is None:
+                self._inflight = asyncio.ensure_future(self._ping())
+                self._inflight.add_done_callback(self._clear_inflight)
+            # Shielded so a probe that disconnects doesn't cancel the ping others wait on.
+            await asyncio.shield(self._inflight)
+        return self._ready, self._error
+
+    def _clear_inflight(self, task):
+        self._inflight = None
@@ -0,0 +1,203 @@
+import asyncio
+import hashlib
+import math
+import time
+from datetime import UTC, datetime, timedelta
+
+from src.configs.config import Config
+from src.repository.revocation_repository import RevocationRepository
+from src.logger_setup import setup_logger
+
+logger = setup_logger(__name__)
+
+# Re-read changes this far behind the last sync, so a revocation written by
+# another worker with a slightly skewed clock, or committed just after our
+# previous query, is still picked up. Re-applying an entry is harmless.
+SYNC_OVERLAP = timedelta(seconds=5)
+
+
+def issued_at() -> float:
+    """Current time as a JWT NumericDate, truncated to milliseconds."""
+    return math.floor(time.time() * 1000) / 1000
+
+
+def _timestamp(value: datetime) -> float:
+    # The driver returns naive datetimes in UTC.
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=UTC)
+    return value.timestamp()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings, sized for `capacity` items at `error_rate`."""
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.capacity = max(1, capacity)
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item: str):
+        # Double hashing: k positions from one 128-bit digest.
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, item: str):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+
+class RevocationService:
+    """
+    Per-worker mirror of the revocations in MongoDB, checked on every
+    authenticated request without any I/O.
+
+    Revoked jtis go into a Bloom filter backed by an exact dict (jti -> expiry):
+    almost every token is not revoked, and the filter rejects those with a few
+    bit tests; only filter hits consult the dict. Per-user cutoffs revoke every
+    token issued before a point in time. A background task pulls changes made by
+    other workers every `sync_seconds`; revocations made by this worker apply
+    immediately. Entries are dropped once the tokens they cover have expired.
+    """
+
+    def __init__(self, repository: RevocationRepository, sync_seconds: float = 5,
+                 bloom_capacity: int = 100000, bloom_error_rate: float = 0.001):
+        self.repository = repository
+        self.sync_seconds = sync_seconds
+        self.bloom_capacity = bloom_capacity
+        self.bloom_error_rate = bloom_error_rate
+        self._bloom = BloomFilter(bloom_capacity, bloom_error_rate)
+        self._revoked = {}
+        self._cutoffs = {}
+        self._synced_from = None
+        self._synced_at = None
+        self._task = None
+
+        self.checks = 0
+        self.bloom_hits = 0
+        self.false_positives = 0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    @classmethod
+    def from_config(cls, repository: RevocationRepository):
+        return cls(
+            repository,
+            sync_seconds=Config.REVOCATION_SYNC_SECONDS,
+            bloom_capacity=Config.REVOCATION_BLOOM_CAPACITY,
+            bloom_error_rate=Config.REVOCATION_BLOOM_ERROR_RATE,
+        )
+
+    def is_revoked(self, payload: dict) -> bool:
+        self.checks += 1
+        cutoff = self._cutoffs.get(payload.get("sub"))
+        # Tokens without iat predate revocation support and fall under any cutoff.
+        if cutoff is not None and payload.get("iat", 0) < cutoff[0]:
+            return True
+        jti = payload.get("jti")
+        if jti is None or jti not in self._bloom:
+            return False
+        self.bloom_hits += 1
+        if jti in self._revoked:
+            return True
+        self.false_positives += 1
+        return False
+
+    def _add_token(self, jti, expires_at: float):
+        if jti not in self._revoked:
+            self._bloom.add(jti)
+        self._revoked[jti] = expires_at
+        if len(self._revoked) > self._bloom.capacity:
+            self._rebuild_bloom()
+
+    def _add_cutoff(self, user_id, not_before: float, expires_at: float):
+        current = self._cutoffs.get(user_id)
+        if current is None or not_before > current[0]:
+            self._cutoffs[user_id] = (not_before, expires_at)
+
+    def _rebuild_bloom(self):
+        capacity = max(self.bloom_capacity, 2 * len(self._revoked))
+        bloom = BloomFilter(capacity, self.bloom_error_rate)
+        for jti in self._revoked:
+            bloom.add(jti)
+        self._bloom = bloom
+
+    def prune(self, now: float = None):
+        now = now if now is not None else time.time()
+        expired = [jti for jti, expires_at in self._revoked.items() if expires_at <= now]
+        for jti in expired:
+            del self._revoked[jti]
+        for user_id in [user_id for user_id, (_, expires_at) in self._cutoffs.items() if expires_at <= now]:
+            del self._cutoffs[user_id]
+        # Bloom filters can't forget; rebuild once a good share of the bits are stale.
+        if expired and len(expired) * 4 >= len(self._revoked):
+            self._rebuild_bloom()
+
+    async def revoke_token(self, jti, user_id, expires_at: float):
+        await self.repository.revoke_token(jti, user_id, datetime.fromtimestamp(expires_at, UTC))
+        self._add_token(jti, expires_at)
+
+    async def revoke_user_tokens(self, user_id):
+        """Revoke every access token issued to `user_id` up to now."""
+        not_before = issued_at()
+        expires_at = not_before + Config.ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        await self.repository.set_user_cutoff(user_id, not_before, datetime.fromtimestamp(expires_at, UTC))
+        self._add_cutoff(user_id, not_before, expires_at)
+
+    async def sync(self):
+        started = datetime.now(UTC)
+        since = self._synced_from - SYNC_OVERLAP if self._synced_from is not None else None
+        tokens, cutoffs = await self.repository.changes_since(since)
+        for token in tokens:
+            self._add_token(token["_id"], _timestamp(token["expires_at"]))
+        for cutoff in cutoffs:
+            self._add_cutoff(cutoff["_id"], cutoff["not_before"], _timestamp(cutoff["expires_at"]))
+        self.prune()
+        self._synced_from = started
+        self._synced_at = time.monotonic()
+        self.syncs += 1
+
+    async def _sync_forever(self):
+        while True:
+            await asyncio.sleep(self.sync_seconds)
+            try:
+                await self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logger.error("Error syncing token revocations: %s", e)
+
+    async def start(self):
+        try:
+            await self.sync()
+        except Exception as e:
+            # Serve anyway; the background task keeps retrying.
+            self.sync_errors += 1
+            logger.error("Initial token revocation sync failed: %s", e)
+        self._task = asyncio.ensure_future(self._sync_forever())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self):
+        return {
+            "revoked_tokens": len(self._revoked),
+            "user_cutoffs": len(self._cutoffs),
+            "bloom_bits": self._bloom.size,
+            "checks": self.checks,
+            "bloom_hits": self.bloom_hits,
+            "false_positives": self.false_positives,
+            "syncs": self.syncs,
+            "sync_errors": self.sync_errors,
+            "seconds_since_sync": time.monotonic() - self._synced_at if self._synced_at is not None else -1,
+        }
@@ -0,0 +1,78 @@
+import hashlib
+import time
+from collections import OrderedDict
+
+
+class VerifiedTokenCache:
+    """
+    Bounded LRU of already-verified JWT payloads.
+
+    Keys are SHA-256 digests of the raw token, so the cache never holds usable
+    credentials. An entry lives until the token's `exp` or `max_ttl_seconds`,
+    whichever comes first.
+    """
+
+    def __init__(self, max_size: int = 10000, max_ttl_seconds: float = 300):
+        self.max_size = max_size
+        self.max_ttl_seconds = max_ttl_seconds
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def _key(token: str, token_type: str):
+        return hashlib.sha256(f"{token_type}:{token}".encode('utf-8')).digest()
+
+    def get(self, token: str, token_type: str):
+        key = self._key(token, token_type)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        payload, expires_at = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return payload
+
+    def set(self, token: str, token_type: str, payload: dict):
+        if self.max_size <= 0:
+            return
+        exp = payload.get("exp")
+        if exp is None:
+            return
+        now = time.time()
+        expires_at = min(float(exp), now + self.max_ttl_seconds)
+        if expires_at <= now:
+            return
+
+        key = self._key(token, token_type)
+        self._entries[key] = (payload, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
@@ -1,78 +1,157 @@
+import asyncio
+import time
 import uuid
-from jose import jwt
+from jose import JWTError, jwt
 from datetime import UTC, datetime, timedelta
 from fastapi import HTTPException
 from fastapi.security import OAuth2PasswordBearer
 from starlette.status import HTTP_401_UNAUTHORIZED
 
 from src.configs.config import Config
+from src.metrics import jwt_duration_seconds
 from src.repository.token_repository import TokenRepository
+from src.services.key_ring import key_ring
+from src.services.revocation_service import RevocationService, issued_at
+from src.services.token_cache import VerifiedTokenCache
+from src.single_flight import SingleFlight
 from src.logger_setup import setup_logger
 
 logger = setup_logger(__name__)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
+_encode_access_seconds = jwt_duration_seconds.labels("encode", "access")
+_encode_refresh_seconds = jwt_duration_seconds.labels("encode", "refresh")
+_decode_seconds = {
+    "access": jwt_duration_seconds.labels("decode", "access"),
+    "refresh": jwt_duration_seconds.labels("decode", "refresh"),
+}
+
+# Only access tokens are cached: refresh tokens are single-use and would just churn the LRU.
+access_token_cache = VerifiedTokenCache(
+    max_size=Config.TOKEN_CACHE_SIZE,
+    max_ttl_seconds=Config.TOKEN_CACHE_MAX_TTL_SECONDS,
+)
+# Introspection answers for tokens that failed verification. Only failures that
+# never turn valid later are cached (a bad signature, an expiry, a malformed
+# token), so these only need a bound on memory, not a short TTL for correctness.
+# An unknown key id is not among them: the key may be added on the next reload.
+invalid_token_cache = VerifiedTokenCache(
+    max_size=Config.INTROSPECTION_NEGATIVE_CACHE_SIZE,
+    max_ttl_seconds=Config.INTROSPECTION_NEGATIVE_TTL_SECONDS,
+)
+INACTIVE = {"active": False}
+
+class UnknownKeyError(JWTError):
+    """The token names a key id that is not in the key ring (yet)."""
+
 class TokenService:
-    _instance = None
-    
-    def __new__(cls, db):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-            cls._instance.__initialized = False
-        return cls._instance
-
-    def __init__(self, db):
-        if getattr(self, '__initialized', False):
-            return
-        self.__initialized = True
+    def __init__(self, db, token_repository: TokenRepository = None, revocation_service: RevocationService = None):
         self.db = db
-        self.token_repository = TokenRepository(db)
+        self.token_repository = token_repository or TokenRepository(db)
+        self.revocation_service = revocation_service
+        self.token_cache = access_token_cache
+        self.invalid_token_cache = invalid_token_cache
+        self.key_ring = key_ring
+        self._key_ring_reloads = key_ring.reloads if key_ring is not None else 0
+        self.refreshes = SingleFlight()
 
     async def create_access_token(self, user_id: str, expires_delta: timedelta = None):
-        to_encode = {"sub": user_id, "type": "access"}
+        to_encode = {"sub": user_id, "type": "access", "jti": uuid.uuid4().hex, "iat": issued_at()}
         expire = datetime.now(UTC) + (expires_delta or timedelta(minutes=Config.ACCESS_TOKEN_EXPIRE_MINUTES))
         to_encode.update({"exp": expire})
-        encoded_jwt = jwt.encode(to_encode, Config.ACCESS_TOKEN_SECRET_KEY, algorithm=Config.ALGORITHM)
+        started = time.perf_counter()
+        if self.key_ring is not None:
+            signing_key = self.key_ring.signing_key()
+            encoded_jwt = jwt.encode(
+                to_encode, signing_key.private_key, algorithm=signing_key.algorithm, headers={"kid": signing_key.kid}
+            )
+        else:
+            encoded_jwt = jwt.encode(to_encode, Config.ACCESS_TOKEN_SECRET_KEY, algorithm=Config.ALGORITHM)
+        _encode_access_seconds.observe(time.perf_counter() - started)
         return encoded_jwt
 
-    async def create_refresh_token(self, user_id: str, expires_delta: timedelta = None):
+    def _build_refresh_token(self, user_id: str, expires_delta: timedelta = None):
         token_id = str(uuid.uuid4())
         to_encode = {"sub": user_id, "type": "refresh", "jti": token_id}
         expire = datetime.now(UTC) + (expires_delta or timedelta(days=Config.REFRESH_TOKEN_EXPIRE_DAYS))
 
         to_encode.update({"exp": expire})
+        started = time.perf_counter()
         encoded_jwt = jwt.encode(to_encode, Config.REFRESH_TOKEN_SECRET_KEY, algorithm=Config.ALGORITHM)
+        _encode_refresh_seconds.observe(time.perf_counter() - started)
+        return token_id, encoded_jwt, expire
 
+    async def _save_refresh_token(self, token_id: str, user_id: str, expire: datetime):
         try:
             await self.token_repository.save_refresh_token(token_id, user_id, expire)
         except Exception as e:
-            logger.error(f"Error saving refresh token for user {user_id}: {e}")
+            logger.error("Error saving refresh token for user %s: %s", user_id, e)
             raise HTTPException(status_code=500, detail="Internal server error")
 
+    async def create_refresh_token(self, user_id: str, expires_delta: timedelta = None):
+        token_id, encoded_jwt, expire = self._build_refresh_token(user_id, expires_delta)
+        await self._save_refresh_token(token_id, user_id, expire)
+        # New sessions are the only way a user's token count grows (rotation
+        # replaces one token with another), so the cap is enforced here.
+        if Config.MAX_SESSIONS_PER_USER > 0:
+            try:
+                await self.token_repository.evict_excess_sessions(user_id, Config.MAX_SESSIONS_PER_USER)
+            except Exception as e:
+                logger.error("Error enforcing session cap for user %s: %s", user_id, e)
         return encoded_jwt
 
+    async def revoke_all_sessions(self, user_id: str):
+        """Revoke every refresh token of `user_id`, and with them the ability to get new access tokens."""
+        revoked = await self.token_repository.revoke_all_for_user(user_id)
+        logger.info("Revoked %s refresh tokens of user %s.", revoked, user_id)
+        return revoked
+
+    def _verification_key(self, token: str, expected_type: str):
+        # Refresh tokens are only ever verified here, so they stay on the shared secret.
+        if expected_type == "refresh":
+            return Config.REFRESH_TOKEN_SECRET_KEY, [Config.ALGORITHM]
+        if self.key_ring is not None:
+            kid = jwt.get_unverified_header(token).get("kid")
+            if kid is not None:
+                verification_key = self.key_ring.verification_key(kid)
+                if verification_key is None:
+                    raise UnknownKeyError(f"Unknown key id {kid}")
+                return verification_key.public_key, [verification_key.algorithm]
+        # Tokens without a kid were signed with the shared secret (e.g. before the
+        # key ring was enabled) and remain valid until they expire.
+        return Config.ACCESS_TOKEN_SECRET_KEY, [Config.ALGORITHM]
+
+    def _decode(self, token: str, expected_type: str):
+        """decode_token without the error handling: raises JWTError for tokens that fail verification."""
+        if expected_type == "access":
+            cached = self.token_cache.get(token, expected_type)
+            if cached is not None:
+                return cached
+        if expected_type not in ("access", "refresh"):
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid token type")
+
+        started = time.perf_counter()
+        key, algorithms = self._verification_key(token, expected_type)
+        payload = jwt.decode(token, key, algorithms=algorithms)
+        _decode_seconds[expected_type].observe(time.perf_counter() - started)
+        user_id: str = payload.get("sub")
+        token_type: str = payload.get("type")
+        if user_id is None or token_type != expected_type:
+            raise HTTPException(
+                status_code=HTTP_401_UNAUTHORIZED,
+                detail="Could not validate credentials",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        if expected_type == "access":
+            self.token_cache.set(token, expected_type, payload)
+        return payload
+
     def decode_token(self, token: str, expected_type: str):
         try:
-            if expected_type == "access":
-                secret_key = Config.ACCESS_TOKEN_SECRET_KEY
-            elif expected_type == "refresh":
-                secret_key = Config.REFRESH_TOKEN_SECRET_KEY
-            else:
-                raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid token type")
-
-            payload = jwt.decode(token, secret_key, algorithms=[Config.ALGORITHM])
-            user_id: str = payload.get("sub")
-            token_type: str = payload.get("type")
-            if user_id is None or token_type != expected_type:
-                raise HTTPException(
-                    status_code=HTTP_401_UNAUTHORIZED,
-                    detail="Could not validate credentials",
-                    headers={"WWW-Authenticate": "Bearer"},
-                )
-            return payload
+            return self._decode(token, expected_type)
         except Exception as e:
-            logger.error(f"Token decoding error: {e}")
+            logger.error("Token decoding error: %s", e)
             raise HTTPException(
                 status_code=HTTP_401_UNAUTHORIZED,
                 detail="Could not validate credentials",
@@ -87,18 +166,117 @@ class TokenService:
             logger.warning("Refresh token payload missing jti or sub.")
             raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
 
-        token_record = await self.token_repository.get_refresh_token(token_id)
-        if not token_record or token_record['user_id'] != user_id:
-            logger.warning("Refresh token not found or does not match user.")
-            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+        # A client retrying a slow refresh sends the same token again while the
+        # first rotation is still running. Rotated on its own, the duplicate would
+        # look like reuse and end every session of the user, so concurrent refreshes
+        # of one token share a single rotation and its new token pair. This works
+        # within a worker; duplicates that reach another worker are still reuse.
+        return await self.refreshes.do(token_id, self._rotate_refresh_token, token_id, user_id)
 
-        # Token rotation
-        await self.token_repository.delete_refresh_token(token_id)
+    async def _rotate_refresh_token(self, token_id: str, user_id: str):
+        # Token rotation: consume the presented token and store its successor in
+        # parallel, so a refresh costs one round trip instead of three.
+        new_token_id, new_refresh_token, new_expire = self._build_refresh_token(user_id)
+        consumed, saved = await asyncio.gather(
+            self.token_repository.consume_refresh_token(token_id, user_id),
+            self._save_refresh_token(new_token_id, user_id, new_expire),
+            return_exceptions=True,
+        )
+        if isinstance(consumed, Exception) or consumed is None:
+            if not isinstance(saved, Exception):
+                await self.token_repository.delete_refresh_token(new_token_id)
+            if isinstance(consumed, Exception):
+                logger.error("Error consuming refresh token for user %s: %s", user_id, consumed)
+                raise HTTPException(status_code=500, detail="Internal server error")
+            # The signature and expiry were valid, so a missing record means this
+            # token has already been rotated (or revoked): treat it as reuse. Either
+            # the legitimate client or an attacker holds a stolen token, so end every
+            # session of the user.
+            logger.warning("Reuse of rotated refresh token detected for user %s.", user_id)
+            await self.revoke_all_sessions(user_id)
+            raise HTTPException(status_code=HTTP_401_UNAUTHORIZED, detail="Invalid refresh token")
+        if isinstance(saved, Exception):
+            raise saved
 
-        new_refresh_token = await self.create_refresh_token(user_id)
         access_token = await self.create_access_token(user_id)
         return access_token, new_refresh_token
 
+    def verify_access_token(self, token: str):
+        """Decode an access token and reject it if it has been revoked. No I/O."""
+        payload = self.decode_token(token, expected_type="access")
+        if self.revocation_service is not None and self.revocation_service.is_revoked(payload):
+            logger.info("Rejected revoked access token for user %s.", payload.get("sub"))
+            raise HTTPException(
+                status_code=HTTP_401_UNAUTHORIZED,
+                detail="Token has been revoked",
+                headers={"WWW-Authenticate": "Bearer"},
+            )
+        return payload
+
+    def introspect(self, tokens: list):
+        """
+        Verify a batch of access tokens in one pass, without I/O: signatures and
+        expiry through decode_token (and its cache), revocation through the
+        in-memory mirror. Returns one RFC 7662-style result per token, in order.
+        """
+        results = []
+        for token in tokens:
+            self._clear_invalid_tokens_on_key_ring_reload()
+            if self.invalid_token_cache.get(token, "invalid") is not None:
+                results.append(INACTIVE)
+                continue
+            try:
+                payload = self._decode(token, "access")
+            except UnknownKeyError:
+                results.append(INACTIVE)
+                continue
+            except JWTError:
+                ttl = self.invalid_token_cache.max_ttl_seconds
+                self.invalid_token_cache.set(token, "invalid", {"exp": time.time() + ttl})
+                results.append(INACTIVE)
+                continue
+            except Exception:
+                # Not a verification failure (e.g. a refresh token): answer, but don't remember it.
+                results.append(INACTIVE)
+                continue
+            if self.revocation_service is not None and self.revocation_service.is_revoked(payload):
+                results.append(INACTIVE)
+                continue
+            results.append({
+                "active": True,
+                "sub": payload["sub"],
+                "exp": payload["exp"],
+                "iat": payload.get("iat"),
+                "jti": payload.get("jti"),
+                "type": payload["type"],
+            })
+        return results
+
+    def _clear_invalid_tokens_on_key_ring_reload(self):
+        # A reloaded key ring may replace the key behind a kid, so failures cached
+        # against the previous keys no longer hold.
+        if self.key_ring is not None and self.key_ring.reloads != self._key_ring_reloads:
+            self._key_ring_reloads = self.key_ring.reloads
+            self.invalid_token_cache.clear()
+
+    async def revoke_access_token(self, payload: dict):
+        if self.revocation_service is None or not payload.get("jti"):
+            return
+        await self.revocation_service.revoke_token(payload["jti"], payload["sub"], payload["exp"])
+
+    async def revoke_user_access_tokens(self, user_id: str):
+        if self.revocation_service is not None:
+            await self.revocation_service.revoke_user_tokens(user_id)
+
+    async def revoke_refresh_token(self, refresh_token: str):
+        """Forget a refresh token's record so it can't be rotated again. Invalid tokens are ignored."""
+        try:
+            payload = self.decode_token(refresh_token, expected_type="refresh")
+        except HTTPException:
+            return
+        self.refreshes.forget(payload.get("jti"))
+        await self.token_repository.delete_refresh_token(payload.get("jti"))
+
     async def extract_user_id_from_token(self, token: str, expected_type: str = "access"):
         if not token:
             logger.warning("No token provided for user extraction.")
@@ -107,5 +285,8 @@ class TokenService:
                 detail="Not authenticated",
                 headers={"WWW-Authenticate": "Bearer"},
             )
-        payload = self.decode_token(token, expected_type=expected_type)
+        if expected_type == "access":
+            payload = self.verify_access_token(token)
+        else:
+            payload = self.decode_token(token, expected_type=expected_type)
         return payload.get("sub")
@@ -1,8 +1,11 @@
+import asyncio
 from datetime import timedelta
+from fastapi import HTTPException
 from fastapi.responses import JSONResponse
+from starlette.status import HTTP_403_FORBIDDEN
 
 from src.repository.user_repository import UserRepository
-from src.services.hashing_service import PasswordHasher
+from src.services.hashing_service import HashingPool, PasswordHasher
 from src.services.token_service import TokenService
 from src.configs.config import Config 
 from src.logger_setup import setup_logger
@@ -10,21 +13,14 @@ from src.logger_setup import setup_logger
 logger = setup_logger(__name__)
 
 class UserService:
-    _instance = None
-
-    def __new__(cls, db):
-        if not cls._instance:
-            cls._instance = super().__new__(cls)
-            cls._instance.__initialized = False
-        return cls._instance
-
-    def __init__(self, db):
-        if getattr(self, '__initialized', False):
-            return
-        self.__initialized = True
+    def __init__(self, db, user_repository: UserRepository = None, token_service: TokenService = None,
+                 hashing_pool: HashingPool = None):
         self.db = db
-        self.user_repository = UserRepository(db)
-        self.token_service = TokenService(db)
+        self.user_repository = user_repository or UserRepository(db)
+        self.token_service = token_service or TokenService(db)
+        self.hashing_pool = hashing_pool
+        # Strong references to fire-and-forget tasks, which the loop only holds weakly.
+        self._background_tasks = set()
 
     async def login(self, email, password):
         user = await self._authenticate_user(email, password)
@@ -33,20 +29,39 @@ class UserService:
                 {'message': 'Invalid credentials'}, 
                 status_code=401
             )
-        
-        return await self._create_login_response(user)
+
+        if int(Config.BCRYPT_REHASH_ON_LOGIN) and PasswordHasher.needs_rehash(user['password']):
+            self._run_in_background(self._rehash_password(user, password))
+        return await self.create_session_response(user, "Login successful")
+
+    def _run_in_background(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def _rehash_password(self, user, password):
+        # The plaintext is only available while the user logs in, so this is the one
+        # chance to move the stored hash to the current cost factor.
+        try:
+            new_hash = await PasswordHasher.hash_password_async(password, pool=self.hashing_pool)
+            if await self.user_repository.replace_password_hash(str(user['_id']), user['password'], new_hash):
+                logger.info("Rehashed password for user %s at cost %s.", user['_id'], PasswordHasher.rounds)
+        except Exception as e:
+            logger.warning("Background rehash failed for user %s: %s", user['_id'], e)
 
     async def _authenticate_user(self, email, password):
         user = await self.user_repository.get_user_by_email(email)
-        if user and PasswordHasher.check_password(user['password'], password):
+        if user and await PasswordHasher.check_password_async(user['password'], password, pool=self.hashing_pool):
             return user
         return None
 
-    async def _create_login_response(self, user):
+    async def create_session_response(self, user, message):
+        """Issue a fresh access token (in the body) and refresh token (as a cookie)."""
         tokens = await self._generate_tokens(str(user['_id']))
         
         response = JSONResponse({
-            "message": "Login successful",
+            "message": message,
             "access_token": tokens['access_token']
         }, status_code=200)
         
@@ -82,7 +97,11 @@ class UserService:
         )
 
     async def create_user(self, email, password):
-        hashed_password = PasswordHasher.hash_password(password)
+        # Admin rights go with the email, so it is only ever created by seeding.
+        if email == Config.ADMIN_EMAIL:
+            logger.warning("Refused to register the admin email %s.", email)
+            return None
+        hashed_password = await PasswordHasher.hash_password_async(password, pool=self.hashing_pool)
         user = await self.user_repository.create_user(email, hashed_password)
         if user is None:
             return None
@@ -91,9 +110,39 @@ class UserService:
     async def get_user_by_id(self, user_id):
         return await self.user_repository.get_user_by_id(user_id)
 
-    def validate_user_password(self, user, password):
-        return PasswordHasher.check_password(user['password'], password)
+    async def is_admin(self, user_id):
+        user = await self.user_repository.get_user_by_id(user_id)
+        return bool(user) and user.get('email') == Config.ADMIN_EMAIL
+
+    async def validate_user_password(self, user, password):
+        return await PasswordHasher.check_password_async(user['password'], password, pool=self.hashing_pool)
+
+    async def delete_user(self, user_id):
+        """
+        Soft-delete a user and end all of their sessions. Returns False if there
+        was no live user. The admin account can't be deleted: that would free its
+        email, and with it admin rights, for anyone to register.
+        """
+        user = await self.user_repository.get_user_by_id(user_id)
+        if user and user.get('email') == Config.ADMIN_EMAIL:
+            raise HTTPException(status_code=HTTP_403_FORBIDDEN, detail="The admin account can't be deleted")
+        email = await self.user_repository.soft_delete_user(user_id, keep_email=Config.ADMIN_EMAIL)
+        if email is None:
+            return False
+        await asyncio.gather(
+            self.token_service.revoke_user_access_tokens(user_id),
+            self.token_service.revoke_all_sessions(user_id),
+        )
+        logger.info("Deleted user %s.", user_id)
+        return True
 
     async def update_user_password(self, user_id, new_password):
-        hashed_password = PasswordHasher.hash_password(new_password)
-        return await self.user_repository.update_password(user_id, hashed_password)
+        hashed_password = await PasswordHasher.hash_password_async(new_password, pool=self.hashing_pool)
+        updated = await self.user_repository.update_password(user_id, hashed_password)
+        if updated:
+            # Sessions authenticated with the old password must not outlive it.
+            await asyncio.gather(
+                self.token_service.revoke_user_access_tokens(user_id),
+                self.token_service.revoke_all_sessions(user_id),
+            )
+        return updated
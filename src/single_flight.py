@@ -0,0 +1,54 @@
+"""
+Request coalescing for async lookups.
+
+When many coroutines ask for the same key at once (a login storm for one user,
+a wave of client retries) only the first one runs the lookup; the others await
+its result. Nothing is cached: once the lookup finishes, the next caller for the
+key starts a new one.
+"""
+import asyncio
+
+
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key, fn, *args):
+        """
+        Run `fn(*args)` unless a call for `key` is already in flight, in which case
+        wait for that one. Every caller receives the same result object (or
+        exception), so callers that mutate the result must copy it.
+
+        The shared call runs in its own task behind `asyncio.shield`: cancelling
+        one waiter (e.g. a client disconnecting) neither cancels the query for the
+        others nor leaves the key stuck.
+        """
+        self.calls += 1
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn(*args))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved in case every waiter was cancelled.
+            task.exception()
+
+    def forget(self, *keys):
+        """
+        Stop sharing the in-flight calls for `keys`. Call after a write, so that
+        callers arriving later don't join a read that started before it.
+        """
+        for key in keys:
+            self._inflight.pop(key, None)
+
+    def stats(self):
+        return {"calls": self.calls, "coalesced": self.coalesced, "in_flight": len(self._inflight)}
@@ -1,9 +1,51 @@
+import asyncio
+import ecdsa
+import httpx
 import json
+import logging
+import os
+import queue
+import threading
+import time
 import pytest
+from datetime import UTC, datetime, timedelta
+from types import SimpleNamespace
+from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import MagicMock, AsyncMock
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+from pymongo import monitoring
+from pymongo.errors import DuplicateKeyError
 
-from src.services.hashing_service import PasswordHasher
+from benchmarks.fake_mongo import FakeMongoClient
+from src.logger_setup import RATE_LIMITED, DroppingQueueHandler, RateLimitFilter
+from src.configs.config import Config
+from src.metrics import MetricsMiddleware, MetricsRegistry, MultiprocessMetrics
+from src.profiling import ProfileStore, ProfilingMiddleware, SamplingProfiler
+from src.mongo_monitoring import MongoPoolMetrics
+from src.repository.revocation_repository import RevocationRepository
+from src.repository.routing import OperationRouting, read_preference, write_concern
+from src.repository.token_repository import TokenRepository
+from src.repository.user_cache import InMemoryUserCache, NullUserCache, UserCache, build_user_cache
+from src.repository.user_repository import LIVE_USER_FILTER, PRE_MIGRATION_LIVE_USER_FILTER, UserRepository
+from src.router.api import get_current_admin_user_id, router
+from src.run import create_app
+from src.services.container import ServiceContainer, refresh_token_write_behind_enabled
+from src.services.admission_service import (
+    LoginAdmissionController, TokenBucketLimiter, build_login_admission,
+)
+from src.services import hashing_service
+from src.services.hashing_service import HashingPool, PasswordHasher, build_hashing_pool
+from src.services.import_service import UserImportService, aiter_lines, parse_records
+from src.services.key_ring import KeyRing
+from src.services.purge_service import UserPurgeJob
+from src.services.readiness_service import ReadinessProbe
+from src.services.revocation_service import RevocationService
+from src.services.token_cache import VerifiedTokenCache
+from src.services.token_service import TokenService
 from src.services.user_service import UserService
+from src.single_flight import SingleFlight
 
 @pytest.fixture
 def mock_db():
@@ -62,3 +104,784 @@ async def test_login_invalid_credentials(user_service):
     assert response.status_code == 401
     data = json.loads(response.body.decode("utf-8"))
     assert data["message"] == "Invalid credentials"
+
+@pytest.mark.asyncio
+async def test_hashing_pool_rejects_when_saturated():
+    pool = HashingPool(kind='thread', max_workers=1, max_queue=0)
+    release = threading.Event()
+    busy = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0)
+
+    with pytest.raises(HTTPException) as exc_info:
+        await pool.run(release.wait)
+    assert exc_info.value.status_code == 503
+
+    release.set()
+    assert await busy is True
+    stats = pool.stats()
+    assert stats["rejected"] == 1
+    assert stats["completed"] == 1
+    pool.shutdown()
+
+def test_verified_token_cache_respects_exp_and_size():
+    cache = VerifiedTokenCache(max_size=2, max_ttl_seconds=300)
+    now = time.time()
+    cache.set("expired", "access", {"sub": "u0", "exp": now - 1})
+    cache.set("a", "access", {"sub": "u1", "exp": now + 60})
+    cache.set("b", "access", {"sub": "u2", "exp": now + 60})
+
+    assert cache.get("expired", "access") is None
+    assert cache.get("a", "access")["sub"] == "u1"
+    assert cache.get("a", "refresh") is None
+
+    cache.set("c", "access", {"sub": "u3", "exp": now + 60})
+    assert cache.get("b", "access") is None  # least recently used
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["hits"] == 1
+
+@pytest.mark.asyncio
+async def test_repository_create_user_duplicate_is_single_round_trip(mock_db):
+    users = MagicMock()
+    users.insert_one = AsyncMock(side_effect=DuplicateKeyError("E11000 duplicate key"))
+    mock_db.__getitem__.return_value = users
+
+    result = await UserRepository(mock_db).create_user("test@example.com", "hashed_pass")
+    assert result is None
+    users.insert_one.assert_awaited_once()
+    users.find_one.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_bulk_import_reports_duplicates_and_failures(monkeypatch):
+    monkeypatch.setattr(PasswordHasher, "hash_passwords", staticmethod(lambda passwords, rounds=None: [f"hashed:{p}" for p in passwords]))
+    repo = AsyncMock()
+    repo.insert_many_users.side_effect = [
+        (1, [{"index": 1, "code": 11000, "errmsg": "E11000 duplicate key"}]),
+        (1, []),
+    ]
+
+    async def chunks():
+        yield b'{"email": "a@example.com", "password": "Password1"}\nnot json\n'
+        yield b'{"email": "b@example.com", "password": "Password2"}\n{"email": "\xff@example.com"}\n'
+        yield b'{"email": "c@example.com", "password": "short"}\n'
+        yield b'{"email": "d@example.com", "password": "Password4"}'
+
+    importer = UserImportService(repo, batch_size=2, workers=2, progress_every=0)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        report = await importer.import_users(parse_records(aiter_lines(chunks()), "ndjson"), executor=executor)
+
+    result = report.to_dict()
+    assert result["rows"] == 6
+    assert result["inserted"] == 2
+    assert result["duplicate_rows"] == [{"row": 3, "email": "b@example.com"}]
+    assert [failure["row"] for failure in result["failures"]] == [2, 4, 5]
+    assert result["failures"][1]["error"].startswith("Invalid UTF-8")
+    first_batch = repo.insert_many_users.await_args_list[0].args[0]
+    assert first_batch[0] == {"email": "a@example.com", "password": "hashed:Password1"}
+
+@pytest.mark.asyncio
+async def test_web_import_hashes_through_the_pool_one_small_chunk_at_a_time(monkeypatch):
+    monkeypatch.setattr(PasswordHasher, "hash_passwords", staticmethod(lambda passwords, rounds=None: [f"hashed:{p}" for p in passwords]))
+    repo = AsyncMock()
+    repo.insert_many_users.side_effect = lambda documents: (len(documents), [])
+    pool = HashingPool('thread', max_workers=1, max_queue=0)
+    records = [{"email": f"user{i}@example.com", "password": f"Password{i}"} for i in range(5)]
+
+    async def rows():
+        for row, record in enumerate(records, 1):
+            yield row, record
+
+    # A login holds the only slot first; the import waits for it instead of failing.
+    release = threading.Event()
+    login = asyncio.ensure_future(pool.run(release.wait))
+    await asyncio.sleep(0.01)
+    importer = UserImportService(repo, batch_size=4, pool_chunk_size=2, progress_every=0, hashing_pool=pool)
+    report = asyncio.ensure_future(importer.import_users(rows()))
+    await asyncio.sleep(0.1)
+    assert not report.done() and pool.rejected == 0
+    release.set()
+    await login
+
+    assert (await report).inserted == 5
+    assert pool.completed == 1 + 3  # the login, then chunks of 2, 2 and 1
+    assert pool.max_queue_depth == 0
+
+@pytest.mark.asyncio
+async def test_refresh_rotation_consumes_token_atomically(user_service):
+    token_service = user_service.token_service
+    repo = token_service.token_repository
+    refresh_token = await token_service.create_refresh_token("dummy_id")
+    repo.consume_refresh_token.return_value = {"_id": "some_token_id", "user_id": "dummy_id"}
+
+    access_token, new_refresh_token = await token_service.refresh_access_token(refresh_token)
+    assert token_service.decode_token(access_token, "access")["sub"] == "dummy_id"
+    assert new_refresh_token != refresh_token
+    repo.get_refresh_token.assert_not_called()
+
+    repo.consume_refresh_token.return_value = None
+    with pytest.raises(HTTPException) as exc_info:
+        await token_service.refresh_access_token(refresh_token)
+    assert exc_info.value.status_code == 401
+    # The successor stored in parallel with the failed consume is removed again,
+    # and reuse ends every session of the user.
+    repo.delete_refresh_token.assert_awaited_once()
+    repo.revoke_all_for_user.assert_awaited_once_with("dummy_id")
+
+@pytest.mark.asyncio
+async def test_user_cache_read_through_and_invalidation(mock_db):
+    user_id = ObjectId()
+    users = MagicMock()
+    users.find_one = AsyncMock(side_effect=lambda query, **kwargs: (
+        {"_id": user_id, "email": "test@example.com", "password": "old"}
+        if query.get("email") == "test@example.com" else None
+    ))
+    users.find_one_and_update = AsyncMock(return_value={"_id": user_id, "email": "test@example.com"})
+    mock_db.__getitem__.return_value = users
+    cache = InMemoryUserCache(max_size=10, ttl_seconds=60, negative_ttl_seconds=60)
+    repo = UserRepository(mock_db, cache=cache)
+
+    assert (await repo.get_user_by_email("test@example.com"))["password"] == "old"
+    assert (await repo.get_user_by_id(str(user_id)))["email"] == "test@example.com"
+    assert await repo.get_user_by_email("unknown@example.com") is None
+    assert await repo.get_user_by_email("unknown@example.com") is None
+    assert users.find_one.await_count == 2
+
+    assert await repo.update_password(str(user_id), "new") is True
+    await repo.get_user_by_email("test@example.com")
+    assert users.find_one.await_count == 3
+    stats = cache.stats()
+    assert stats["hits"] == 1
+    assert stats["negative_hits"] == 1
+
+    class GetOnlyCache(UserCache):
+        async def get(self, key):
+            return None
+
+    with pytest.raises(TypeError):
+        GetOnlyCache()
+
+@pytest.mark.asyncio
+async def test_user_cache_skips_reads_that_raced_with_a_write():
+    db = FakeMongoClient()["cache_race"]
+    repo = UserRepository(db, cache=InMemoryUserCache(max_size=10, ttl_seconds=60, negative_ttl_seconds=60))
+    user = await repo.create_user("race@example.com", "old")
+    collection = db["users"]
+    find_one = collection.find_one
+    release = asyncio.Event()
+
+    async def slow_find_one(*args, **kwargs):
+        snapshot = await find_one(*args, **kwargs)
+        await release.wait()
+        return snapshot
+
+    collection.find_one = slow_find_one
+    fetch = asyncio.ensure_future(repo.get_user_by_email("race@example.com"))
+    await asyncio.sleep(0.01)
+    assert await repo.update_password(str(user["_id"]), "new") is True
+    release.set()
+    assert (await fetch)["password"] == "old"
+    collection.find_one = find_one
+
+    assert (await repo.get_user_by_email("race@example.com"))["password"] == "new"
+    assert (await repo.get_user_by_id(str(user["_id"])))["password"] == "new"
+    assert repo._invalidated_at == {}
+
+def test_mongo_pool_metrics_tracks_checkouts_and_waits():
+    address = ("localhost", 27017)
+    metrics = MongoPoolMetrics()
+    metrics.connection_created(monitoring.ConnectionCreatedEvent(address, 1))
+    metrics.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+    metrics.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1, 0.25))
+
+    stats = metrics.stats()
+    assert stats["connections_open"] == 1
+    assert stats["checked_out"] == 1
+    assert stats["waiting"] == 0
+    assert stats["checkout_wait_seconds_max"] == 0.25
+
+    metrics.connection_checked_in(monitoring.ConnectionCheckedInEvent(address, 1))
+    assert metrics.stats()["checked_out"] == 0
+
+def test_worker_processes_share_login_limits_and_hashing_threads(monkeypatch):
+    monkeypatch.setattr(Config, "LOGIN_IP_RATE_PER_MINUTE", 60)
+    monkeypatch.setattr(Config, "LOGIN_IP_BURST", 100)
+    monkeypatch.setattr(Config, "LOGIN_EMAIL_BURST", 10)
+    monkeypatch.setattr(Config, "HASHING_POOL_WORKERS", 8)
+    monkeypatch.setattr(Config, "HASHING_POOL_MAX_QUEUE", 64)
+
+    admission = build_login_admission(workers=4)
+    assert admission.ip_limiter.rate_per_second == pytest.approx(0.25)
+    assert admission.ip_limiter.burst == 25
+    assert admission.email_limiter.burst == 3
+    pool = build_hashing_pool(workers=4)
+    assert (pool.max_workers, pool.max_queue) == (2, 16)
+    assert build_hashing_pool(workers=16).max_workers == 1
+
+def test_login_admission_limits_per_email_and_ip():
+    controller = LoginAdmissionController(
+        email_limiter=TokenBucketLimiter(rate_per_minute=60, burst=2, max_keys=100),
+        ip_limiter=TokenBucketLimiter(rate_per_minute=60, burst=2, max_keys=100),
+    )
+    assert controller.admit("Victim@example.com", "10.0.0.1") == 0
+    assert controller.admit("victim@example.com", "10.0.0.2") == 0
+    assert controller.admit("victim@example.com", "10.0.0.3") == pytest.approx(1, abs=0.1)
+
+    assert controller.admit("a@example.com", "10.0.0.1") == 0
+    assert controller.admit("b@example.com", "10.0.0.1") > 0
+
+    stats = controller.stats()
+    assert stats["rejected_email"] == 1
+    assert stats["rejected_ip"] == 1
+    assert stats["allowed"] == 3
+
+def test_metrics_endpoint_reports_route_latency():
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router)
+    client = TestClient(app)
+
+    assert client.get("/health").status_code == 200
+    body = client.get("/metrics").text
+    assert 'http_requests_total{method="GET",route="/health",status="200"} 1' in body
+    assert 'http_request_duration_seconds_bucket{method="GET",route="/health",le="+Inf"} 1' in body
+    assert "# TYPE db_operation_duration_seconds histogram" in body
+
+def test_any_worker_serves_every_workers_metrics(tmp_path):
+    workers = []
+    for pid, count in (("101", 2), ("102", 3)):
+        registry = MetricsRegistry()
+        registry.counter("logins_total", "Logins.").labels().inc(count)
+        registry.histogram("login_seconds", "Login latency.", buckets=(0.1,)).labels().observe(0.05)
+        workers.append(MultiprocessMetrics(registry, str(tmp_path), interval_seconds=5, worker=pid))
+    workers[1].write_snapshot()
+    (tmp_path / "99.json").write_text("[]")
+    os.utime(tmp_path / "99.json", (0, 0))  # left behind by a worker that died
+
+    body = workers[0].render()
+    assert body.count("# TYPE logins_total counter") == 1
+    assert 'logins_total{worker="101"} 2' in body and 'logins_total{worker="102"} 3' in body
+    assert 'login_seconds_bucket{le="0.1",worker="102"} 1' in body
+    assert sorted(os.listdir(tmp_path)) == ["101.json", "102.json"]
+
+@pytest.mark.asyncio
+async def test_access_tokens_signed_with_key_ring(user_service, tmp_path):
+    for kid in ("old", "new"):
+        pem = ecdsa.SigningKey.generate(curve=ecdsa.NIST256p).to_pem().decode()
+        (tmp_path / f"{kid}.pem").write_text(pem)
+    ring_file = tmp_path / "keys.json"
+    ring_file.write_text(json.dumps({
+        "signing_kid": "new",
+        "keys": [
+            {"kid": "new", "alg": "ES256", "private_key_file": "new.pem"},
+            {"kid": "old", "alg": "ES256", "private_key_file": "old.pem"},
+        ],
+    }))
+    token_service = user_service.token_service
+    token_service.key_ring = KeyRing(str(ring_file))
+    token_service.token_cache.clear()
+    try:
+        token = await token_service.create_access_token("dummy_id")
+        assert token_service.decode_token(token, "access")["sub"] == "dummy_id"
+        assert {key["kid"] for key in token_service.key_ring.jwks()["keys"]} == {"new", "old"}
+        assert all("d" not in key for key in token_service.key_ring.jwks()["keys"])
+
+        # Dropping the key from the ring invalidates tokens that name it.
+        token_service.token_cache.clear()
+        ring_file.write_text(json.dumps({
+            "signing_kid": "old",
+            "keys": [{"kid": "old", "alg": "ES256", "private_key_file": "old.pem"}],
+        }))
+        token_service.key_ring.load()
+        with pytest.raises(HTTPException):
+            token_service.decode_token(token, "access")
+
+        # Introspection doesn't remember an unknown kid, and forgets failures once keys reload.
+        token_service.invalid_token_cache.clear()
+        assert token_service.introspect([token, "not-a-jwt"]) == [{"active": False}] * 2
+        assert token_service.invalid_token_cache.get(token, "invalid") is None
+        assert token_service.invalid_token_cache.get("not-a-jwt", "invalid") is not None
+        ring_file.write_text(json.dumps({
+            "signing_kid": "new",
+            "keys": [{"kid": "new", "alg": "ES256", "private_key_file": "new.pem"}],
+        }))
+        token_service.key_ring.load()
+        assert token_service.introspect([token])[0]["active"] is True
+        assert token_service.invalid_token_cache.stats()["size"] == 0
+    finally:
+        token_service.key_ring = None
+        token_service.token_cache.clear()
+
+def test_routes_use_services_from_app_container(user_service):
+    app = FastAPI()
+    app.include_router(router)
+    app.state.container = SimpleNamespace(user_service=user_service, token_service=user_service.token_service)
+
+    response = TestClient(app).post("/api/register/", json={"email": "new@example.com", "password": "SomePass123"})
+    assert response.status_code == 201
+    assert response.json()["user_id"] == "new_user_id"
+
+@pytest.mark.asyncio
+async def test_admin_user_listing_pages_and_streams():
+    db = FakeMongoClient()["listing"]
+    repo = UserRepository(db)
+    await repo.insert_many_users([{"email": f"user{i}@example.com", "password": "hash"} for i in range(5)])
+    app = FastAPI()
+    app.include_router(router)
+    app.state.container = SimpleNamespace(user_service=SimpleNamespace(user_repository=repo))
+    app.dependency_overrides[get_current_admin_user_id] = lambda: "admin_id"
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        first = (await client.get("/api/admin/users", params={"limit": 3})).json()
+        second = (await client.get("/api/admin/users", params={"limit": 3, "after": first["next_cursor"]})).json()
+        streamed = await client.get("/api/admin/users", params={"format": "ndjson"})
+        invalid = await client.get("/api/admin/users", params={"after": "not-an-id"})
+
+    emails = [user["email"] for user in first["users"] + second["users"]]
+    assert emails == [f"user{i}@example.com" for i in range(5)]
+    assert second["next_cursor"] is None
+    assert all("password" not in user for user in first["users"])
+    assert [json.loads(line)["email"] for line in streamed.text.splitlines()] == emails
+    assert invalid.status_code == 400
+
+def test_logging_handler_drops_when_full_and_rate_limits_templates():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=2))
+    handler.addFilter(RateLimitFilter(per_minute=3))
+    logger = logging.getLogger("tests.logging_pipeline")
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    try:
+        for i in range(10):
+            logger.info("Sent password reset to %s.", f"user{i}@example.com")
+        logger.info("Other event.")
+    finally:
+        logger.removeHandler(handler)
+
+    # Three "password reset" records pass the filter, the rest are suppressed; of the
+    # four admitted records only two fit in the queue.
+    assert handler.filters[0].suppressed == 7
+    assert handler.dropped == 2
+    record = handler.queue.get_nowait()
+    assert record.args == ("user0@example.com",)
+    assert record.getMessage() == "Sent password reset to user0@example.com."
+
+    # Warnings are only rate limited when they opt in, errors never, and the template table stays bounded.
+    limiter = RateLimitFilter(per_minute=1, max_keys=2)
+    warnings = [logging.LogRecord("auth", logging.WARNING, "", 0, "Pool saturated (%s).", (i,), None)
+                for i in range(5)]
+    assert all(limiter.filter(record) for record in warnings)
+    errors = [logging.LogRecord("auth", logging.ERROR, "", 0, "Failed (%s).", (i,), None) for i in range(5)]
+    for record in errors:
+        record.rate_limited = True
+    assert all(limiter.filter(record) for record in errors)
+    for i in range(5):
+        limiter.filter(logging.LogRecord("app", logging.INFO, "", 0, f"template {i}", (), None))
+    assert len(limiter._window) == 2
+
+def test_failed_login_flood_is_rate_limited(monkeypatch):
+    monkeypatch.setattr(Config, "LOGIN_RATE_LIMIT_ENABLED", "0")
+    emitted = []
+    handler = logging.Handler()
+    handler.emit = emitted.append
+    limiter = RateLimitFilter(per_minute=3)
+    handler.addFilter(limiter)
+    api_logger = logging.getLogger("src.router.api")
+    api_logger.addHandler(handler)
+    try:
+        app = create_app(mongo_client=FakeMongoClient(), database_name="login_flood")
+        with TestClient(app) as client:
+            for i in range(10):
+                credentials = {"email": f"victim{i}@example.com", "password": "WrongPass1"}
+                assert client.post("/api/login/", json=credentials).status_code == 401
+            api_logger.error("Unexpected error.", extra=RATE_LIMITED)
+    finally:
+        api_logger.removeHandler(handler)
+
+    failed = [record for record in emitted if record.msg == "Failed login attempt for %s."]
+    assert len(failed) == 3 and limiter.suppressed == 7
+    assert emitted[-1].levelno == logging.ERROR
+
+@pytest.mark.asyncio
+async def test_login_rehashes_outdated_password_in_background(user_service, monkeypatch):
+    monkeypatch.setattr(PasswordHasher, "rounds", 5)
+    old_hash = hashing_service._hash("TestPass123", 4)
+    user_service.user_repository.get_user_by_email.return_value = {
+        "_id": "dummy_id", "email": "test@example.com", "password": old_hash
+    }
+    user_service.user_repository.replace_password_hash.return_value = True
+
+    response = await user_service.login("test@example.com", "TestPass123")
+    assert response.status_code == 200
+    await asyncio.gather(*user_service._background_tasks)
+
+    user_id, replaced, new_hash = user_service.user_repository.replace_password_hash.await_args.args
+    assert (user_id, replaced) == ("dummy_id", old_hash)
+    assert hashing_service.hash_rounds(new_hash) == 5
+    assert PasswordHasher.check_password(new_hash, "TestPass123")
+    assert not PasswordHasher.needs_rehash(new_hash)
+
+@pytest.mark.asyncio
+async def test_readiness_probe_coalesces_and_caches_pings():
+    client = MagicMock()
+
+    async def ping(name):
+        await asyncio.sleep(0.01)
+        return {"ok": 1}
+    client.admin.command.side_effect = ping
+    probe = ReadinessProbe(client, ttl_seconds=60, timeout_seconds=1)
+
+    results = await asyncio.gather(*(probe.check() for _ in range(10)))
+    assert results == [(True, None)] * 10
+    assert await probe.check() == (True, None)
+    assert probe.pings == 1
+
+def test_startup_seeds_once_and_reports_ready(monkeypatch):
+    mongo_client = FakeMongoClient()
+    hash_calls = []
+    original = PasswordHasher.hash_password_async
+
+    async def counting_hash(password, pool=None):
+        hash_calls.append(password)
+        return await original(password, pool=pool)
+    monkeypatch.setattr(PasswordHasher, "hash_password_async", staticmethod(counting_hash))
+
+    for _ in range(2):
+        app = create_app(mongo_client=mongo_client, database_name="startup")
+        with TestClient(app) as client:
+            assert client.get("/ready").json() == {"status": "ready"}
+            assert "seed" in app.state.startup.phases
+
+    assert len(hash_calls) == 2
+    assert len(mongo_client["startup"]["users"]._documents) == 2
+
+@pytest.mark.asyncio
+async def test_revocations_propagate_between_workers_on_sync():
+    db = FakeMongoClient()["revocation"]
+    worker_a = RevocationService(RevocationRepository(db), bloom_capacity=100)
+    worker_b = RevocationService(RevocationRepository(db), bloom_capacity=100)
+    await worker_b.sync()
+    now = time.time()
+    token = {"sub": "user1", "jti": "jti-1", "iat": now - 10, "exp": now + 600}
+
+    await worker_a.revoke_token("jti-1", "user1", token["exp"])
+    assert worker_a.is_revoked(token)
+    assert not worker_b.is_revoked(token)
+    await worker_b.sync()
+    assert worker_b.is_revoked(token)
+    assert not worker_b.is_revoked({**token, "jti": "jti-2"})
+
+    await worker_a.revoke_user_tokens("user2")
+    await worker_b.sync()
+    assert worker_b.is_revoked({"sub": "user2", "jti": "jti-3", "iat": now - 1})
+    assert not worker_b.is_revoked({"sub": "user2", "jti": "jti-4", "iat": time.time() + 1})
+
+    worker_b.prune(now=now + 3600)
+    assert worker_b.stats()["revoked_tokens"] == 0 and worker_b.stats()["user_cutoffs"] == 0
+
+def test_logout_and_password_change_revoke_access_tokens(monkeypatch):
+    monkeypatch.setattr(Config, "LOGIN_RATE_LIMIT_ENABLED", "0")
+    app = create_app(mongo_client=FakeMongoClient(), database_name="logout")
+    with TestClient(app) as client:
+        credentials = {"email": Config.QUEST_EMAIL, "password": Config.QUEST_PASSWORD}
+        first = client.post("/api/login/", json=credentials).json()["access_token"]
+        second = client.post("/api/login/", json=credentials).json()["access_token"]
+        auth = lambda token: {"Authorization": f"Bearer {token}"}
+
+        assert client.post("/api/logout/", headers=auth(first)).status_code == 200
+        assert client.post("/api/logout/", headers=auth(first)).status_code == 401
+
+        response = client.post("/api/update_password/", headers=auth(second), json={
+            "current_password": Config.QUEST_PASSWORD, "new_password": "NewPass1234"
+        })
+        assert response.status_code == 200
+        assert client.post("/api/logout/", headers=auth(second)).status_code == 401
+        assert client.post("/api/logout/", headers=auth(response.json()["access_token"])).status_code == 200
+
+@pytest.mark.asyncio
+async def test_refresh_token_store_caps_sessions_and_reports_expiry_lag():
+    repo = TokenRepository(FakeMongoClient()["sessions"])
+    now = datetime.now(UTC)
+    for i in range(5):
+        await repo.save_refresh_token(f"token{i}", "user1", now + timedelta(days=7, minutes=i))
+    await repo.save_refresh_token("expired", "user2", now - timedelta(minutes=3))
+
+    assert await repo.evict_excess_sessions("user1", 3) == 2
+    assert await repo.evict_excess_sessions("user1", 3) == 0
+    assert await repo.get_refresh_token("token0") is None
+    assert await repo.get_refresh_token("token4") is not None
+
+    stats = await repo.store_stats()
+    assert stats["documents"] == 4 and stats["expired_documents"] == 1
+    assert 170 < stats["expiry_lag_seconds"] < 190
+
+    assert await repo.revoke_all_for_user("user1") == 3
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_lookups_and_survives_cancellation():
+    flights = SingleFlight()
+    calls = []
+
+    async def lookup(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"key": key}
+
+    cancelled = asyncio.ensure_future(flights.do("a", lookup, "a"))
+    waiters = [flights.do("a", lookup, "a") for _ in range(4)] + [flights.do("b", lookup, "b")]
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    results = await asyncio.gather(*waiters)
+
+    assert calls == ["a", "b"]
+    assert results[:4] == [{"key": "a"}] * 4
+    assert flights.stats() == {"calls": 6, "coalesced": 4, "in_flight": 0}
+
+    # The next call after completion queries again.
+    await flights.do("a", lookup, "a")
+    assert calls == ["a", "b", "a"]
+
+@pytest.mark.asyncio
+async def test_concurrent_refreshes_of_one_token_share_a_rotation():
+    client = FakeMongoClient(latency_ms=5)
+    token_service = TokenService(client["refresh"], token_repository=TokenRepository(client["refresh"]))
+    tokens = client["refresh"]["refresh_tokens"]
+    refresh_token = await token_service.create_refresh_token("user1")
+    other_session = await token_service.create_refresh_token("user1")
+
+    # A retry wave: the same token presented again while the first refresh is in flight.
+    results = await asyncio.gather(*(token_service.refresh_access_token(refresh_token) for _ in range(5)))
+    assert len({new_refresh for _, new_refresh in results}) == 1
+    assert token_service.refreshes.stats()["coalesced"] == 4
+    assert await tokens.count_documents({"user_id": "user1"}) == 2
+
+    # Once that rotation is done, presenting the old token again is reuse.
+    with pytest.raises(HTTPException):
+        await token_service.refresh_access_token(refresh_token)
+    assert await tokens.count_documents({"user_id": "user1"}) == 0
+    with pytest.raises(HTTPException):
+        await token_service.refresh_access_token(other_session)
+
+def _busy_handler(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+def test_profiling_middleware_collects_collapsed_stacks():
+    profiler = SamplingProfiler(ProfileStore(max_stacks=100), interval_seconds=0.002)
+    app = FastAPI()
+    app.include_router(router)
+    app.add_middleware(ProfilingMiddleware, profiler=profiler, sample_rate=1.0)
+    app.state.profiler = profiler
+    app.dependency_overrides[get_current_admin_user_id] = lambda: "admin_id"
+
+    @app.get("/busy")
+    async def busy():
+        _busy_handler(0.1)
+        return {}
+
+    client = TestClient(app)
+    assert client.get("/busy").status_code == 200
+    wall = client.get("/api/admin/profiles", params={"route": "GET /busy"}).text
+    cpu = client.get("/api/admin/profiles", params={"route": "GET /busy", "mode": "cpu"}).text
+
+    assert "tests.test_services._busy_handler" in wall
+    assert "tests.test_services._busy_handler" in cpu
+    assert all(line.startswith("loop;") for line in wall.splitlines())
+    assert client.delete("/api/admin/profiles").status_code == 204
+    assert client.get("/api/admin/profiles", params={"route": "GET /busy"}).text == ""
+
+def test_soft_delete_revokes_sessions_frees_email_and_is_purged(monkeypatch):
+    monkeypatch.setattr(Config, "LOGIN_RATE_LIMIT_ENABLED", "0")
+    mongo_client = FakeMongoClient()
+    users = mongo_client["soft_delete"]["users"]
+    legacy = {"email": "legacy@example.com", "password": PasswordHasher.hash_password("LegacyPass1")}
+    users._documents["legacy"] = {"_id": "legacy", **legacy}  # as written by the original version, with no indexes
+    app = create_app(mongo_client=mongo_client, database_name="soft_delete")
+    with TestClient(app) as client:
+        # Startup leaves documents of older versions alone and matches them with $ne.
+        assert "isDeleted" not in users._documents["legacy"] and "email_unique" in users._indexes
+        assert app.state.container.user_repository.live_filter == PRE_MIGRATION_LIVE_USER_FILTER
+        legacy_credentials = {"email": "legacy@example.com", "password": "LegacyPass1"}
+        assert client.post("/api/login/", json=legacy_credentials).status_code == 200
+        # The unflagged user's email is taken, though the partial index doesn't cover it.
+        assert client.post("/api/register/", json=legacy_credentials).status_code == 400
+        assert client.post("/api/register/", json={"email": Config.ADMIN_EMAIL, "password": "Admin1234"}).status_code == 400
+        # Deleting the admin would free its email, and admin rights, for anyone to register.
+        admin = client.post("/api/login/", json={"email": Config.ADMIN_EMAIL, "password": Config.ADMIN_PASSWORD})
+        admin_headers = {"Authorization": f"Bearer {admin.json()['access_token']}"}
+        assert client.delete("/api/users/me", headers=admin_headers).status_code == 403
+
+        credentials = {"email": "gone@example.com", "password": "GonePass123"}
+        assert client.post("/api/register/", json=credentials).status_code == 201
+        token = client.post("/api/login/", json=credentials).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        assert client.delete("/api/users/me", headers=headers).status_code == 204
+
+        assert client.delete("/api/users/me", headers=headers).status_code == 401
+        assert client.post("/api/login/", json=credentials).status_code == 401
+        # The old index still covers deleted users until the migration drops it.
+        assert client.post("/api/register/", json=credentials).status_code == 400
+
+        assert asyncio.run(UserRepository(mongo_client["soft_delete"]).migrate_soft_delete()) == 1
+        assert users._documents["legacy"]["isDeleted"] is False and "email_unique" not in users._indexes
+        assert client.post("/api/register/", json=credentials).status_code == 201
+
+        job = UserPurgeJob(app.state.container.user_repository, timedelta(0), 3600, 1, 0)
+        assert asyncio.run(job.run_once()) == 1
+        assert [user["email"] for user in users._documents.values()].count("gone@example.com") == 1
+
+    with TestClient(app):
+        assert app.state.container.user_repository.live_filter == LIVE_USER_FILTER
+
+    fresh = create_app(mongo_client=FakeMongoClient(), database_name="fresh")
+    with TestClient(fresh):
+        assert fresh.state.container.user_repository.live_filter == LIVE_USER_FILTER
+
+@pytest.mark.asyncio
+async def test_batch_introspection_reports_each_token_and_cache_lifetime(user_service, monkeypatch):
+    token_service = user_service.token_service
+    token_service.revocation_service = RevocationService(RevocationRepository(FakeMongoClient()["introspect"]))
+    token_service.invalid_token_cache.clear()
+    hits = token_service.invalid_token_cache.stats()["hits"]
+    valid = await token_service.create_access_token("dummy_id")
+    revoked = await token_service.create_access_token("dummy_id")
+    revoked_payload = token_service.decode_token(revoked, "access")
+    await token_service.revoke_access_token(revoked_payload)
+
+    app = FastAPI()
+    app.include_router(router)
+    app.state.container = SimpleNamespace(token_service=token_service)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+        body = {"tokens": [valid, "not-a-jwt", revoked]}
+        unconfigured = await client.post("/api/introspect/", json=body)
+        monkeypatch.setattr(Config, "INTROSPECTION_API_KEY", "gateway-key")
+        unauthorized = await client.post("/api/introspect/", json=body)
+        response = await client.post("/api/introspect/", json=body, headers={"X-API-Key": "gateway-key"})
+        await client.post("/api/introspect/", json=body, headers={"X-API-Key": "gateway-key"})
+
+    assert unconfigured.status_code == 503
+    assert unauthorized.status_code == 401
+    results = response.json()["results"]
+    assert results[0]["active"] is True and results[0]["sub"] == "dummy_id" and results[0]["type"] == "access"
+    assert results[1] == {"active": False} and results[2] == {"active": False}
+    assert response.headers["Cache-Control"] == f"private, max-age={Config.INTROSPECTION_MAX_CACHE_SECONDS}"
+    assert token_service.invalid_token_cache.stats()["hits"] - hits == 1  # only the malformed token
+
+@pytest.mark.asyncio
+async def test_secondary_reads_follow_this_workers_writes():
+    client = FakeMongoClient()
+    routing = OperationRouting(
+        read_preferences={"get_user_by_id": read_preference("secondaryPreferred", 90)},
+        write_concerns={"update_password": write_concern("majority", 5000)},
+    )
+    repo = UserRepository(client["routing"], cache=NullUserCache(), routing=routing)
+    assert routing.write_concerns["update_password"].document == {"w": "majority", "wtimeout": 5000}
+    assert routing.read_preferences["get_user_by_id"].max_staleness == 90
+    with pytest.raises(ValueError):
+        read_preference("secondaryOnly")
+
+    user = await repo.create_user("causal@example.com", "hash")
+    assert client.sessions == 1
+    read_session = None
+    async with routing.read_session(client, "get_user_by_id", repo._id_key(user["_id"])) as session:
+        read_session = session
+    assert read_session.advanced_to.time == 1  # the create_user write
+
+    assert (await repo.get_user_by_id(str(user["_id"])))["email"] == "causal@example.com"
+    assert await repo.get_user_by_id(str(ObjectId())) is None
+    assert routing.stats()["causal_reads"] == 2  # only reads of written keys join a session
+
+    primary_client = FakeMongoClient()
+    primary_repo = UserRepository(primary_client["routing"], cache=NullUserCache(), routing=OperationRouting())
+    created = await primary_repo.create_user("primary@example.com", "hash")
+    await primary_repo.get_user_by_id(str(created["_id"]))
+    assert primary_client.sessions == 0
+
+@pytest.mark.asyncio
+async def test_refresh_token_write_buffer_serves_and_flushes_tokens():
+    client = FakeMongoClient(latency_ms=5)
+    repo = TokenRepository(client["buffer"], write_behind=True)
+    buffer = repo.write_buffer
+    buffer.interval_seconds = 0.01
+    collection = client["buffer"]["refresh_tokens"]
+    expires_at = datetime.now(UTC) + timedelta(days=1)
+
+    await repo.save_refresh_token("early", "u1", expires_at - timedelta(minutes=1))  # not started: written synchronously
+    assert await collection.count_documents({"_id": "early"}) == 1
+    buffer.start()
+    for token_id in ("a", "b", "c"):
+        await repo.save_refresh_token(token_id, "u1", expires_at)
+    await repo.save_refresh_token("d", "u2", expires_at)
+    assert await collection.count_documents({}) == 1
+    assert (await repo.get_refresh_token("a"))["user_id"] == "u1"
+    assert (await repo.consume_refresh_token("a", "u1"))["_id"] == "a"
+
+    # Tokens in a flush that is still running are consumed exactly once.
+    flush = asyncio.ensure_future(buffer.flush())
+    await asyncio.sleep(0)
+    consumed = await asyncio.gather(repo.consume_refresh_token("b", "u1"), repo.consume_refresh_token("b", "u1"))
+    await flush
+    assert sorted(token is None for token in consumed) == [False, True]
+    assert await collection.count_documents({"_id": {"$in": ["a", "b"]}}) == 0
+    assert await collection.count_documents({"_id": {"$in": ["c", "d"]}}) == 2
+
+    # The session cap counts buffered tokens and drops the oldest, wherever they are.
+    buffer.interval_seconds = 60
+    await asyncio.sleep(0.02)  # let the flusher settle into the longer wait
+    await repo.save_refresh_token("e", "u1", expires_at + timedelta(minutes=1))
+    assert await repo.evict_excess_sessions("u1", 3) == 0
+    await repo.save_refresh_token("g", "u1", expires_at + timedelta(minutes=2))
+    assert await repo.evict_excess_sessions("u1", 3) == 1
+    assert await collection.count_documents({"_id": "early"}) == 0
+
+    assert await repo.revoke_all_for_user("u1") == 3  # c and the buffered e and g
+    await repo.save_refresh_token("f", "u2", expires_at)
+    await buffer.stop()
+    assert await collection.count_documents({"_id": "f"}) == 1
+    stats = buffer.stats()
+    assert stats["pending"] == 0 and stats["consumed_before_flush"] == 1 and stats["fallbacks"] == 1
+    assert stats["flushed"] == stats["buffered"] - 3  # a consumed, e and g revoked before their flush
+
+    # A token missing from both the buffer and the collection is gone, without waiting for another worker.
+    assert await repo.consume_refresh_token("a", "u1") is None
+
+def test_refresh_token_write_behind_needs_a_single_worker(monkeypatch):
+    monkeypatch.setattr(Config, "REFRESH_TOKEN_WRITE_BEHIND_ENABLED", "1")
+    assert refresh_token_write_behind_enabled(workers=1)
+    assert not refresh_token_write_behind_enabled(workers=4)
+    monkeypatch.setattr(Config, "WEB_WORKERS", 2)
+    assert ServiceContainer(FakeMongoClient()["workers"]).token_repository.write_buffer is None
+
+def test_user_cache_needs_a_single_worker(monkeypatch):
+    monkeypatch.setattr(Config, "USER_CACHE_ENABLED", "1")
+    assert isinstance(build_user_cache(workers=1), InMemoryUserCache)
+    # Another worker's cache would keep accepting a changed or deleted user's old password.
+    assert isinstance(build_user_cache(workers=4), NullUserCache)
+    monkeypatch.setattr(Config, "WEB_WORKERS", 2)
+    assert isinstance(build_user_cache(), NullUserCache)
+
+@pytest.mark.asyncio
+async def test_login_admission_keys_on_client_behind_trusted_proxy(monkeypatch):
+    monkeypatch.setattr(Config, "TRUSTED_PROXY_IPS", "10.0.0.0/8")
+    mongo_client = FakeMongoClient()
+    app = create_app(mongo_client)
+    login_admission = LoginAdmissionController(
+        email_limiter=TokenBucketLimiter(rate_per_minute=60, burst=10, max_keys=100),
+        ip_limiter=TokenBucketLimiter(rate_per_minute=0, burst=1, max_keys=100),
+    )
+    app.state.container = ServiceContainer(app.state.db, login_admission=login_admission)
+
+    async def login(peer, email, forwarded_for=None):
+        headers = {"X-Forwarded-For": forwarded_for} if forwarded_for else {}
+        transport = httpx.ASGITransport(app=app, client=(peer, 1234))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/login/", json={"email": email, "password": "Password1"}, headers=headers)
+        return response.status_code
+
+    # Two clients behind the same load balancer get their own budgets...
+    assert await login("10.0.0.2", "a@example.com", "203.0.113.1") == 401
+    assert await login("10.0.0.2", "b@example.com", "203.0.113.2") == 401
+    assert await login("10.0.0.2", "c@example.com", "198.51.100.9, 203.0.113.1") == 429
+    # ...while an untrusted peer can't pick its own key by sending the header.
+    assert await login("192.0.2.7", "d@example.com", "203.0.113.3") == 401
+    assert await login("192.0.2.7", "e@example.com", "203.0.113.4") == 429